@@ -0,0 +1,175 @@
+"""
+ETL 基准：在不同数据规模下对各阶段计时并记录峰值内存
+
+阶段（与 README 中的流水线顺序一致）：
+    noaa_stream  : noaa_extract.stream_us_stations（GSOD tar.gz -> NOAA 数据集）
+    calc_aqi     : calc_aqi.add_aqi_column（OpenAQ 数据集 -> 带 AQI 的数据集）
+    merge        : merge.add_nearby_max_aqi（NOAA x AQI，同日 50 km 内最大 AQI）
+    merge_ooc    : 同上，out_of_core=True（逐日期分区流式处理，峰值内存应不随规模增长）
+    frshtt_flags : merge.add_frshtt_flags（展开 FRSHTT、缺测码置 NaN）
+
+输入由 benchmarks/synthetic.py 生成并按规模缓存。每个阶段在全新的子进程中运行，
+峰值内存（ru_maxrss）只反映该阶段本身。在仓库根目录运行：
+    python -m benchmarks.bench_etl --sizes 10000 100000 1000000
+    python -m benchmarks.bench_etl --sizes 100000000 --stages calc_aqi merge --archive-rows 0
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.common import rss_mb, run_metadata, save_results
+from benchmarks.synthetic import gsod_archive, write_noaa_dataset, write_openaq_dataset
+
+STAGES = ["noaa_stream", "calc_aqi", "merge", "merge_ooc", "frshtt_flags"]
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "aqi_bench_etl")
+
+
+def prepare_inputs(workdir: str, rows: int, archive_rows: int, regenerate: bool):
+    """生成（或复用）该规模下的输入数据，返回各路径"""
+    paths = {
+        "archive": os.path.join(workdir, "gsod.tar.gz"),
+        "noaa": os.path.join(workdir, "noaa.parquet"),
+        "openaq": os.path.join(workdir, "openaq.parquet"),
+        "aqi": os.path.join(workdir, "aqi.parquet"),
+        "merged": os.path.join(workdir, "merged.parquet"),
+        "flags": os.path.join(workdir, "merged_flags.parquet"),
+    }
+    if regenerate:
+        shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir, exist_ok=True)
+
+    if not os.path.exists(paths["noaa"]):
+        print(f"  generating {rows:,} NOAA rows...")
+        write_noaa_dataset(paths["noaa"], rows)
+    if not os.path.exists(paths["openaq"]):
+        print(f"  generating {rows:,} OpenAQ rows...")
+        # 传感器集中在约一半的气象站附近，merge 既有匹配也有丢弃
+        write_openaq_dataset(paths["openaq"], rows, near_stations=max(1, rows // 730))
+    if archive_rows and not os.path.exists(paths["archive"]):
+        print(f"  generating GSOD archive with {archive_rows:,} rows...")
+        gsod_archive(paths["archive"], archive_rows)
+    return paths
+
+
+def _run_stage(stage: str, paths: dict, merge_jobs: int) -> dict:
+    """在子进程中执行一个阶段，返回耗时与内存"""
+    from src.etl.calc_aqi import add_aqi_column
+    from src.etl.merge import add_frshtt_flags, add_nearby_max_aqi
+    from src.etl.noaa_extract import stream_us_stations
+    from src.etl.storage import open_dataset
+
+    baseline = rss_mb()
+    rows_in = None
+    start = time.perf_counter()
+    if stage == "noaa_stream":
+        # 写到独立路径，不覆盖 merge 使用的 NOAA 数据集
+        rows_in = stream_us_stations(paths["archive"], paths["noaa"] + ".streamed")
+    elif stage == "calc_aqi":
+        add_aqi_column(paths["openaq"], paths["aqi"])
+    elif stage == "merge":
+        add_nearby_max_aqi(
+            paths["noaa"], paths["aqi"], paths["merged"], n_jobs=merge_jobs
+        )
+    elif stage == "merge_ooc":
+        add_nearby_max_aqi(
+            paths["noaa"],
+            paths["aqi"],
+            paths["merged"] + ".ooc",
+            n_jobs=merge_jobs,
+            out_of_core=True,
+        )
+    elif stage == "frshtt_flags":
+        add_frshtt_flags(paths["merged"], paths["flags"])
+    seconds = time.perf_counter() - start
+
+    if rows_in is None:
+        source = {
+            "calc_aqi": "openaq",
+            "merge": "noaa",
+            "merge_ooc": "noaa",
+            "frshtt_flags": "merged",
+        }[stage]
+        rows_in = open_dataset(paths[source]).count_rows()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "seconds": round(seconds, 3),
+        "rows_in": int(rows_in),
+        "rows_per_s": round(rows_in / seconds, 1) if seconds else None,
+        "baseline_rss_mb": baseline,
+        "peak_rss_mb": round(peak / unit, 1),
+        # merge 在 n_jobs > 1 时由进程池计算，单个工作进程的峰值
+        "children_peak_rss_mb": round(children / unit, 1) if children else None,
+    }
+
+
+def run_stage(stage: str, paths: dict, merge_jobs: int) -> dict:
+    # spawn：子进程不继承父进程已占用的内存，峰值只属于该阶段
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(_run_stage, stage, paths, merge_jobs).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument(
+        "--archive-rows",
+        type=int,
+        default=5_000_000,
+        help="cap on rows in the synthetic GSOD archive (CSV text is large); "
+        "0 skips noaa_stream",
+    )
+    parser.add_argument("--merge-jobs", type=int, default=1)
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    parser.add_argument("--regenerate", action="store_true")
+    parser.add_argument("--out", default="results/bench/etl.json")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.sizes:
+        print(f"\n=== {rows:,} rows ===")
+        archive_rows = min(rows, args.archive_rows)
+        paths = prepare_inputs(
+            os.path.join(args.workdir, str(rows)),
+            rows,
+            archive_rows if "noaa_stream" in args.stages else 0,
+            args.regenerate,
+        )
+        for stage in STAGES:
+            if stage not in args.stages:
+                continue
+            if stage == "noaa_stream" and not archive_rows:
+                continue
+            r = {"stage": stage, "size": rows} | run_stage(
+                stage, paths, args.merge_jobs
+            )
+            results.append(r)
+
+    print(
+        f"\n{'stage':<14}{'size':>12}{'rows in':>12}{'seconds':>10}"
+        f"{'rows/s':>12}{'peak MB':>10}{'base MB':>10}"
+    )
+    for r in results:
+        print(
+            f"{r['stage']:<14}{r['size']:>12,}{r['rows_in']:>12,}{r['seconds']:>10.2f}"
+            f"{r['rows_per_s']:>12,.0f}{r['peak_rss_mb']:>10.0f}"
+            f"{r['baseline_rss_mb']:>10.0f}"
+        )
+    save_results(args.out, run_metadata(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+快速模型基准：蒸馏后的单模型 vs 完整集成的单行延迟、批量吞吐与验证集 RMSE
+
+需要先训练并导出快速模型：
+    python -m src.train --fast          # 或对已有模型：python -m src.train --fast-only
+    python -m benchmarks.bench_fast_model
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from autogluon.tabular import TabularPredictor
+
+from src.etl.storage import read_table
+from src.model import FAST_MODEL_PATH, MODEL_PATH
+from src.train import FEATURE_COLS, LABEL_COL
+
+VAL_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "data/processed/val_dataset.parquet"
+)
+
+
+def measure(predictor, val_df, n_single: int, repeats: int) -> dict:
+    X, y = val_df[FEATURE_COLS], val_df[LABEL_COL].to_numpy()
+    predictor.predict(X.iloc[:1])  # 预热
+
+    # 单行延迟：逐行调用，模拟在线请求
+    latencies = []
+    for i in range(min(n_single, len(X))):
+        start = time.perf_counter()
+        predictor.predict(X.iloc[i : i + 1])
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+
+    # 整批吞吐
+    start = time.perf_counter()
+    for _ in range(repeats):
+        y_pred = predictor.predict(X).to_numpy()
+    batch_time = (time.perf_counter() - start) / repeats
+
+    return {
+        "p50_ms": np.percentile(latencies, 50),
+        "p99_ms": np.percentile(latencies, 99),
+        "rows_per_s": len(X) / batch_time,
+        "rmse": float(np.sqrt(np.mean((y - y_pred) ** 2))),
+        "pred": y_pred,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--val-path", default=VAL_PATH)
+    parser.add_argument("--single-rows", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    val_df = read_table(args.val_path, columns=FEATURE_COLS + [LABEL_COL])
+    full = TabularPredictor.load(MODEL_PATH)
+    fast = TabularPredictor.load(FAST_MODEL_PATH)
+    fast.persist()
+
+    results = {
+        "full ensemble": measure(full, val_df, args.single_rows, args.repeats),
+        "fast model": measure(fast, val_df, args.single_rows, args.repeats),
+    }
+
+    print(f"validation rows: {len(val_df)}")
+    print(f"{'model':<16}{'p50 ms':>10}{'p99 ms':>10}{'rows/s':>12}{'RMSE':>10}")
+    for name, r in results.items():
+        print(
+            f"{name:<16}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+            f"{r['rows_per_s']:>12.0f}{r['rmse']:>10.3f}"
+        )
+
+    full_r, fast_r = results["full ensemble"], results["fast model"]
+    gap = np.sqrt(np.mean((full_r["pred"] - fast_r["pred"]) ** 2))
+    print(
+        f"\nper-row speedup: {full_r['p50_ms'] / fast_r['p50_ms']:.1f}x, "
+        f"RMSE change: {fast_r['rmse'] / full_r['rmse'] - 1:+.1%}, "
+        f"RMSE between the two models' predictions: {gap:.3f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+推理延迟基准：进程内 AQIPredictor 与 HTTP /predict 的吞吐、p50/p95/p99 延迟与内存
+
+使用合成数据训练的小模型（首次运行时训练，之后复用），不依赖 data/ 下的真实数据。
+在仓库根目录运行：
+    python -m benchmarks.bench_inference --out results/bench/inference.json
+    python -m benchmarks.bench_inference --modes http --workers 4 --concurrency 8 32
+    python -m benchmarks.bench_inference --compare results/bench/baseline.json
+
+--compare 时 p99 上升或吞吐下降超过 --threshold 即以退出码 1 结束，可用于发布前检查。
+结果缓存在基准中关闭（AQI_CACHE_SIZE=0），测到的是真实推理开销。
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.common import (
+    compare_results,
+    latency_stats,
+    prepare_fixtures,
+    rss_mb,
+    run_metadata,
+    save_results,
+    wait_until_ready,
+)
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..")
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "aqi_bench")
+
+
+def make_batches(store, rows: int, batch_size: int, seed: int = 0) -> list:
+    """从特征存储覆盖的城市与日期中抽样，切成每批 batch_size 个 (city, date)"""
+    rng = np.random.default_rng(seed)
+    cities = sorted(store.cities)
+    dates = [str(d) for d in store.dates]
+    pairs = [
+        (cities[rng.integers(len(cities))], dates[rng.integers(len(dates))])
+        for _ in range(rows)
+    ]
+    return [pairs[i : i + batch_size] for i in range(0, rows, batch_size)]
+
+
+def drive(call, batches: list, concurrency: int):
+    """
+    concurrency 个线程并发、各自顺序调用 call(batch)（闭环负载），
+    返回 (总耗时, 每次调用耗时, 失败次数)
+    """
+    pending = iter(batches)
+    lock = threading.Lock()
+    latencies, errors = [], []
+
+    def worker():
+        while True:
+            with lock:
+                batch = next(pending, None)
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                call(batch)
+            except Exception as e:
+                errors.append(e)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return time.perf_counter() - start, latencies, len(errors)
+
+
+def process_tree_memory_mb(pid: int):
+    """服务进程及其 worker 的 PSS 之和（MB），共享的写时复制页只按比例计入一次"""
+    pids = [pid]
+    children_file = f"/proc/{pid}/task/{pid}/children"
+    if os.path.exists(children_file):
+        with open(children_file) as f:
+            pids += [int(p) for p in f.read().split()]
+    total = 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/smaps_rollup") as f:
+                total += next(int(l.split()[1]) for l in f if l.startswith("Pss:"))
+        except (OSError, StopIteration):
+            return None
+    return round(total / 1024, 1)
+
+
+def bench_inprocess(fixtures, args) -> list:
+    # 模型路径在 src.model 导入时读取，必须先设置环境变量
+    os.environ["AQI_MODEL_PATH"] = fixtures["model_path"]
+    from src.cache import PredictionCache
+    from src.feature_store import FeatureStore
+    from src.model import AQIPredictor
+
+    predictor = AQIPredictor(
+        feature_store=FeatureStore.from_path(fixtures["noaa_path"]),
+        cache=PredictionCache(max_size=0),
+    )
+
+    def call(batch):
+        if len(batch) == 1:
+            predictor.predict(*batch[0])
+        else:
+            predictor.predict_batch(batch)
+
+    results = []
+    for batch_size in args.batch_sizes:
+        batches = make_batches(predictor.feature_store, args.rows, batch_size)
+        drive(call, batches[:5], 1)  # 预热
+        for concurrency in args.concurrency:
+            elapsed, latencies, errors = drive(call, batches, concurrency)
+            results.append(
+                _result("inprocess", concurrency, batch_size, elapsed, latencies)
+                | {"errors": errors, "memory_mb": rss_mb()}
+            )
+            _print_row(results[-1])
+    return results
+
+
+def bench_http(fixtures, args) -> list:
+    import requests
+
+    from src.feature_store import FeatureStore
+
+    store = FeatureStore.from_path(fixtures["noaa_path"])
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(
+        os.environ,
+        AQI_MODEL_PATH=fixtures["model_path"],
+        AQI_NOAA_PATH=fixtures["noaa_path"],
+        AQI_CACHE_SIZE="0",
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "src.serve",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(args.port),
+            "--workers",
+            str(args.workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=REPO_ROOT,
+        env=env,
+    )
+    local = threading.local()
+
+    def call(batch):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        if len(batch) == 1:
+            city, date = batch[0]
+            resp = session.post(
+                f"{base_url}/predict", json={"city": city, "date": date}
+            )
+        else:
+            resp = session.post(
+                f"{base_url}/predict/batch",
+                json=[{"city": city, "date": date} for city, date in batch],
+            )
+        resp.raise_for_status()
+
+    results = []
+    try:
+        wait_until_ready(f"{base_url}/ready")
+        for batch_size in args.batch_sizes:
+            batches = make_batches(store, args.rows, batch_size)
+            drive(call, batches[:5], 1)  # 预热
+            for concurrency in args.concurrency:
+                elapsed, latencies, errors = drive(call, batches, concurrency)
+                results.append(
+                    _result("http", concurrency, batch_size, elapsed, latencies)
+                    | {
+                        "errors": errors,
+                        "workers": args.workers,
+                        "memory_mb": process_tree_memory_mb(server.pid),
+                    }
+                )
+                _print_row(results[-1])
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return results
+
+
+def _result(mode, concurrency, batch_size, elapsed, latencies) -> dict:
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+    } | latency_stats(latencies, elapsed, rows=len(latencies) * batch_size)
+
+
+def _print_row(r: dict) -> None:
+    print(
+        f"{r['mode']:<10}{r['concurrency']:>6}{r['batch_size']:>7}"
+        f"{r['throughput_rows_per_s']:>11.0f}{r['p50_ms']:>9.2f}"
+        f"{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+        f"{r['memory_mb'] if r['memory_mb'] is not None else '-':>10}"
+        f"{r['errors']:>8}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=["inprocess", "http"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32])
+    parser.add_argument("--rows", type=int, default=2000, help="rows per case")
+    parser.add_argument("--workers", type=int, default=1, help="HTTP server workers")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    parser.add_argument("--retrain", action="store_true")
+    parser.add_argument("--out", default="results/bench/inference.json")
+    parser.add_argument("--compare", help="baseline JSON from a previous run")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    fixtures = prepare_fixtures(args.workdir, retrain=args.retrain)
+
+    print(
+        f"{'mode':<10}{'conc':>6}{'batch':>7}{'rows/s':>11}{'p50 ms':>9}"
+        f"{'p95 ms':>9}{'p99 ms':>9}{'mem MB':>10}{'errors':>8}"
+    )
+    results = []
+    if "inprocess" in args.modes:
+        results += bench_inprocess(fixtures, args)
+    if "http" in args.modes:
+        results += bench_http(fixtures, args)
+
+    save_results(args.out, run_metadata(args), results)
+    if args.compare and compare_results(args.compare, results, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
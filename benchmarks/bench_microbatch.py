@@ -0,0 +1,132 @@
+"""
+微批调度器基准：不同 (批大小, 等待窗口) 与并发度下的吞吐与 p50 / p99 延迟
+
+需要已训练的模型（data/ag_models）与处理后的 NOAA 数据。在仓库根目录运行：
+    python -m benchmarks.bench_microbatch
+    python -m benchmarks.bench_microbatch --concurrency 1 16 64 --batch-sizes 1 32 --waits 0 5
+
+"direct" 一行为原实现：在事件循环里逐条同步调用 predictor.predict。
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+
+import numpy as np
+
+from src.batching import MicroBatcher
+from src.feature_store import NOAA_PATH, FeatureStore
+from src.model import AQIPredictor
+
+
+def make_requests(store: FeatureStore, n: int, seed: int = 0) -> list:
+    """从特征存储中有气象站覆盖的城市和已有日期里随机抽取 n 个 (city, date)"""
+    rng = np.random.default_rng(seed)
+    cities = []
+    for city in sorted(store.cities):
+        try:
+            store.lookup_city(city)
+        except KeyError:
+            continue
+        cities.append(city)
+    dates = [str(d) for d in store.dates]
+    return [
+        (cities[rng.integers(len(cities))], dates[rng.integers(len(dates))])
+        for _ in range(n)
+    ]
+
+
+async def _drive(call, requests: list, concurrency: int) -> tuple:
+    """concurrency 个客户端并发、各自顺序发送请求，返回 (总耗时, 每条延迟)"""
+    queue = iter(requests)
+    latencies = []
+
+    async def client():
+        for item in queue:
+            start = time.perf_counter()
+            try:
+                await call(item)
+            except Exception:
+                pass
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, np.array(latencies)
+
+
+async def run_direct(predictor: AQIPredictor, requests: list, concurrency: int):
+    async def call(item):
+        # 让出一次事件循环，模拟多个请求处理协程交替执行
+        await asyncio.sleep(0)
+        return predictor.predict(*item)
+
+    elapsed, latencies = await _drive(call, requests, concurrency)
+    return elapsed, latencies, 1.0
+
+
+async def run_batched(
+    predictor: AQIPredictor,
+    requests: list,
+    concurrency: int,
+    max_batch_size: int,
+    max_wait_ms: float,
+):
+    calls = 0
+
+    def predict_batch(items, return_exceptions):
+        nonlocal calls
+        calls += 1
+        return predictor.predict_batch(items, return_exceptions)
+
+    batcher = MicroBatcher(predict_batch, max_batch_size, max_wait_ms)
+    await batcher.start()
+    try:
+        elapsed, latencies = await _drive(batcher.submit, requests, concurrency)
+    finally:
+        await batcher.stop()
+    return elapsed, latencies, len(requests) / max(calls, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--noaa-path", default=NOAA_PATH)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--waits", type=float, nargs="+", default=[0, 2, 5, 10])
+    args = parser.parse_args()
+
+    predictor = AQIPredictor(FeatureStore.from_path(args.noaa_path))
+    requests = make_requests(predictor.feature_store, args.requests)
+    predictor.predict_batch(requests[:10])  # 预热
+
+    print(
+        f"{'mode':<18}{'conc':>6}{'req/s':>10}{'p50 ms':>10}"
+        f"{'p99 ms':>10}{'avg batch':>11}"
+    )
+
+    def report(mode, concurrency, result):
+        elapsed, latencies, avg_batch = result
+        p50, p99 = np.percentile(latencies * 1000, [50, 99])
+        print(
+            f"{mode:<18}{concurrency:>6}{len(latencies) / elapsed:>10.0f}"
+            f"{p50:>10.2f}{p99:>10.2f}{avg_batch:>11.1f}"
+        )
+
+    for concurrency in args.concurrency:
+        report(
+            "direct",
+            concurrency,
+            asyncio.run(run_direct(predictor, requests, concurrency)),
+        )
+        for size, wait in itertools.product(args.batch_sizes, args.waits):
+            result = asyncio.run(
+                run_batched(predictor, requests, concurrency, size, wait)
+            )
+            report(f"batch={size} w={wait:g}ms", concurrency, result)
+
+
+if __name__ == "__main__":
+    main()
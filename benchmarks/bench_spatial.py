@@ -0,0 +1,110 @@
+"""
+空间近邻基准：merge 的「同日 50 km 内最大 AQI」在不同索引下的耗时
+
+    per_date : 每天用当天的传感器坐标重建 BallTree（原有做法）
+    balltree : 对去重后的传感器位置建一次 BallTree，各日期共用预先算好的邻居列表
+    grid     : 同上，索引换成经纬度网格哈希
+
+只计近邻检索本身（不含读写），数据由 benchmarks/synthetic.py 在内存中生成，
+并检查三种方式的结果完全一致。在仓库根目录运行：
+    python -m benchmarks.bench_spatial --sizes 100000 1000000 --days 365
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import run_metadata, save_results
+from benchmarks.synthetic import noaa_chunks, openaq_chunks
+from src.etl.merge import nearby_matcher
+from src.etl.spatial import SPATIAL_INDEXES
+
+INDEXES = ["per_date", *SPATIAL_INDEXES]
+
+
+def day_groups(rows: int, days: int):
+    """生成 NOAA / 传感器数据，按日期分组为 [(站点坐标, 传感器坐标, AQI), ...]"""
+    noaa = pd.concat(noaa_chunks(rows, days=days), ignore_index=True)
+    sensors = pd.concat(
+        openaq_chunks(rows, near_stations=max(1, rows // days // 2), days=days),
+        ignore_index=True,
+    )
+    # 合成数据没有 AQI 列，用读数本身代替（只影响取最大值的数值）
+    sensors["day"] = pd.to_datetime(sensors["period.datetimeFrom.utc"]).dt.date
+    noaa["day"] = pd.to_datetime(noaa["DATE"]).dt.date
+    b_groups = sensors.groupby("day").indices
+    groups = []
+    for day, idx in noaa.groupby("day").indices.items():
+        if day not in b_groups:
+            continue
+        b = sensors.iloc[b_groups[day]]
+        groups.append(
+            (
+                noaa.iloc[idx][["LATITUDE", "LONGITUDE"]].to_numpy(dtype=float),
+                b[["latitude", "longitude"]].to_numpy(dtype=float),
+                b["value"].to_numpy(dtype=float),
+            )
+        )
+    a_all = noaa[["LATITUDE", "LONGITUDE"]].to_numpy(dtype=float)
+    b_all = sensors[["latitude", "longitude"]].to_numpy(dtype=float)
+    return groups, a_all, b_all
+
+
+def run_index(index: str, groups, a_all, b_all, dist_km: float):
+    start = time.perf_counter()
+    match = nearby_matcher(index, dist_km, a_all, b_all)
+    build = time.perf_counter() - start
+    results = [match(a, b, aqi) for a, b, aqi in groups]
+    return build, time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--dist-km", type=float, default=50)
+    parser.add_argument("--indexes", nargs="+", choices=INDEXES, default=INDEXES)
+    parser.add_argument("--out", default="results/bench/spatial.json")
+    args = parser.parse_args()
+
+    print(
+        f"{'index':<10}{'rows':>12}{'days':>6}{'sites':>8}"
+        f"{'build s':>10}{'total s':>10}{'ms/day':>9}{'speedup':>9}{'same':>6}"
+    )
+    results = []
+    for rows in args.sizes:
+        groups, a_all, b_all = day_groups(rows, args.days)
+        n_sites = len(np.unique(b_all, axis=0))
+        reference, base_total = None, None
+        for index in args.indexes:
+            build, total, out = run_index(index, groups, a_all, b_all, args.dist_km)
+            if reference is None:
+                reference, base_total = out, total
+            same = all(
+                np.array_equal(m1, m2) and np.array_equal(v1, v2, equal_nan=True)
+                for (m1, v1), (m2, v2) in zip(reference, out)
+            )
+            r = {
+                "index": index,
+                "rows": rows,
+                "days": len(groups),
+                "sensor_sites": int(n_sites),
+                "build_s": round(build, 4),
+                "total_s": round(total, 4),
+                "ms_per_day": round(1000 * (total - build) / len(groups), 3),
+                "speedup": round(base_total / total, 2),
+                "matches_reference": same,
+            }
+            results.append(r)
+            print(
+                f"{index:<10}{rows:>12,}{r['days']:>6}{n_sites:>8}"
+                f"{r['build_s']:>10.3f}{r['total_s']:>10.3f}{r['ms_per_day']:>9.2f}"
+                f"{r['speedup']:>8.1f}x{'yes' if same else 'NO':>6}"
+            )
+    save_results(args.out, run_metadata(args), results)
+
+
+if __name__ == "__main__":
+    main()
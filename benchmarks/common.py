@@ -0,0 +1,153 @@
+"""
+基准测试公用工具：小模型训练（合成数据来自 benchmarks.synthetic）、延迟统计、内存读取、结果文件读写与对比
+"""
+
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.synthetic import city_noaa_frame, training_frame
+from src.etl.storage import write_table
+from src.feature_store import DEFAULT_CITIES
+
+LABEL_COL = "max_aqi"
+
+
+def prepare_fixtures(workdir: str, retrain: bool = False) -> dict:
+    """
+    在 workdir 下准备合成 NOAA 数据集与一个只含 LightGBM 的小模型（已存在时复用）
+    返回 {"noaa_path": ..., "model_path": ...}
+    """
+    from autogluon.tabular import TabularPredictor
+
+    noaa_path = os.path.join(workdir, "noaa.parquet")
+    model_path = os.path.join(workdir, "ag_models")
+    os.makedirs(workdir, exist_ok=True)
+
+    if retrain or not os.path.exists(noaa_path):
+        write_table(city_noaa_frame(DEFAULT_CITIES), noaa_path, date_col="DATE")
+    if retrain or not os.path.exists(model_path):
+        print(f"Training tiny benchmark model in {model_path}...")
+        TabularPredictor(
+            label=LABEL_COL,
+            path=model_path,
+            problem_type="regression",
+            eval_metric="rmse",
+            verbosity=0,
+        ).fit(
+            training_frame(label_col=LABEL_COL),
+            hyperparameters={"GBM": {"num_boost_round": 100}},
+            time_limit=60,
+        )
+    return {"noaa_path": noaa_path, "model_path": model_path}
+
+
+def latency_stats(latencies_s, elapsed_s: float, rows: int) -> dict:
+    """由每次调用的耗时（秒）汇总吞吐与分位延迟"""
+    ms = np.asarray(latencies_s) * 1000
+    return {
+        "calls": len(ms),
+        "rows": rows,
+        "throughput_calls_per_s": round(len(ms) / elapsed_s, 2),
+        "throughput_rows_per_s": round(rows / elapsed_s, 2),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def rss_mb(pid: int = None):
+    """进程当前常驻内存（MB）；非 Linux 时只能给出本进程峰值"""
+    status = f"/proc/{pid or 'self'}/status"
+    if os.path.exists(status):
+        with open(status) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 单位为字节，Linux 为 KB
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    return None
+
+
+def run_metadata(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def save_results(path: str, meta: dict, results: list) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=4)
+    print(f"Results saved to {path}")
+
+
+def compare_results(baseline_path: str, results: list, threshold: float) -> bool:
+    """
+    与基线结果逐项对比（按 mode / concurrency / batch_size 匹配），
+    p99 延迟上升或吞吐下降超过 threshold 记为回归；返回是否存在回归
+    """
+    with open(baseline_path) as f:
+        baseline = {
+            (r["mode"], r["concurrency"], r["batch_size"]): r
+            for r in json.load(f)["results"]
+        }
+
+    regressed = False
+    print(f"\nComparison with {baseline_path} (threshold {threshold:.0%})")
+    print(f"{'case':<24}{'p99 ms':>25}{'rows/s':>26}")
+    for r in results:
+        key = (r["mode"], r["concurrency"], r["batch_size"])
+        base = baseline.get(key)
+        if base is None:
+            continue
+        p99_change = r["p99_ms"] / base["p99_ms"] - 1
+        tput_change = r["throughput_rows_per_s"] / base["throughput_rows_per_s"] - 1
+        flag = p99_change > threshold or tput_change < -threshold
+        regressed |= flag
+        print(
+            f"{'%s c=%d b=%d' % key:<24}"
+            f"{base['p99_ms']:>8.2f} -> {r['p99_ms']:>7.2f} {p99_change:>+5.0%}"
+            f"{base['throughput_rows_per_s']:>9.0f} -> "
+            f"{r['throughput_rows_per_s']:>7.0f} {tput_change:>+5.0%}"
+            f"{'  REGRESSION' if flag else ''}"
+        )
+    return regressed
+
+
+def wait_until_ready(url: str, timeout: float = 120) -> None:
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
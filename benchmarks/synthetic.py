@@ -0,0 +1,292 @@
+"""
+合成数据生成器：与 ETL 各阶段输入 schema 一致的 NOAA GSOD / OpenAQ 数据，规模可调（1 万 ~ 1 亿行）
+
+    gsod_archive      : GSOD 年度 tar.gz（每站一个 CSV，含非美国站），供 noaa_extract 流式读取
+    noaa_chunks       : noaa_extract 输出的 18 列日观测（含缺测码与 FRSHTT 字符串）
+    city_noaa_frame   : 给定城市周边气象站的日观测，供特征存储与推理基准使用
+    training_frame    : merge 输出形式的训练集（18 个特征 + max_aqi 标签）
+    openaq_chunks     : openaq_extract 输出的 7 列传感器日均值，传感器分布在气象站附近
+    write_*_dataset   : 分块生成并追加写出 Parquet 数据集，内存占用只与 chunk_rows 有关
+"""
+
+import io
+import tarfile
+
+import numpy as np
+import pandas as pd
+
+from src.etl.merge import flag_to_nan, frshtt_flags
+from src.etl.noaa_extract import NOAA_COLUMNS, NOAA_SCHEMA
+from src.etl.storage import remove_table, write_table
+from src.feature_store import FEATURE_COLUMNS
+
+START_DATE = "2025-01-01"
+# 美国本土经纬度范围
+US_LAT, US_LON = (25.0, 49.0), (-124.0, -67.0)
+
+# 测量列 -> (均值, 标准差, 缺测码)
+NOAA_MEASURES = {
+    "TEMP": (55.0, 18.0, None),
+    "DEWP": (42.0, 16.0, 9999.9),
+    "SLP": (1015.0, 7.0, 9999.9),
+    "STP": (960.0, 40.0, 999.9),
+    "VISIB": (9.0, 2.0, 999.9),
+    "WDSP": (7.0, 3.5, 999.9),
+    "MXSPD": (13.0, 5.0, 999.9),
+    "GUST": (22.0, 7.0, 999.9),
+    "MAX": (65.0, 19.0, None),
+    "MIN": (45.0, 17.0, None),
+    "PRCP": (0.1, 0.25, 99.99),
+    "SNDP": (1.0, 3.0, 999.9),
+}
+# GSOD 原始 CSV 的完整列（含 *_ATTRIBUTES 计数列）
+GSOD_CSV_COLUMNS = [
+    "STATION",
+    "DATE",
+    "LATITUDE",
+    "LONGITUDE",
+    "ELEVATION",
+    "NAME",
+    "TEMP",
+    "TEMP_ATTRIBUTES",
+    "DEWP",
+    "DEWP_ATTRIBUTES",
+    "SLP",
+    "SLP_ATTRIBUTES",
+    "STP",
+    "STP_ATTRIBUTES",
+    "VISIB",
+    "VISIB_ATTRIBUTES",
+    "WDSP",
+    "WDSP_ATTRIBUTES",
+    "MXSPD",
+    "GUST",
+    "MAX",
+    "MAX_ATTRIBUTES",
+    "MIN",
+    "MIN_ATTRIBUTES",
+    "PRCP",
+    "PRCP_ATTRIBUTES",
+    "SNDP",
+    "FRSHTT",
+]
+# OpenAQ 日均值：(污染物, 平均周期, 单位, 对数均值, 对数标准差)
+OPENAQ_PARAMETERS = [
+    ("pm25", "24:00:00", "µg/m³", 2.0, 0.6),
+    ("pm10", "24:00:00", "µg/m³", 2.8, 0.6),
+    ("o3", "08:00:00", "ppm", -3.4, 0.35),
+    ("o3", "01:00:00", "ppm", -3.3, 0.4),
+    ("co", "08:00:00", "ppm", -1.2, 0.7),
+    ("so2", "01:00:00", "ppb", 0.5, 0.9),
+    ("no2", "01:00:00", "ppb", 2.3, 0.7),
+]
+
+
+def station_coords(n_stations: int, seed: int = 0) -> np.ndarray:
+    """气象站坐标（同一 seed 结果固定，OpenAQ 生成器据此把传感器放在站点附近）"""
+    # 按行抽取 (纬度, 经度)，前 k 个站的坐标与 n_stations 无关
+    unit = np.random.default_rng(seed).random((n_stations, 2))
+    low = np.array([US_LAT[0], US_LON[0]])
+    high = np.array([US_LAT[1], US_LON[1]])
+    return low + unit * (high - low)
+
+
+def _frshtt(rng, n: int) -> np.ndarray:
+    """6 位 0/1 天气现象字符串，雨最常见、龙卷风极少"""
+    probs = np.array([0.08, 0.25, 0.05, 0.01, 0.04, 0.001])
+    bits = (rng.random((n, 6)) < probs).astype(np.int64)
+    codes = bits @ (10 ** np.arange(5, -1, -1))
+    return np.char.zfill(codes.astype(str), 6)
+
+
+def noaa_frame(
+    stations: np.ndarray,
+    coords: np.ndarray,
+    days: int,
+    seed: int = 0,
+    missing_rate: float = 0.05,
+    country: str = "US",
+) -> pd.DataFrame:
+    """给定站号与坐标，生成这些站 days 天的日观测（NOAA_COLUMNS 顺序）"""
+    rng = np.random.default_rng(seed)
+    n = len(stations) * days
+    df = pd.DataFrame(
+        {
+            "DATE": np.tile(
+                pd.date_range(START_DATE, periods=days).values.astype("datetime64[D]"),
+                len(stations),
+            ),
+            "LATITUDE": np.repeat(coords[:, 0], days).round(5),
+            "LONGITUDE": np.repeat(coords[:, 1], days).round(5),
+            "ELEVATION": np.repeat(rng.uniform(0, 2500, len(stations)), days).round(1),
+            "NAME": np.repeat(
+                np.array(
+                    [f"SYNTHETIC STATION {s}, XX {country}" for s in stations],
+                    dtype=object,
+                ),
+                days,
+            ),
+        }
+    )
+    for col, (mean, std, missing) in NOAA_MEASURES.items():
+        values = rng.normal(mean, std, n)
+        if col in ("PRCP", "SNDP", "VISIB", "WDSP", "MXSPD", "GUST"):
+            values = np.abs(values)
+        values = values.round(2 if col == "PRCP" else 1)
+        if missing is not None:
+            values[rng.random(n) < missing_rate] = missing
+        df[col] = values
+    df["FRSHTT"] = _frshtt(rng, n)
+    return df[NOAA_COLUMNS]
+
+
+def noaa_chunks(rows: int, days: int = 365, chunk_rows: int = 2_000_000, seed: int = 0):
+    """按站分块生成约 rows 行的 NOAA 观测，逐块 yield"""
+    n_stations = max(1, -(-rows // days))
+    days = min(days, rows)
+    coords = station_coords(n_stations, seed)
+    per_chunk = max(1, chunk_rows // days)
+    for i, start in enumerate(range(0, n_stations, per_chunk)):
+        ids = np.arange(start, min(start + per_chunk, n_stations))
+        yield noaa_frame(ids, coords[ids], days, seed=seed + 1 + i)
+
+
+def city_noaa_frame(
+    cities: dict, days: int = 90, stations_per_city: int = 3, seed: int = 0
+) -> pd.DataFrame:
+    """在 {城市: (纬度, 经度)} 周边 ±0.3° 内放置气象站，生成 days 天的日观测"""
+    rng = np.random.default_rng(seed)
+    centers = np.repeat(
+        np.array(list(cities.values()), dtype=float), stations_per_city, axis=0
+    )
+    coords = centers + rng.uniform(-0.3, 0.3, centers.shape)
+    return noaa_frame(np.arange(len(coords)), coords, days, seed=seed)
+
+
+def training_frame(
+    rows: int = 5000, seed: int = 0, label_col: str = "max_aqi"
+) -> pd.DataFrame:
+    """
+    merge 输出形式的训练集：NOAA 特征（缺测码转 NaN，FRSHTT 展开为 6 个标志列）
+    加上与若干特征呈非线性关系的 AQI 标签
+    """
+    days = min(rows, 100)
+    n_stations = -(-rows // days)
+    df = noaa_frame(
+        np.arange(n_stations), station_coords(n_stations, seed), days, seed=seed
+    ).head(rows)
+    df = flag_to_nan(df.assign(**frshtt_flags(df["FRSHTT"])))
+    df = df[FEATURE_COLUMNS].reset_index(drop=True)
+    noise = np.random.default_rng(seed).normal(0, 5, len(df))
+    df[label_col] = (
+        30
+        + 0.8 * df["TEMP"]
+        - 0.5 * df["WDSP"].fillna(NOAA_MEASURES["WDSP"][0])
+        + 0.02 * (df["DEWP"].fillna(NOAA_MEASURES["DEWP"][0]) - 50) ** 2
+        + 20 * df["Fog"]
+        + noise
+    ).clip(0, 500)
+    return df
+
+
+def openaq_frame(
+    sensors: np.ndarray, coords: np.ndarray, days: int, seed: int = 0
+) -> pd.DataFrame:
+    """给定传感器与坐标，生成 days 天的日均值（openaq_extract 输出的 7 列）"""
+    rng = np.random.default_rng(seed)
+    param = rng.integers(len(OPENAQ_PARAMETERS), size=len(sensors))
+    name, interval, units, mu, sigma = (
+        np.array(col, dtype=object)[param] for col in zip(*OPENAQ_PARAMETERS)
+    )
+    dates = pd.date_range(START_DATE, periods=days).strftime("%Y-%m-%dT00:00:00Z")
+    values = rng.lognormal(
+        np.repeat(mu.astype(float), days), np.repeat(sigma.astype(float), days)
+    )
+    return pd.DataFrame(
+        {
+            "value": values.round(4),
+            "parameter.name": np.repeat(name, days),
+            "period.datetimeFrom.utc": np.tile(dates.values, len(sensors)),
+            "latitude": np.repeat(coords[:, 0], days).round(5),
+            "longitude": np.repeat(coords[:, 1], days).round(5),
+            "period.interval": np.repeat(interval, days),
+            "parameter.units": np.repeat(units, days),
+        }
+    )
+
+
+def openaq_chunks(
+    rows: int,
+    near_stations: int,
+    days: int = 365,
+    chunk_rows: int = 2_000_000,
+    radius_deg: float = 0.3,
+    seed: int = 0,
+):
+    """
+    按传感器分块生成约 rows 行的 OpenAQ 日均值；
+    传感器随机落在前 near_stations 个气象站（station_coords 同一 seed）附近，保证 merge 有匹配
+    """
+    n_sensors = max(1, -(-rows // days))
+    days = min(days, rows)
+    rng = np.random.default_rng(seed + 10_000)
+    anchors = station_coords(max(1, near_stations), seed)
+    coords = anchors[rng.integers(len(anchors), size=n_sensors)] + rng.uniform(
+        -radius_deg, radius_deg, (n_sensors, 2)
+    )
+    per_chunk = max(1, chunk_rows // days)
+    for i, start in enumerate(range(0, n_sensors, per_chunk)):
+        ids = np.arange(start, min(start + per_chunk, n_sensors))
+        yield openaq_frame(ids, coords[ids], days, seed=seed + 20_000 + i)
+
+
+def write_noaa_dataset(path: str, rows: int, **kwargs) -> int:
+    """生成 NOAA 数据集（与 noaa_extract 输出相同的 schema 与日期分区），返回行数"""
+    remove_table(path)
+    total = 0
+    for chunk in noaa_chunks(rows, **kwargs):
+        write_table(chunk, path, date_col="DATE", schema=NOAA_SCHEMA, append=True)
+        total += len(chunk)
+    return total
+
+
+def write_openaq_dataset(path: str, rows: int, near_stations: int, **kwargs) -> int:
+    """生成 OpenAQ 传感器数据集（与 openaq_extract 输出相同的列与日期分区），返回行数"""
+    remove_table(path)
+    total = 0
+    for chunk in openaq_chunks(rows, near_stations, **kwargs):
+        write_table(chunk, path, date_col="period.datetimeFrom.utc", append=True)
+        total += len(chunk)
+    return total
+
+
+def gsod_archive(
+    path: str, rows: int, days: int = 365, foreign_frac: float = 0.3, seed: int = 0
+) -> int:
+    """
+    写出 GSOD 风格的年度 tar.gz：每站一个 CSV（含 *_ATTRIBUTES 列），
+    约 foreign_frac 比例的站点不在美国，会被 stream_us_stations 跳过。
+    返回归档中的美国站行数
+    """
+    n_stations = max(1, -(-rows // days))
+    days = min(days, rows)
+    coords = station_coords(n_stations, seed)
+    rng = np.random.default_rng(seed)
+    us_rows = 0
+    with tarfile.open(path, "w:gz") as tar:
+        for s in range(n_stations):
+            country = "FR" if rng.random() < foreign_frac else "US"
+            df = noaa_frame(
+                np.array([s]), coords[s : s + 1], days, seed=seed + s, country=country
+            )
+            df.insert(0, "STATION", f"{720000 + s:06d}{s % 100000:05d}")
+            for col in GSOD_CSV_COLUMNS:
+                if col.endswith("_ATTRIBUTES"):
+                    df[col] = rng.integers(4, 25, len(df))
+            data = df[GSOD_CSV_COLUMNS].to_csv(index=False).encode()
+
+            info = tarfile.TarInfo(f"{df['STATION'].iloc[0]}.csv")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            us_rows += len(df) if country == "US" else 0
+    return us_rows
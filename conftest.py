@@ -0,0 +1 @@
+# 让 pytest 从仓库根目录导入 src（与 python -m src.xxx 的运行方式一致）
@@ -1,7 +1,7 @@
 # 示例：端到端调用
 from src.model import AQIPredictor
 from src.genai import get_or_generate_city_image
-# from src.genai_sd import get_or_generate_city_image
+# from src.genai_sd import get_or_generate_city_image  # 后台生成；传 wait=True 等待结果
 
 # 1. 预测
 pred = AQIPredictor().predict("Los Angeles", "2026-01-21")
@@ -1,11 +1,87 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import base64
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import List
+from urllib.parse import quote
+
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware  # ← 新增导入
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from .batching import MicroBatcher
+from .feature_store import CityNotFoundError
+from .genai import FORMATS, get_renderer
+from .image_cache import bucket_sample, get_image_cache, image_key
 from .model import AQIPredictor
 
+# NDJSON 批量接口：每攒够 BATCH_CHUNK_SIZE 行调用一次模型，内存占用与总行数无关
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+BATCH_CHUNK_SIZE = 1000
+# /image 响应后是否把图片写入磁盘缓存（frontend/images），以及浏览器缓存时长
+PERSIST_IMAGES = os.environ.get("AQI_PERSIST_IMAGES", "1") == "1"
+IMAGE_MAX_AGE = int(os.environ.get("AQI_IMAGE_MAX_AGE", "86400"))
+# 图片来源：template 为 Pillow 卡片（默认）；sd 为 Stable Diffusion，
+# 在后台生成，生成完成前 /image 返回卡片作为占位
+IMAGE_BACKEND = os.environ.get("AQI_IMAGE_BACKEND", "template")
+
+# 模型在服务启动后于后台加载（预派生模式下由父进程在 fork 前加载，见 serve.py）；
+# 加载完成前 /ready 返回 503，预测接口返回 503
+predictor: AQIPredictor = None
+_load_error: Exception = None
+
+
+def load_predictor() -> AQIPredictor:
+    """加载全局模型（已加载则直接返回）"""
+    global predictor, _load_error
+    if predictor is None:
+        try:
+            predictor = AQIPredictor()
+        except Exception as e:
+            _load_error = e
+            raise
+        _load_error = None
+    return predictor
+
+
+def _get_predictor() -> AQIPredictor:
+    if predictor is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded yet")
+    return predictor
+
+
+def _predict_batch(items, return_exceptions):
+    return predictor.predict_batch(items, return_exceptions)
+
+
+# 单条 /predict 请求经微批调度器合并后再调用模型
+# （窗口与批大小见 AQI_BATCH_WAIT_MS / AQI_MAX_BATCH_SIZE）
+batcher = MicroBatcher(_predict_batch)
+
+
+def _log_load_failure(future):
+    if future.exception() is not None:
+        print(f"Model loading failed: {future.exception()}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 字体与背景模板只在启动时加载一次
+    get_renderer()
+    await batcher.start()
+    if predictor is None:
+        loading = asyncio.get_running_loop().run_in_executor(None, load_predictor)
+        loading.add_done_callback(_log_load_failure)
+    yield
+    await batcher.stop()
+
+
 app = FastAPI(
     title="Air Quality Prediction API",
     description="Simulates an AWS SageMaker Endpoint for AQI forecasting",
+    lifespan=lifespan,
 )
 
 # 添加 CORS 中间件
@@ -17,24 +93,278 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有头
 )
 
-# 全局加载模型
-predictor = AQIPredictor()
-
 
 class PredictionRequest(BaseModel):
     city: str
     date: str
 
 
+_batch_adapter = TypeAdapter(List[PredictionRequest])
+
+
+async def _predict_one(city: str, date: str) -> dict:
+    # 预报表命中时直接返回，不经过微批调度与模型
+    model = _get_predictor()
+    if model.reload_due():
+        # 本次查表会检查更新，可能重新加载模型，放到线程池执行，不阻塞事件循环
+        hit = await run_in_threadpool(model.forecast, city, date)
+    else:
+        hit = model.forecast(city, date)
+    if hit is not None:
+        return hit
+    try:
+        return await batcher.submit((city, date))
+    except CityNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (ValueError, TypeError) as e:
+        # 无法解析的日期等输入错误（批量接口中同样记为该条的 error）
+        raise HTTPException(status_code=422, detail=f"Invalid request: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+
 @app.post("/predict")
 async def predict(request: PredictionRequest):
+    return await _predict_one(request.city, request.date)
+
+
+def _sd_service():
+    """Stable Diffusion 生成服务（依赖 torch / diffusers，仅在 sd 模式下导入）"""
+    from .genai_sd import get_service
+
+    return get_service()
+
+
+def _read_image(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@app.post("/forecast")
+async def forecast_with_image(
+    request: PredictionRequest,
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    inline: bool = False,
+):
+    """
+    预测与城市图片一次返回：image_url 指向 /image（同一城市同一 AQI 等级的 URL 相同，
+    浏览器可直接缓存），image_status 为 ready / pending / failed。
+    图片未生成时在后台生成，不阻塞响应；inline=true 时另附 data URI（image_data）
+    """
+    result = await _predict_one(request.city, request.date)
+    city, aqi, level = result["city"], result["predicted_aqi"], result["aqi_level"]
+    image_url = http_request.url_for(
+        "city_image", city=quote(city, safe="")
+    ).include_query_params(aqi=bucket_sample(aqi))
+    response = {**result, "image_url": str(image_url), "image_status": "ready"}
+    data = None
+    if IMAGE_BACKEND == "sd":
+        # 任务按城市与 AQI 等级去重，已生成时直接返回完成状态
+        job = _sd_service().submit(city, aqi, level)
+        response["image_status"] = {"done": "ready", "failed": "failed"}.get(
+            job.status, "pending"
+        )
+        if inline and job.status == "done":
+            data = await run_in_threadpool(_read_image, job.path)
+    renderer = get_renderer()
+    if inline and data is None:
+        data = (await run_in_threadpool(renderer.render, city, aqi))[0]
+    elif IMAGE_BACKEND != "sd":
+        # 响应发出后预先渲染（并按配置写盘），浏览器随后请求 image_url 时直接命中内存
+        task = renderer.persist if PERSIST_IMAGES else renderer.render
+        background_tasks.add_task(task, city, aqi)
+    if data is not None:
+        response["image_data"] = "data:image/png;base64," + base64.b64encode(
+            data
+        ).decode("ascii")
+    return response
+
+
+def _error_result(city, date, error) -> dict:
+    return {"city": city, "date": date, "error": str(error)}
+
+
+async def _score_chunk(items: list) -> list:
+    """在线程池中对一批 (city, date) 打分，单条失败转为 error 字段"""
+    results = await run_in_threadpool(predictor.predict_batch, items, True)
+    return [
+        _error_result(city, date, res) if isinstance(res, Exception) else res
+        for (city, date), res in zip(items, results)
+    ]
+
+
+def _parse_ndjson_line(line: bytes):
+    """解析一行 NDJSON，失败时返回异常对象占位"""
     try:
-        result = predictor.predict(request.city, request.date)
-        return result
+        item = PredictionRequest.model_validate_json(line)
+    except ValidationError as e:
+        return ValueError(f"Invalid line: {e.errors()[0]['msg']}")
+    return (item.city, item.date)
+
+
+async def _render_chunk(pending: list) -> str:
+    """
+    对一块已解析的行打分，按原顺序输出为 NDJSON 文本。
+    整块打分失败时该块每行输出 error，响应已开始发送，不能再改成 500
+    """
+    items = [p for p in pending if not isinstance(p, Exception)]
+    try:
+        results = await _score_chunk(items) if items else []
+    except Exception as e:
+        error = f"Prediction failed: {e}"
+        results = [_error_result(city, date, error) for city, date in items]
+    scored = iter(results)
+    lines = []
+    for p in pending:
+        res = _error_result(None, None, p) if isinstance(p, Exception) else next(scored)
+        lines.append(json.dumps(res, ensure_ascii=False) + "\n")
+    return "".join(lines)
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    边读请求体边输出的流式响应。
+    StreamingResponse 在旧版 ASGI 协议下会并发监听 receive() 以检测断开，
+    这会抢走尚未读完的请求体，因此这里只做输出。
+    """
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def _stream_ndjson(request: Request):
+    """
+    逐行读取 NDJSON 请求体，分块打分后按输入顺序逐行写回
+    """
+    pending = []
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            pending.append(_parse_ndjson_line(line))
+            if len(pending) >= BATCH_CHUNK_SIZE:
+                yield await _render_chunk(pending)
+                pending = []
+
+    if buffer.strip():
+        pending.append(_parse_ndjson_line(buffer))
+    if pending:
+        yield await _render_chunk(pending)
+
+
+@app.post(
+    "/predict/batch",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": PredictionRequest.model_json_schema(),
+                    }
+                },
+                NDJSON_MEDIA_TYPE: {"schema": PredictionRequest.model_json_schema()},
+            },
+        }
+    },
+)
+async def predict_batch(request: Request):
+    """
+    批量预测：多个 (city, date) 一次调用模型，结果与输入顺序一致。
+    Content-Type 为 application/x-ndjson 时逐行流式读写，适合超大批量。
+    """
+    _get_predictor()
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(NDJSON_MEDIA_TYPE):
+        return NDJSONStreamingResponse(_stream_ndjson(request))
+
+    try:
+        payload = _batch_adapter.validate_json(await request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+
+    try:
+        return await _score_chunk([(item.city, item.date) for item in payload])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 
+@app.get("/image/{city:path}")
+async def city_image(
+    city: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    aqi: float = Query(..., ge=0),
+    format: str = Query("png", pattern="^(png|webp)$"),
+):
+    """
+    城市 AQI 卡片图，直接从内存返回图片字节。
+    同一城市同一 AQI 等级的图片不变：带 ETag 与 Cache-Control，If-None-Match 命中时返回 304。
+    sd 模式下返回已生成的图片，尚未生成时返回不缓存的卡片占位
+    """
+    path = (
+        get_image_cache().get(image_key(city, aqi)) if IMAGE_BACKEND == "sd" else None
+    )
+    if path is not None:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:  # 刚被其他进程淘汰
+            pass
+        else:
+            etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+            headers = {
+                "ETag": etag,
+                "Cache-Control": f"public, max-age={IMAGE_MAX_AGE}",
+            }
+            if etag in request.headers.get("if-none-match", ""):
+                return Response(status_code=304, headers=headers)
+            data = await run_in_threadpool(_read_image, path)
+            return Response(data, media_type="image/png", headers=headers)
+    renderer = get_renderer()
+    data, etag = await run_in_threadpool(renderer.render, city, aqi, format)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={IMAGE_MAX_AGE}"}
+    if IMAGE_BACKEND == "sd":
+        # 生成完成前的占位图，不让浏览器缓存
+        headers = {"Cache-Control": "no-store"}
+    elif etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if PERSIST_IMAGES and format == "png" and IMAGE_BACKEND != "sd":
+        # 响应发出后再写磁盘，不在请求的关键路径上
+        background_tasks.add_task(renderer.persist, city, aqi)
+    return Response(data, media_type=FORMATS[format][1], headers=headers)
+
+
 @app.get("/health")
 async def health_check():
-    return {"status": "ok", "model_loaded": True}
+    status = {"status": "ok", "model_loaded": predictor is not None}
+    if predictor is not None:
+        status["model_version"] = predictor.model_version
+        status["cache"] = predictor.cache.stats()
+        table = predictor.forecasts
+        if table is not None:
+            status["forecast_table"] = {
+                "rows": len(table),
+                "generated_at": table.generated_at,
+                "in_use": table.model_version == predictor.model_version,
+            }
+    elif _load_error is not None:
+        status["status"] = "error"
+        status["error"] = str(_load_error)
+    return status
+
+
+@app.get("/ready")
+async def readiness():
+    """就绪探针：模型加载完成前返回 503，负载均衡器据此暂不转发流量"""
+    if predictor is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded yet")
+    return {"ready": True}
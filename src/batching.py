@@ -0,0 +1,117 @@
+"""
+动态微批处理（模拟 SageMaker 端点的服务端批处理）
+
+在线请求先进入队列，调度器把几毫秒内到达的请求（最多 max_batch_size 条）
+合并成一批，在专用工作线程中调用一次 predict_batch，再把结果分发回各自的 future。
+事件循环不再被模型推理阻塞，AutoGluon 的单次调用开销由整批请求分摊。
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# 默认配置，可通过环境变量调整
+MAX_BATCH_SIZE = int(os.environ.get("AQI_MAX_BATCH_SIZE", "64"))
+MAX_WAIT_MS = float(os.environ.get("AQI_BATCH_WAIT_MS", "5"))
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        predict_batch,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+    ):
+        """
+        参数
+        ----
+        predict_batch  : 批量打分函数 f(items, return_exceptions=True) -> 结果列表
+        max_batch_size : 每批最多合并的请求数
+        max_wait_ms    : 收到一批的第一条请求后，最多再等待多少毫秒凑批
+        """
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue = None
+        self._worker = None
+        self._executor = None
+
+    async def start(self) -> None:
+        """在当前事件循环中启动调度协程"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            # 模型只在这一个线程里调用，批与批之间串行
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="batcher"
+            )
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止调度协程，未处理的请求以异常结束"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped"))
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, item):
+        """
+        提交一条请求并等待其结果；单条失败时抛出对应异常
+        """
+        if self._worker is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> list:
+        """阻塞等到第一条请求，然后在时间窗口内尽量凑满一批"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # 已在排队的请求直接取走，不再等待
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # 调用方已取消（如客户端断开）的请求不再打分
+            batch = [(item, f) for item, f in batch if not f.done()]
+            if not batch:
+                continue
+
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.predict_batch, items, True
+                )
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, future), res in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(res, Exception):
+                    future.set_exception(res)
+                else:
+                    future.set_result(res)
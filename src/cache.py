@@ -0,0 +1,179 @@
+"""
+预测结果缓存（模拟 ElastiCache 前置于 SageMaker 端点）
+
+同一 (城市, 日期) 的预测在特征或模型更新前不会变化，而在线流量集中在少数大城市。
+进程内 LRU + TTL 缓存，键为 (城市, 日期, 模型版本)；可选共享后端
+（本地以 SQLite 文件代替 Redis），多个进程 / 实例共用缓存结果。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 默认配置，可通过环境变量调整
+CACHE_MAX_SIZE = int(os.environ.get("AQI_CACHE_SIZE", "10000"))
+CACHE_TTL_SECONDS = float(os.environ.get("AQI_CACHE_TTL", "3600"))
+# 设置后启用共享后端（SQLite 文件路径）
+CACHE_DB_PATH = os.environ.get("AQI_CACHE_DB")
+
+
+def model_version(model_path: str) -> str:
+    """
+    由模型目录下文件的修改时间与大小生成版本号；
+    重新训练 / 覆盖模型后版本号随之变化，旧缓存自然失效
+    """
+    latest, total = 0, 0
+    for root, _, files in os.walk(model_path):
+        for name in files:
+            st = os.stat(os.path.join(root, name))
+            latest = max(latest, st.st_mtime_ns)
+            total += st.st_size
+    return f"{latest:x}-{total:x}"
+
+
+class SQLiteCacheBackend:
+    """
+    基于 SQLite 的共享缓存后端（Redis 的本地替身）
+    接口只有 get / set / clear，换成 Redis 时保持同样的方法即可。
+    连接按进程建立：serve.py 在父进程创建缓存后 fork，worker 不会共用父进程的连接
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn, self._pid = None, None
+        self._connection()
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS prediction_cache (
+                    key        TEXT PRIMARY KEY,
+                    value      TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """)
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str):
+        with self._lock:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT value, expires_at FROM prediction_cache WHERE key = ?",
+                    (key,),
+                )
+                .fetchone()
+            )
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict, ttl: float):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO prediction_cache VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl),
+            )
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM prediction_cache")
+            conn.commit()
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+
+class PredictionCache:
+    def __init__(
+        self,
+        max_size: int = CACHE_MAX_SIZE,
+        ttl_seconds: float = CACHE_TTL_SECONDS,
+        backend=None,
+    ):
+        """
+        参数
+        ----
+        max_size    : 进程内最多缓存的条目数，超出时淘汰最久未用的
+        ttl_seconds : 条目有效期（秒）
+        backend     : 可选共享后端（get / set / clear），进程内未命中时再查
+        """
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self.backend = backend
+        self._entries = OrderedDict()  # key -> (过期时间, 结果)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "PredictionCache":
+        backend = SQLiteCacheBackend(CACHE_DB_PATH) if CACHE_DB_PATH else None
+        return cls(backend=backend)
+
+    @staticmethod
+    def _backend_key(key: tuple) -> str:
+        return "|".join(map(str, key))
+
+    def get(self, key: tuple):
+        """命中返回缓存的结果字典，否则返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        value = self.backend.get(self._backend_key(key)) if self.backend else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._put(key, value, now)
+        return value
+
+    def set(self, key: tuple, value: dict):
+        with self._lock:
+            self._put(key, value, time.monotonic())
+        if self.backend:
+            self.backend.set(self._backend_key(key), value, self.ttl)
+
+    def _put(self, key: tuple, value: dict, now: float):
+        self._entries[key] = (now + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """清空进程内缓存（共享后端的旧条目因模型版本不同不会再被命中）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
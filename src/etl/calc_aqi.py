@@ -1,25 +1,129 @@
 import os
+import numpy as np
 import pandas as pd
 from typing import Callable, Optional
 
+from .storage import read_table, write_table
+
+# EPA AQI 断点表：(parameter, period) -> 计算规则
+#   scale  : 截断精度，浓度先乘 scale 取整（向零截断）
+#   divide : 截断后是否再除以 scale（so2/no2 换算成 ppb 后不再除）
+#   units  : 按单位覆盖 scale，例如 ppb 不需要放大
+#   bands  : (C_lo, C_hi, I_lo, I_hi)，闭区间
+#   upper_open : 最后一档不含上界（o3 8 小时：< 0.200）
+#   extend_from: 超出最后一档后，从该浓度起沿最后一档斜率外推，起点 AQI 为 500
+#   otherwise  : 落在所有档位之外时的取值（o3 8 小时为 300，so2 为 200），缺省丢弃
+AQI_BREAKPOINTS = {
+    ("o3", "08:00:00"): {
+        "scale": 1000,
+        "divide": True,
+        "bands": [
+            (0.0, 0.054, 0, 50),
+            (0.055, 0.070, 51, 100),
+            (0.071, 0.085, 101, 150),
+            (0.086, 0.105, 151, 200),
+            (0.106, 0.200, 201, 300),
+        ],
+        "upper_open": True,
+        "otherwise": 300,
+    },
+    ("o3", "01:00:00"): {
+        "scale": 1000,
+        "divide": True,
+        "bands": [
+            (0.125, 0.164, 101, 150),
+            (0.165, 0.204, 151, 200),
+            (0.205, 0.404, 201, 300),
+            (0.405, 0.604, 301, 500),
+        ],
+        "extend_from": 0.605,
+    },
+    ("pm25", "24:00:00"): {
+        "scale": 10,
+        "divide": True,
+        "bands": [
+            (0.0, 9.0, 0, 50),
+            (9.1, 35.4, 51, 100),
+            (35.5, 55.4, 101, 150),
+            (55.5, 125.4, 151, 200),
+            (125.5, 225.4, 201, 300),
+            (225.5, 325.4, 301, 500),
+        ],
+        "extend_from": 325.5,
+    },
+    ("pm10", "24:00:00"): {
+        "scale": 1,
+        "divide": True,
+        "bands": [
+            (0.0, 54.0, 0, 50),
+            (55.0, 154.0, 51, 100),
+            (155.0, 254.0, 101, 150),
+            (255.0, 354.0, 151, 200),
+            (355.0, 424.0, 201, 300),
+            (425.0, 604.0, 301, 500),
+        ],
+        "extend_from": 605.0,
+    },
+    ("co", "08:00:00"): {
+        "scale": 10,
+        "divide": True,
+        "bands": [
+            (0.0, 4.4, 0, 50),
+            (4.5, 9.4, 51, 100),
+            (9.5, 12.4, 101, 150),
+            (12.5, 15.4, 151, 200),
+            (15.5, 30.4, 201, 300),
+            (30.5, 50.4, 301, 500),
+        ],
+        "extend_from": 50.5,
+    },
+    ("so2", "01:00:00"): {
+        "scale": 1000,
+        "divide": False,
+        "units": {"ppb": 1},
+        "bands": [
+            (0.0, 35.0, 0, 50),
+            (36.0, 75.0, 51, 100),
+            (76.0, 185.0, 101, 150),
+            (186.0, 304.0, 151, 200),
+        ],
+        "otherwise": 200,
+    },
+    ("no2", "01:00:00"): {
+        "scale": 1000,
+        "divide": False,
+        "units": {"ppb": 1},
+        "bands": [
+            (0.0, 53.0, 0, 50),
+            (54.0, 100.0, 51, 100),
+            (101.0, 360.0, 101, 150),
+            (361.0, 649.0, 151, 200),
+            (650.0, 1249.0, 201, 300),
+            (1250.0, 2049.0, 301, 500),
+        ],
+        "extend_from": 2050.0,
+    },
+}
+
 
 def add_aqi_column(
-    in_csv: str,
-    out_csv: str,
-    func: Callable[[str, str, str, float], Optional[float]],
+    in_path: str,
+    out_path: str,
+    func: Optional[Callable[[str, str, str, float], Optional[float]]] = None,
     *,
     dtype: Optional[dict] = None,
 ) -> None:
     """
-    为 CSV 增加一列 'aqi' 并保存为新文件。
+    为传感器数据增加一列 'aqi' 并保存为按日期分区的 Parquet 数据集。
     若 func 返回 None，则该行被丢弃。
 
     参数
     ----
-    in_csv  : 输入文件路径
-    out_csv : 输出文件路径
-    func    : 计算 AQI 的函数，签名
+    in_path : 输入数据集路径（Parquet 数据集或 CSV）
+    out_path: 输出数据集路径
+    func    : 可选，逐行计算 AQI 的函数，签名
               func(parameter, period, unit, value) -> float | None
+              缺省时使用按整列计算的断点表引擎 calc_aqi_vectorized
     dtype   : 可选，手动指定列类型
     """
     # 1. 读入
@@ -32,35 +136,47 @@ def add_aqi_column(
         "period.interval",
         "parameter.units",
     ]
-    df = pd.read_csv(in_csv, usecols=cols, dtype=dtype)
-
-    # 2. 清洗 value 列（可重复利用之前逻辑）
-    df["value"] = (
-        df["value"]
-        .astype(str)
-        .str.replace(",", "")
-        .str.strip()
-        .replace({"": pd.NA, "N/A": pd.NA, "NULL": pd.NA})
-    )
+    df = read_table(in_path, columns=cols)
+    if dtype:
+        df = df.astype(dtype)
+
+    # 2. 清洗 value 列（Parquet 中已是数值类型时跳过字符串清洗）
+    if not pd.api.types.is_numeric_dtype(df["value"]):
+        df["value"] = (
+            df["value"]
+            .astype(str)
+            .str.replace(",", "")
+            .str.strip()
+            .replace({"": pd.NA, "N/A": pd.NA, "NULL": pd.NA})
+        )
     df["value"] = pd.to_numeric(df["value"], errors="coerce")
 
     # 3. 计算 AQI，允许 None
-    def _calc(row):
-        return func(
-            row["parameter.name"],
-            row["period.interval"],
-            row["parameter.units"],
-            row["value"],
+    if func is None:
+        df["aqi"] = calc_aqi_vectorized(
+            df["parameter.name"],
+            df["period.interval"],
+            df["parameter.units"],
+            df["value"],
         )
+    else:
+
+        def _calc(row):
+            return func(
+                row["parameter.name"],
+                row["period.interval"],
+                row["parameter.units"],
+                row["value"],
+            )
 
-    df["aqi"] = df.apply(_calc, axis=1)
+        df["aqi"] = df.apply(_calc, axis=1)
 
     # 4. 丢弃 None 行
     df = df[df["aqi"].notna()]
 
     # 5. 写出
-    df.to_csv(out_csv, index=False, float_format="%.6f")
-    print(f"已生成 {out_csv}，共 {len(df)} 行（None 行已剔除）。")
+    write_table(df, out_path, date_col="period.datetimeFrom.utc")
+    print(f"已生成 {out_path}，共 {len(df)} 行（None 行已剔除）。")
 
 
 def convert_to_aqi(parameter, period, unit, value):
@@ -183,13 +299,66 @@ def convert_to_aqi(parameter, period, unit, value):
     return round(aqi) if aqi is not None else None
 
 
+def _apply_breakpoints(rule: dict, unit: np.ndarray, value: np.ndarray) -> np.ndarray:
+    """对同一 (parameter, period) 的一组浓度按断点表整列计算 AQI"""
+    scale = np.full(len(value), float(rule["scale"]))
+    for u, s in rule.get("units", {}).items():
+        scale[unit == u] = s
+    conc = np.trunc(value * scale)
+    if rule["divide"]:
+        conc = conc / scale
+
+    c_lo, c_hi, i_lo, i_hi = (np.array(col, dtype=float) for col in zip(*rule["bands"]))
+    slope = (i_hi - i_lo) / (c_hi - c_lo)
+
+    # 每个浓度所在档位：最后一个 C_lo <= conc 的档
+    idx = np.searchsorted(c_lo, conc, side="right") - 1
+    band = np.clip(idx, 0, len(c_lo) - 1)
+    in_band = (idx >= 0) & (conc <= c_hi[band])
+    if rule.get("upper_open"):
+        in_band &= ~((band == len(c_lo) - 1) & (conc >= c_hi[-1]))
+
+    otherwise = rule.get("otherwise")
+    aqi = np.full(len(conc), np.nan if otherwise is None else float(otherwise))
+    hit = band[in_band]
+    aqi[in_band] = slope[hit] * (conc[in_band] - c_lo[hit]) + i_lo[hit]
+    if "extend_from" in rule:
+        start = rule["extend_from"]
+        beyond = conc >= start
+        aqi[beyond] = slope[-1] * (conc[beyond] - start) + 500
+
+    # 缺测浓度不参与计算
+    aqi[np.isnan(value)] = np.nan
+    return np.round(aqi)
+
+
+def calc_aqi_vectorized(parameter, period, unit, value) -> np.ndarray:
+    """
+    按 AQI_BREAKPOINTS 整列计算 AQI，与 convert_to_aqi 逐行结果一致；
+    不支持的污染物 / 平均周期以及缺测值返回 NaN。
+
+    参数均为等长的一维序列（Series / ndarray）
+    """
+    parameter = np.asarray(parameter, dtype=object)
+    period = np.asarray(period, dtype=object)
+    unit = np.asarray(unit, dtype=object)
+    value = np.asarray(value, dtype=float)
+
+    aqi = np.full(len(value), np.nan)
+    for (param, interval), rule in AQI_BREAKPOINTS.items():
+        mask = (parameter == param) & (period == interval)
+        if mask.any():
+            aqi[mask] = _apply_breakpoints(rule, unit[mask], value[mask])
+    return aqi
+
+
 if __name__ == "__main__":
     filtered_path = os.path.join(
         os.path.dirname(__file__),
         "../../",
-        "data/processed/US_20250101_20260118_sensor_filtered.csv",
+        "data/processed/US_20250101_20260118_sensor_filtered.parquet",
     )
     aqi_added_path = os.path.join(
-        os.path.dirname(__file__), "../../", "data/processed/US_sensor_with_aqi.csv"
+        os.path.dirname(__file__), "../../", "data/processed/US_sensor_with_aqi.parquet"
     )
-    add_aqi_column(filtered_path, aqi_added_path, convert_to_aqi)
+    add_aqi_column(filtered_path, aqi_added_path)
@@ -1,59 +1,280 @@
 import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
 import pandas as pd
 from geopy.distance import geodesic
 from sklearn.neighbors import BallTree
 import numpy as np
 from tqdm import tqdm
 from pathlib import Path
+import pyarrow as pa
+import pyarrow.compute as pc
 
-EARTH_RADIUS_KM = 6371.0088
+from .spatial import EARTH_RADIUS_KM, SPATIAL_INDEXES, SiteNeighbors, Sites
+from .storage import (
+    PARTITION_COL,
+    list_partitions,
+    open_dataset,
+    read_partition,
+    read_table,
+    replace_table,
+    write_table,
+)
+
+# 逐日期分区流式处理（out-of-core）：峰值内存只与单日数据量有关，与历史长度无关
+OUT_OF_CORE = os.environ.get("AQI_MERGE_OUT_OF_CORE", "0") == "1"
+
+# 近邻检索方式：per_date 为每天重建 BallTree；其余见 spatial.SPATIAL_INDEXES，
+# 对去重后的传感器位置只建一次索引，所有日期共用
+SPATIAL_INDEX = os.environ.get("AQI_SPATIAL_INDEX", "balltree")
+
+# 传感器数据集中 merge 需要的列
+SENSOR_COLUMNS = ["period.datetimeFrom.utc", "latitude", "longitude", "aqi"]
+
+# FRSHTT 六位天气现象标志对应的列名
+FRSHTT_COLUMNS = ["Fog", "Rain", "Snow", "Hail", "Thunder", "Tornado"]
+
+# GSOD 缺测码：列 -> 闭区间 (下界, 上界)，落在区间内的值视为缺测
+MISSING_CODES = {
+    "DEWP": (9999.8, 9999.95),
+    "SLP": (9999.8, 9999.95),
+    "STP": (999.8, 999.95),
+    "VISIB": (999.8, 999.95),
+    "WDSP": (999.8, 999.95),
+    "MXSPD": (999.8, 999.95),
+    "GUST": (999.8, 999.95),
+    "PRCP": (99.98, 99.995),
+    "SNDP": (999.8, 999.95),
+}
+
+
+def _nearby_max_for_date(
+    a_lat_lon: np.ndarray, b_lat_lon: np.ndarray, b_aqi: np.ndarray, radius: float
+):
+    """
+    单日批量近邻：为当天全部 NOAA 站一次性 query_radius，
+    返回 (是否有匹配, 半径内最大 AQI)
+    """
+    matched = np.zeros(len(a_lat_lon), dtype=bool)
+    max_aqi = np.full(len(a_lat_lon), np.nan)
+
+    valid_a = ~np.isnan(a_lat_lon).any(axis=1)
+    valid_b = ~np.isnan(b_lat_lon).any(axis=1)
+    if not valid_a.any() or not valid_b.any():
+        return matched, max_aqi
+
+    tree = BallTree(np.deg2rad(b_lat_lon[valid_b]), metric="haversine")
+    neighbors = tree.query_radius(np.deg2rad(a_lat_lon[valid_a]), r=radius)
+    counts = np.fromiter(map(len, neighbors), dtype=np.int64, count=len(neighbors))
+
+    hit = counts > 0
+    if hit.any():
+        # 把各站的邻居下标拼成一维，按段求最大值（忽略 NaN）
+        flat = np.concatenate(neighbors[hit])
+        starts = np.concatenate(([0], np.cumsum(counts[hit])[:-1]))
+        pos = np.flatnonzero(valid_a)[hit]
+        matched[pos] = True
+        max_aqi[pos] = np.fmax.reduceat(b_aqi[valid_b][flat], starts)
+    return matched, max_aqi
 
 
 def add_nearby_max_aqi(
-    csv_a: str, csv_b: str, out_csv: str, dist_km: float = 50
+    path_a: str,
+    path_b: str,
+    out_path: str,
+    dist_km: float = 50,
+    n_jobs: int = 1,
+    out_of_core: bool = OUT_OF_CORE,
+    spatial_index: str = SPATIAL_INDEX,
 ) -> None:
     """
     同日期 + 50 km 内最大 AQI，无匹配则丢弃该行。
+    n_jobs > 1 时各日期分组在进程池中并行计算。
+    out_of_core 时逐个日期分区读取、计算并写出，见 _merge_by_partition。
+    spatial_index 选择近邻检索方式（"per_date" / "balltree" / "grid"），结果一致。
+
+    path_a : NOAA 数据集，path_b : 带 AQI 的传感器数据集，out_path : 输出数据集
     """
-    # 1. 读数据
-    df_a = pd.read_csv(csv_a)
-    df_b = pd.read_csv(csv_b)
-    df_a.rename(columns=str.upper, inplace=True)
+    if out_of_core:
+        if list_partitions(path_a) and list_partitions(path_b):
+            return _merge_by_partition(
+                path_a, path_b, out_path, dist_km, n_jobs, spatial_index
+            )
+        print("Inputs are not partitioned by date, falling back to in-memory merge")
+
+    # 1. 读数据：B 只取坐标、时间与 AQI 四列，且只读 A 中出现的日期分区
+    df_a = _prepare_noaa(read_table(path_a))
+    df_b = read_table(
+        path_b, columns=SENSOR_COLUMNS, dates=list_partitions(path_a) or None
+    )
     df_b.rename(columns=str.upper, inplace=True)
 
     # 2. 统一日期键（只保留年月日）
-    df_a["DATE"] = pd.to_datetime(df_a["DATE"], errors="coerce")
     df_b["PERIOD.DATETIMEFROM.UTC"] = pd.to_datetime(
         df_b["PERIOD.DATETIMEFROM.UTC"], errors="coerce"
     )
     df_a["date_key"] = df_a["DATE"].dt.date
     df_b["date_key"] = df_b["PERIOD.DATETIMEFROM.UTC"].dt.date
 
-    # 3. 按日期分组 B，并为每组预建 BallTree（球面弧度坐标）
-    trees = {}
-    for d_key, sub in df_b.groupby("date_key"):
-        rad = np.deg2rad(sub[["LATITUDE", "LONGITUDE"]].values)
-        trees[d_key] = (BallTree(rad, metric="haversine"), sub)
-
-    # 4. 遍历 A
-    keep = []
-    for _, row in tqdm(df_a.iterrows(), total=len(df_a), desc="Processing"):
-        d_key = row["date_key"]
-        if pd.isna(d_key) or d_key not in trees:
-            continue
-        tree, sub_b = trees[d_key]
-        loc_rad = np.deg2rad([[row["LATITUDE"], row["LONGITUDE"]]])
-        idx = tree.query_radius(loc_rad, r=dist_km / EARTH_RADIUS_KM)[0]
-        if len(idx) == 0:
-            continue
-        max_aqi = sub_b.iloc[idx]["AQI"].max()
-        row["max_aqi"] = max_aqi
-        keep.append(row)
+    # 3. 按日期分组，取出 A/B 两侧的坐标与 AQI 数组
+    a_lat_lon = df_a[["LATITUDE", "LONGITUDE"]].to_numpy(dtype=float)
+    b_lat_lon = df_b[["LATITUDE", "LONGITUDE"]].to_numpy(dtype=float)
+    b_aqi = df_b["AQI"].to_numpy(dtype=float)
+    b_groups = df_b.groupby("date_key").indices
+    a_groups = {
+        d_key: idx
+        for d_key, idx in df_a.groupby("date_key").indices.items()
+        if d_key in b_groups
+    }
+
+    # 4. 每个日期一次批量查询
+    match = nearby_matcher(spatial_index, dist_km, a_lat_lon, b_lat_lon)
+    a_pos = list(a_groups.values())
+    args = (
+        [a_lat_lon[idx] for idx in a_pos],
+        [b_lat_lon[b_groups[d_key]] for d_key in a_groups],
+        [b_aqi[b_groups[d_key]] for d_key in a_groups],
+    )
+    matched = np.zeros(len(df_a), dtype=bool)
+    max_aqi = np.full(len(df_a), np.nan)
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = pool.map(match, *args, chunksize=8)
+            results = list(tqdm(results, total=len(a_pos), desc="Processing"))
+    else:
+        results = tqdm(map(match, *args), total=len(a_pos), desc="Processing")
+    for idx, (hit, values) in zip(a_pos, results):
+        matched[idx] = hit
+        max_aqi[idx] = values
 
     # 5. 输出
-    df_out = pd.DataFrame(keep).drop(columns=["date_key"])
-    df_out.to_csv(out_csv, index=False)
-    print(f"Done -> {out_csv}  共保留 {len(df_out)} 行")
+    df_out = df_a.loc[matched].drop(columns=["date_key"])
+    df_out["max_aqi"] = max_aqi[matched]
+    write_table(df_out, out_path, date_col="DATE")
+    print(f"Done -> {out_path}  共保留 {len(df_out)} 行")
+
+
+def nearby_matcher(spatial_index: str, dist_km: float, a_lat_lon, b_lat_lon):
+    """
+    返回单日近邻函数 match(a_lat_lon, b_lat_lon, b_aqi) -> (是否有匹配, 最大 AQI)。
+    静态索引在 a_lat_lon / b_lat_lon 中出现过的全部位置上构建一次
+    """
+    if spatial_index == "per_date":
+        return partial(_nearby_max_for_date, radius=dist_km / EARTH_RADIUS_KM)
+    if spatial_index not in SPATIAL_INDEXES:
+        raise ValueError(
+            f"Unknown spatial index {spatial_index!r}, "
+            f"expected one of {['per_date', *SPATIAL_INDEXES]}"
+        )
+    stations = Sites(a_lat_lon[:, 0], a_lat_lon[:, 1])
+    sensors = Sites(b_lat_lon[:, 0], b_lat_lon[:, 1])
+    return SiteNeighbors(stations, sensors, dist_km, spatial_index).for_date
+
+
+def _unique_coords(path: str, columns: list, chunk_rows: int = 2_000_000):
+    """
+    流式扫描数据集的坐标两列并去重，得到全部位置：
+    攒够 chunk_rows 行就与已有位置一起去重，内存只与位置数和 chunk_rows 有关
+    """
+    seen = pa.table({col: pa.array([], pa.float64()) for col in columns})
+    pending, pending_rows = [], 0
+    batches = open_dataset(path).to_batches(columns=columns)
+    for batch in (*batches, None):
+        if batch is not None:
+            pending.append(pa.Table.from_batches([batch]).cast(seen.schema))
+            pending_rows += batch.num_rows
+        if pending_rows >= chunk_rows or (batch is None and pending):
+            seen = pa.concat_tables([seen, *pending]).group_by(columns).aggregate([])
+            pending, pending_rows = [], 0
+    return np.column_stack([seen[col].to_numpy() for col in columns]).reshape(-1, 2)
+
+
+def _prepare_noaa(df: pd.DataFrame) -> pd.DataFrame:
+    """NOAA 列名统一大写，DATE 转为时间戳"""
+    df.rename(columns=str.upper, inplace=True)
+    df["DATE"] = pd.to_datetime(df["DATE"], errors="coerce")
+    return df
+
+
+def _merged_schema(path_a: str) -> pa.Schema:
+    """
+    merge 输出的列类型：NOAA 各列（大写，DATE 为时间戳）+ max_aqi。
+    逐日追加写出时固定下来，避免某天整列为空时推断出不同类型
+    """
+    fields = [
+        field.with_name(field.name.upper())
+        for field in open_dataset(path_a).schema
+        if field.name != PARTITION_COL
+    ]
+    fields = [
+        field.with_type(pa.timestamp("ns")) if field.name == "DATE" else field
+        for field in fields
+    ]
+    return pa.schema(fields + [pa.field("max_aqi", pa.float64())])
+
+
+def _merge_partition(
+    path_a: str, path_b: str, staging: str, day: str, match, schema
+) -> int:
+    """单个日期：读两侧当天的分区、查近邻、追加写出匹配行，返回保留行数"""
+    df_a = _prepare_noaa(read_partition(path_a, day))
+    df_b = read_partition(path_b, day, columns=SENSOR_COLUMNS)
+    hit, values = match(
+        df_a[["LATITUDE", "LONGITUDE"]].to_numpy(dtype=float),
+        df_b[["latitude", "longitude"]].to_numpy(dtype=float),
+        df_b["aqi"].to_numpy(dtype=float),
+    )
+    df_out = df_a.loc[hit].assign(max_aqi=values[hit])
+    if len(df_out):
+        write_table(df_out, staging, date_col="DATE", schema=schema, append=True)
+    return len(df_out)
+
+
+def _merge_by_partition(
+    path_a: str,
+    path_b: str,
+    out_path: str,
+    dist_km: float,
+    n_jobs: int,
+    spatial_index: str = SPATIAL_INDEX,
+) -> None:
+    """
+    out-of-core merge：两侧都按日期分区时，一次只读入一天的 NOAA 与传感器数据，
+    查近邻、写出匹配行后全部释放。峰值内存只取决于单日数据量
+    （n_jobs > 1 时为 n_jobs 天）与位置数，与历史年份、国家数量无关。
+    静态索引需要的位置先流式扫描坐标列收集。
+    结果先写到临时目录，全部完成后整体替换 out_path。
+    """
+    days = sorted(set(list_partitions(path_a)) & set(list_partitions(path_b)))
+    if spatial_index == "per_date":
+        a_lat_lon = b_lat_lon = None
+    else:
+        a_lat_lon = _unique_coords(path_a, ["LATITUDE", "LONGITUDE"])
+        b_lat_lon = _unique_coords(path_b, ["latitude", "longitude"])
+    match = nearby_matcher(spatial_index, dist_km, a_lat_lon, b_lat_lon)
+    staging = f"{os.path.normpath(out_path)}.partial-{os.getpid()}"
+    args = (
+        repeat(path_a),
+        repeat(path_b),
+        repeat(staging),
+        days,
+        repeat(match),
+        repeat(_merged_schema(path_a)),
+    )
+    try:
+        if n_jobs > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                kept = sum(tqdm(pool.map(_merge_partition, *args), total=len(days)))
+        else:
+            kept = sum(tqdm(map(_merge_partition, *args), total=len(days)))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    os.makedirs(staging, exist_ok=True)
+    replace_table(staging, out_path)
+    print(f"Done -> {out_path}  共保留 {kept} 行（逐日处理 {len(days)} 个分区）")
 
 
 def split_frshtt(s):
@@ -67,42 +288,97 @@ def split_frshtt(s):
     return [int(ch) for ch in s]
 
 
-def add_frshtt_flags(csv_in: str, csv_out: str | None = None):
+def _frshtt_codes(frshtt: pd.Series) -> np.ndarray:
+    """FRSHTT 列 -> 整数编码（只取后 6 位；缺失 / 无法解析记为 0）"""
+    if pd.api.types.is_numeric_dtype(frshtt):
+        codes = frshtt.to_numpy(dtype=float)
+    else:
+        try:
+            # 字符串整列交给 Arrow 解析，比逐个 Python 字符串快一个数量级
+            arr = pc.utf8_trim_whitespace(
+                pa.array(frshtt, type=pa.string(), from_pandas=True)
+            )
+            codes = pc.cast(arr, pa.int64()).to_numpy(zero_copy_only=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            codes = pd.to_numeric(frshtt, errors="coerce").to_numpy(dtype=float)
+    codes = np.nan_to_num(np.asarray(codes, dtype=float), nan=0.0)
+    return codes.astype(np.int64) % 1_000_000
+
+
+def frshtt_flags(frshtt: pd.Series) -> pd.DataFrame:
     """
-    csv_in : 原始文件路径
-    csv_out: 输出文件路径，若为 None 则默认在原文件名后加 '_flags'
+    把 FRSHTT 列展开为 6 个 int8 标志列：按整数编码逐位取数，
+    结果与逐行 split_frshtt 一致
     """
-    csv_in = Path(csv_in)
-    df = pd.read_csv(csv_in)
-
-    # 生成 6 列
-    frshtt_cols = ["Fog", "Rain", "Snow", "Hail", "Thunder", "Tornado"]
-    df[frshtt_cols] = pd.DataFrame(
-        df["FRSHTT"].apply(split_frshtt).tolist(), index=df.index
+    codes = _frshtt_codes(frshtt)
+    return pd.DataFrame(
+        {
+            col: ((codes // 10 ** (5 - i)) % 10).astype(np.int8)
+            for i, col in enumerate(FRSHTT_COLUMNS)
+        },
+        index=frshtt.index,
     )
 
+
+def add_frshtt_flags(
+    path_in: str, path_out: str | None = None, out_of_core: bool = OUT_OF_CORE
+):
+    """
+    path_in : 原始数据集路径
+    path_out: 输出数据集路径，若为 None 则默认在原文件名后加 '_flags'
+    out_of_core: 按日期分区逐个处理，峰值内存只与单日数据量有关
+    """
+    path_in = Path(path_in)
+
     # 构造输出路径
-    if csv_out is None:
-        csv_out = csv_in.with_name(csv_in.stem + "_flags.csv")
+    if path_out is None:
+        path_out = path_in.with_name(path_in.stem + "_flags" + path_in.suffix)
 
-    df = flag_to_nan(df)
-    df.to_csv(csv_out, index=False)
-    print(f"Saved → {csv_out}")
+    days = list_partitions(str(path_in)) if out_of_core else []
+    if days:
+        schema = _flags_schema(str(path_in))
+        staging = f"{os.path.normpath(path_out)}.partial-{os.getpid()}"
+        try:
+            for day in tqdm(days):
+                df = _with_flags(read_partition(str(path_in), day))
+                write_table(df, staging, date_col="DATE", schema=schema, append=True)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        os.makedirs(staging, exist_ok=True)
+        replace_table(staging, str(path_out))
+    else:
+        df = _with_flags(read_table(str(path_in)))
+        write_table(df, str(path_out), date_col="DATE")
+    print(f"Saved → {path_out}")
 
 
-def flag_to_nan(df):
-    """把缺测码统一换成 NaN"""
-    df = df.copy()
-    df.loc[df["DEWP"].between(9999.8, 9999.95, inclusive="both"), "DEWP"] = np.nan
-    df.loc[df["SLP"].between(9999.8, 9999.95, inclusive="both"), "SLP"] = np.nan
-    df.loc[df["STP"].between(999.8, 999.95, inclusive="both"), "STP"] = np.nan
-    df.loc[df["VISIB"].between(999.8, 999.95, inclusive="both"), "VISIB"] = np.nan
-    df.loc[df["WDSP"].between(999.8, 999.95, inclusive="both"), "WDSP"] = np.nan
-    df.loc[df["MXSPD"].between(999.8, 999.95, inclusive="both"), "MXSPD"] = np.nan
-    df.loc[df["GUST"].between(999.8, 999.95, inclusive="both"), "GUST"] = np.nan
-    df.loc[df["PRCP"].between(99.98, 99.995, inclusive="both"), "PRCP"] = np.nan
-    df.loc[df["SNDP"].between(999.8, 999.95, inclusive="both"), "SNDP"] = np.nan
+def _with_flags(df: pd.DataFrame) -> pd.DataFrame:
+    """生成 6 个 FRSHTT 标志列，缺测码置 NaN"""
+    df[FRSHTT_COLUMNS] = frshtt_flags(df["FRSHTT"])
+    return flag_to_nan(df)
+
+
+def _flags_schema(path_in: str) -> pa.Schema:
+    """add_frshtt_flags 输出的列类型：缺测码列为 float64，追加 6 个 int8 标志列"""
+    fields = [
+        field.with_type(pa.float64()) if field.name in MISSING_CODES else field
+        for field in open_dataset(path_in).schema
+        if field.name != PARTITION_COL
+    ]
+    return pa.schema(fields + [pa.field(col, pa.int8()) for col in FRSHTT_COLUMNS])
 
+
+def flag_to_nan(df):
+    """
+    按 MISSING_CODES 把缺测码统一换成 NaN。
+    每列只做一次区间比较并替换该列，原地修改并返回 df（不复制整表）
+    """
+    for col, (low, high) in MISSING_CODES.items():
+        if col not in df.columns:
+            continue
+        values = df[col].to_numpy(dtype=float)
+        df[col] = np.where((values >= low) & (values <= high), np.nan, values)
     return df
 
 
@@ -110,17 +386,19 @@ if __name__ == "__main__":
     noaa_filtered_path = os.path.join(
         os.path.dirname(__file__),
         "../../",
-        "data/processed/NOAA_GSOD_US_2025_filtered.csv",
+        "data/processed/NOAA_GSOD_US_2025_filtered.parquet",
     )
     aqi_added_path = os.path.join(
-        os.path.dirname(__file__), "../../", "data/processed/US_sensor_with_aqi.csv"
+        os.path.dirname(__file__), "../../", "data/processed/US_sensor_with_aqi.parquet"
     )
     merged_path = os.path.join(
-        os.path.dirname(__file__), "../../", "data/processed/noaa_openaq_aqi.csv"
+        os.path.dirname(__file__), "../../", "data/processed/noaa_openaq_aqi.parquet"
     )
     add_nearby_max_aqi(noaa_filtered_path, aqi_added_path, merged_path)
 
     frshtt_path = os.path.join(
-        os.path.dirname(__file__), "../../", "data/processed/noaa_openaq_aqi_frshtt.csv"
+        os.path.dirname(__file__),
+        "../../",
+        "data/processed/noaa_openaq_aqi_frshtt.parquet",
     )
     add_frshtt_flags(merged_path, frshtt_path)
@@ -1,9 +1,100 @@
 import os, sys
+import shutil
+import io
 import pandas as pd
 import boto3, requests, pyarrow as pa
 from datetime import date, timedelta
 import tarfile
-import glob
+
+from .storage import remove_table, replace_table, write_table
+
+# 只保留需要的 18 列
+NOAA_COLUMNS = [
+    "DATE",
+    "LATITUDE",
+    "LONGITUDE",
+    "ELEVATION",
+    "NAME",
+    "TEMP",
+    "DEWP",
+    "SLP",
+    "STP",
+    "VISIB",
+    "WDSP",
+    "MXSPD",
+    "GUST",
+    "MAX",
+    "MIN",
+    "PRCP",
+    "SNDP",
+    "FRSHTT",
+]
+
+# 输出的列类型：各站文件单独解析，统一 schema 才能追加到同一个数据集
+# 除下列三列外均为浮点测量值
+NOAA_TYPES = {"DATE": pa.date32(), "NAME": pa.string(), "FRSHTT": pa.string()}
+NOAA_SCHEMA = pa.schema(
+    [(col, NOAA_TYPES.get(col, pa.float64())) for col in NOAA_COLUMNS]
+)
+
+
+def stream_us_stations(
+    tar_path: str, out_path: str, chunk_rows: int = 500_000, country: str = "US"
+) -> int:
+    """
+    流式读取 GSOD 年度 tar.gz，不解压到磁盘：
+    逐个成员读取站点 CSV，先看站名筛掉非美国站，只解析 18 列，
+    攒够 chunk_rows 行追加到按日期分区的 Parquet 数据集。
+    峰值内存只与 chunk_rows 有关，与归档大小无关。
+    各块先追加到暂存目录，全部写完后整体替换 out_path，
+    中途失败时原有数据集保持不变。
+
+    返回写出的总行数
+    """
+    staging = f"{os.path.normpath(out_path)}.partial-{os.getpid()}"
+    remove_table(staging)
+    pending, pending_rows, total = [], 0, 0
+
+    def flush():
+        nonlocal pending, pending_rows, total
+        chunk = pd.concat(pending, ignore_index=True)[NOAA_COLUMNS]
+        write_table(chunk, staging, date_col="DATE", schema=NOAA_SCHEMA, append=True)
+        total += len(chunk)
+        pending, pending_rows = [], 0
+
+    try:
+        # "r|gz" 为顺序流模式，成员按归档顺序逐个读取
+        with tarfile.open(tar_path, "r|gz") as t:
+            for member in t:
+                if not member.isfile() or not member.name.endswith(".csv"):
+                    continue
+                data = t.extractfile(member).read()
+
+                # 每个文件只有一个站，先只读首行站名
+                head = pd.read_csv(io.BytesIO(data), usecols=["NAME"], nrows=1)
+                if head.empty or not str(head["NAME"].iloc[0]).endswith(country):
+                    continue
+
+                df = pd.read_csv(
+                    io.BytesIO(data),
+                    usecols=NOAA_COLUMNS,
+                    dtype={"NAME": str, "FRSHTT": str},
+                    parse_dates=["DATE"],
+                )
+                df = df[df["NAME"].astype(str).str.endswith(country)]
+                pending.append(df)
+                pending_rows += len(df)
+                if pending_rows >= chunk_rows:
+                    flush()
+        if pending:
+            flush()
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    os.makedirs(staging, exist_ok=True)
+    replace_table(staging, out_path)
+    return total
+
 
 if __name__ == "__main__":
     ### NOAA数据ETL
@@ -23,61 +114,11 @@ if __name__ == "__main__":
             for chunk in r.iter_content(chunk_size=8192):
                 f.write(chunk)
 
-    # 2. 解压 & 读 CSV
-    extract_to = os.path.join(
-        os.path.dirname(__file__), "../../", "data/raw/{0:s}".format("2025_temp")
-    )
-    os.makedirs(extract_to, exist_ok=True)
-    with tarfile.open(local_path, "r:gz") as t:
-        t.extractall(path=extract_to)
-
-    # 3. 合并所有 csv（包里全是 *.csv）
-    csv_files = glob.glob(os.path.join(extract_to, "*.csv"))
-    print("concating")
-    df_noaa = pd.concat(
-        [pd.read_csv(f, parse_dates=["DATE"]) for f in csv_files], ignore_index=True
-    )
-    print("concat done")
-
-    # 4. 筛选美国站
-    mask = df_noaa["NAME"].astype(str).fillna("").str.endswith("US")
-    us_noaa = df_noaa[mask]
-
-    # 5. 保存
-    us_noaa_path = os.path.join(
-        os.path.dirname(__file__), "../../", "data/raw/NOAA_GSOD_US_2025.csv"
-    )
-    us_noaa.to_csv(us_noaa_path, index=False)
-
-    # 6. 只保留需要的 18 列
-    cols = [
-        "DATE",
-        "LATITUDE",
-        "LONGITUDE",
-        "ELEVATION",
-        "NAME",
-        "TEMP",
-        "DEWP",
-        "SLP",
-        "STP",
-        "VISIB",
-        "WDSP",
-        "MXSPD",
-        "GUST",
-        "MAX",
-        "MIN",
-        "PRCP",
-        "SNDP",
-        "FRSHTT",
-    ]
-    df = pd.read_csv(us_noaa_path, usecols=cols)
-
-    df = df[cols]
-
-    # 7. 写出到新的 csv
+    # 2. 流式读取归档，筛选美国站的 18 列，直接写出列式文件
     filtered_noaa_path = os.path.join(
         os.path.dirname(__file__),
         "../../",
-        "data/processed/NOAA_GSOD_US_2025_filtered.csv",
+        "data/processed/NOAA_GSOD_US_2025_filtered.parquet",
     )
-    df.to_csv(filtered_noaa_path, index=False)
+    n_rows = stream_us_stations(local_path, filtered_noaa_path)
+    print(f"Saved {n_rows} rows -> {filtered_noaa_path}")
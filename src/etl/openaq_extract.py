@@ -4,14 +4,23 @@ OpenAQ v3 API 传感器数据下载器
 """
 
 import os, sys
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import argparse
+import glob
+import random
+import sqlite3
+import threading
 import pandas as pd
 import time
 import requests
+from requests.adapters import HTTPAdapter
 from pandas import json_normalize
 import logging
 
+from .storage import read_table, remove_table, write_table
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -19,23 +28,202 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# 需要重试的状态码：限流与服务端临时错误
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """线程安全的令牌桶限速器，所有下载线程共享一个桶"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """
+        Args:
+            rate: 每秒补充的令牌数（即平均请求速率）
+            capacity: 桶容量，允许的最大突发请求数
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到取得一个令牌"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.resume_at:
+                    self.tokens = min(
+                        self.capacity, self.tokens + (now - self.updated) * self.rate
+                    )
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.resume_at - now
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """服务端要求等待（Retry-After / 配额耗尽）时，暂停所有线程取令牌"""
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.resume_at
+
+
+def parse_retry_after(value) -> float | None:
+    """解析 Retry-After 头，支持秒数与 HTTP 日期两种格式"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class SensorCheckpointStore:
+    """
+    基于 SQLite 的传感器下载进度（高水位）记录
+
+    每个传感器记录：
+        last_day   : 已完整下载的最后一天，下次从其后一天开始请求
+        checked_on : 最近一次成功下载的日期，同一天内重跑（断点续传）直接跳过
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS sensor_progress (
+                sensor_id  INTEGER PRIMARY KEY,
+                last_day   TEXT,
+                checked_on TEXT NOT NULL
+            )
+            """)
+        self.conn.commit()
+
+    def load(self) -> dict:
+        """返回 {sensor_id: (last_day, checked_on)}"""
+        rows = self.conn.execute(
+            "SELECT sensor_id, last_day, checked_on FROM sensor_progress"
+        )
+        return {
+            sensor_id: (
+                date.fromisoformat(last_day) if last_day else None,
+                date.fromisoformat(checked_on),
+            )
+            for sensor_id, last_day, checked_on in rows
+        }
+
+    def update(self, sensor_id: int, last_day, checked_on):
+        """数据落盘后再推进高水位，中断时最多重下一个传感器"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sensor_progress VALUES (?, ?, ?)",
+            (
+                int(sensor_id),
+                last_day.isoformat() if last_day else None,
+                checked_on.isoformat(),
+            ),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
 class OpenAQSensorDownloaderComplete:
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        max_workers: int = 1,
+        rate_per_sec: float = 1.0,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        base_url: str = "https://api.openaq.org/v3",
+    ):
         """
         初始化OpenAQ传感器下载器 - 完整版本
 
         Args:
             api_key: OpenAQ API密钥
+            max_workers: 并发下载线程数（同时也是连接池大小）
+            rate_per_sec: 全局请求速率上限（OpenAQ 默认配额为 60 次/分钟）
+            max_retries: 429/5xx/网络错误的最大重试次数
+            backoff_base: 指数退避的基础等待秒数
+            base_url: API 地址，可指向本地桩服务器
         """
         self.api_key = api_key
-        self.base_url = "https://api.openaq.org/v3"
+        self.base_url = base_url
         self.headers = {
             "X-API-Key": api_key,
             "Accept": "application/json",
             "User-Agent": "OpenAQ-Sensor-Downloader/1.0",
         }
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.rate_limiter = TokenBucket(rate_per_sec)
+
+        # 复用 TCP 连接，连接池大小与并发数一致
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_workers, max_retries=0
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         logger.info("OpenAQ API客户端初始化成功")
 
+    def _get(self, path: str, params: dict = None) -> requests.Response:
+        """
+        限速 + 重试的 GET 请求。
+        429/5xx 优先遵循 Retry-After，否则按指数退避（带抖动）重试；
+        配额耗尽（x-ratelimit-remaining 为 0）时暂停所有线程直到重置。
+        """
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            backoff = self.backoff_base * 2**attempt * (1 + random.random() / 2)
+            try:
+                response = self.session.get(url, params=params, timeout=30)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"请求 {path} 失败: {e}，{backoff:.1f} 秒后重试")
+                time.sleep(backoff)
+                continue
+
+            if response.headers.get("x-ratelimit-remaining") == "0":
+                reset = parse_retry_after(response.headers.get("x-ratelimit-reset"))
+                if reset:
+                    logger.info(f"API 配额已用尽，暂停 {reset:.1f} 秒")
+                    self.rate_limiter.pause(reset)
+
+            if (
+                response.status_code not in RETRY_STATUS_CODES
+                or attempt == self.max_retries
+            ):
+                return response
+
+            wait = parse_retry_after(response.headers.get("Retry-After"))
+            if wait is None:
+                wait = backoff
+            if response.status_code == 429:
+                self.rate_limiter.pause(wait)
+            logger.warning(
+                f"请求 {path} 返回 {response.status_code}，{wait:.1f} 秒后重试"
+                f"（{attempt + 1}/{self.max_retries}）"
+            )
+            time.sleep(wait)
+
     def get_us_locations_with_sensors(self, limit: int = 100) -> pd.DataFrame:
         """获取美国带有传感器信息的监测位置"""
         logger.info("获取美国的监测位置及其传感器信息...")
@@ -52,9 +240,7 @@ class OpenAQSensorDownloaderComplete:
                     "page": page,
                 }
 
-                response = requests.get(
-                    f"{self.base_url}/locations", headers=self.headers, params=params
-                )
+                response = self._get("/locations", params=params)
                 response.raise_for_status()
 
                 data = response.json()
@@ -72,7 +258,6 @@ class OpenAQSensorDownloaderComplete:
                     break
 
                 page += 1
-                time.sleep(0.2)
 
             except requests.exceptions.RequestException as e:
                 logger.error(f"获取位置失败: {e}")
@@ -199,15 +384,22 @@ class OpenAQSensorDownloaderComplete:
         return sensors
 
     def get_sensor_daily_data(
-        self, sensor_id: int, days_back: int = 30
-    ) -> pd.DataFrame:
-        """获取传感器的日平均数据 - 最终版本"""
+        self, sensor_id: int, days_back: int = 30, date_from: date = None
+    ) -> pd.DataFrame | None:
+        """
+        获取传感器的日平均数据 - 最终版本（date_from 指定时只取该日之后的增量）
+        无数据返回空 DataFrame，请求失败返回 None（不推进检查点）
+        """
         logger.info(f"获取传感器 {sensor_id} 的日数据（最近{days_back}天）...")
 
         try:
             # 计算日期范围
             end_date = datetime.now()
             start_date = end_date - timedelta(days=days_back)
+            if date_from is not None:
+                start_date = max(
+                    start_date, datetime.combine(date_from, datetime.min.time())
+                )
 
             params = {
                 "date_from": start_date.strftime("%Y-%m-%d"),
@@ -215,11 +407,7 @@ class OpenAQSensorDownloaderComplete:
                 "limit": 1000,
             }
 
-            response = requests.get(
-                f"{self.base_url}/sensors/{sensor_id}/days",
-                headers=self.headers,
-                params=params,
-            )
+            response = self._get(f"/sensors/{sensor_id}/days", params=params)
 
             if response.status_code == 200:
                 data = response.json()
@@ -237,27 +425,79 @@ class OpenAQSensorDownloaderComplete:
                 logger.warning(
                     f"传感器 {sensor_id} 日数据请求失败: {response.status_code}"
                 )
+                return None
 
         except Exception as e:
             logger.error(f"获取传感器 {sensor_id} 日数据失败: {e}")
+            return None
 
         return pd.DataFrame()
 
+    def _fetch_sensor(
+        self,
+        i: int,
+        sensor: dict,
+        total: int,
+        days_back: int,
+        country_code: str,
+        date_from: date = None,
+    ) -> pd.DataFrame | None:
+        """获取单个传感器的日数据并附加传感器和位置信息（包含坐标）"""
+        sensor_id = sensor["sensor_id"]
+        sensor_name = sensor.get("sensor_name", f"Sensor_{sensor_id}")
+        location_id = sensor["location_id"]
+        parameter_name = sensor.get("parameter_name", "Unknown")
+        latitude = sensor.get("latitude")
+        longitude = sensor.get("longitude")
+
+        logger.info(f"处理传感器 {i+1}/{total}: {sensor_id} ({parameter_name})...")
+        if latitude is not None and longitude is not None:
+            logger.info(f"  位置坐标: ({latitude:.4f}, {longitude:.4f})")
+
+        # 获取日数据
+        measurements_df = self.get_sensor_daily_data(sensor_id, days_back, date_from)
+
+        if measurements_df is None:
+            logger.info(f"  传感器 {sensor_id}: 下载失败，下次重试")
+        elif not measurements_df.empty:
+            measurements_df["sensor_id"] = sensor_id
+            measurements_df["sensor_name"] = sensor_name
+            measurements_df["location_id"] = location_id
+            measurements_df["parameter_name"] = parameter_name
+            measurements_df["country_code"] = country_code
+            measurements_df["latitude"] = latitude
+            measurements_df["longitude"] = longitude
+            logger.info(
+                f"  传感器 {sensor_id}: 添加 {len(measurements_df)} 条记录到总数据集"
+            )
+        else:
+            logger.info(f"  传感器 {sensor_id}: 无数据")
+        return measurements_df
+
     def download_recent_sensor_data(
         self,
         country_code: str = "US",
         days_back: int = 30,
         max_sensors: int = 10,
         output_dir: str = "./openaq_recent_data",
-    ):
+        full_refresh: bool = False,
+    ) -> str | None:
         """
         下载最近时间的传感器数据 - 完整版本
 
+        增量模式：每个传感器的高水位记录在 output_dir/openaq_checkpoint.sqlite，
+        只请求上次之后的日期；每次增量单独落盘到 output_dir/sensors/<sensor_id>/，
+        中断后重跑会跳过当天已完成的传感器。最后把窗口内的数据合并为一个文件。
+
         Args:
             country_code: ISO国家代码
             days_back: 回溯天数
             max_sensors: 最大传感器数量
             output_dir: 输出目录
+            full_refresh: 忽略检查点，重新下载整个窗口
+
+        Returns:
+            合并后的输出文件路径，无数据时返回 None
         """
         logger.info(f"开始下载 {country_code} 最近 {days_back} 天的传感器日数据...")
 
@@ -305,68 +545,82 @@ class OpenAQSensorDownloaderComplete:
                     logger.info(f"纬度范围: {lat_range[0]:.4f} 到 {lat_range[1]:.4f}")
                     logger.info(f"经度范围: {lon_range[0]:.4f} 到 {lon_range[1]:.4f}")
 
-        all_measurements = []
-        successful_sensors = 0
-
         # 限制处理的传感器数量
         max_sensors = min(max_sensors, len(sensors))
         logger.info(f"将处理前 {max_sensors} 个传感器")
 
-        # 遍历每个传感器获取数据
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days_back)
+        today = end_date.date()
+
+        # 读取检查点，计算每个传感器的起始日期
+        sensors_dir = os.path.join(output_dir, "sensors")
+        checkpoint = SensorCheckpointStore(
+            os.path.join(output_dir, "openaq_checkpoint.sqlite")
+        )
+        progress = {} if full_refresh else checkpoint.load()
+
+        tasks = []
         for i, sensor in enumerate(sensors[:max_sensors]):
             sensor_id = sensor["sensor_id"]
-            sensor_name = sensor.get("sensor_name", f"Sensor_{sensor_id}")
-            location_id = sensor["location_id"]
-            parameter_name = sensor.get("parameter_name", "Unknown")
-            latitude = sensor.get("latitude")
-            longitude = sensor.get("longitude")
-
             if not sensor_id:
                 continue
+            last_day, checked_on = progress.get(sensor_id, (None, None))
+            if checked_on == today:
+                continue
+            date_from = last_day + timedelta(days=1) if last_day else None
+            tasks.append((i, sensor, max_sensors, days_back, country_code, date_from))
+        logger.info(f"需要更新 {len(tasks)} 个传感器，其余已是最新")
 
-            logger.info(
-                f"处理传感器 {i+1}/{max_sensors}: {sensor_id} ({parameter_name})..."
+        # 并发获取每个传感器的增量日数据（限速由令牌桶统一控制），完成一个落盘一个
+        successful_sensors = 0
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = {pool.submit(self._fetch_sensor, *t): t for t in tasks}
+            for future in as_completed(futures):
+                sensor_id = futures[future][1]["sensor_id"]
+                measurements_df = future.result()
+                if measurements_df is None:
+                    continue
+                if not measurements_df.empty:
+                    self._save_sensor_part(sensors_dir, sensor_id, measurements_df)
+                    successful_sensors += 1
+                # 当天数据尚不完整，高水位最多推进到昨天
+                checkpoint.update(sensor_id, today - timedelta(days=1), today)
+        finally:
+            # 中断（如 Ctrl-C）时取消排队中的请求，已落盘的进度保留
+            pool.shutdown(wait=True, cancel_futures=True)
+            checkpoint.close()
+
+        # 合并窗口内所有传感器的数据；各传感器的增量文件同时压缩为一个文件，
+        # 每次运行读取的文件数与数据量不随运行次数增长
+        all_measurements = []
+        for sensor in sensors[:max_sensors]:
+            if not sensor["sensor_id"]:
+                continue
+            sensor_df = self._compact_sensor_parts(
+                sensors_dir, sensor["sensor_id"], start_date.date()
             )
-            if latitude is not None and longitude is not None:
-                logger.info(f"  位置坐标: ({latitude:.4f}, {longitude:.4f})")
-
-            # 获取日数据
-            measurements_df = self.get_sensor_daily_data(sensor_id, days_back)
-
-            if not measurements_df.empty:
-                # 添加传感器和位置信息（包含坐标）
-                measurements_df["sensor_id"] = sensor_id
-                measurements_df["sensor_name"] = sensor_name
-                measurements_df["location_id"] = location_id
-                measurements_df["parameter_name"] = parameter_name
-                measurements_df["country_code"] = country_code
-                measurements_df["latitude"] = latitude
-                measurements_df["longitude"] = longitude
-
-                all_measurements.append(measurements_df)
-                successful_sensors += 1
-                logger.info(
-                    f"  传感器 {sensor_id}: 添加 {len(measurements_df)} 条记录到总数据集"
-                )
-            else:
-                logger.info(f"  传感器 {sensor_id}: 无数据")
-
-            # 避免请求过快
-            time.sleep(0.5)
+            if sensor_df is not None:
+                all_measurements.append(sensor_df)
 
         if all_measurements:
-            # 合并所有数据
+            # 合并所有数据，重复下载的日期以最新一次为准，并裁剪到回溯窗口
             final_df = pd.concat(all_measurements, ignore_index=True)
+            final_df = final_df.drop_duplicates(
+                subset=["sensor_id", "period.datetimeFrom.utc"], keep="last"
+            )
+            day = pd.to_datetime(final_df["period.datetimeFrom.utc"], utc=True)
+            final_df = final_df[day.dt.date >= start_date.date()].reset_index(drop=True)
 
             # 保存合并数据
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days_back)
             date_str = f"{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}"
 
             output_file = os.path.join(
-                output_dir, f"{country_code}_{date_str}_sensor_daily_with_coords.csv"
+                output_dir,
+                f"{country_code}_{date_str}_sensor_daily_with_coords.parquet",
             )
-            final_df.to_csv(output_file, index=False)
+            write_table(final_df, output_file, date_col="period.datetimeFrom.utc")
 
             logger.info(f"传感器数据下载完成!")
             logger.info(f"总记录数: {len(final_df)}")
@@ -398,8 +652,57 @@ class OpenAQSensorDownloaderComplete:
                 print("\n前5行数据:")
                 print(final_df.head())
 
+            return output_file
+
         else:
             logger.warning("没有获取到任何传感器数据")
+            return None
+
+    @staticmethod
+    def _compact_sensor_parts(sensors_dir: str, sensor_id, since):
+        """
+        读取传感器目录下的全部增量文件，去重（重复日期以最新一次为准）并裁剪到 since 之后；
+        不止一个文件或有数据被裁掉时，整体替换为一个文件。返回裁剪后的数据，无数据时返回 None
+        """
+        sensor_dir = os.path.join(sensors_dir, str(sensor_id))
+        # 各次增量的列可能略有不同，逐个文件读取再由 concat 对齐；
+        # 按文件名（写入时间）排序，早期无时间前缀的 part-* 文件视为最旧
+        parts = sorted(
+            glob.glob(os.path.join(sensor_dir, "*.parquet")),
+            key=lambda f: (os.path.basename(f)[0].isdigit(), os.path.basename(f)),
+        )
+        if not parts:
+            return None
+        df = pd.concat([read_table(f) for f in parts], ignore_index=True)
+        df = df.drop_duplicates(
+            subset=["sensor_id", "period.datetimeFrom.utc"], keep="last"
+        )
+        day = pd.to_datetime(df["period.datetimeFrom.utc"], utc=True)
+        kept = df[day.dt.date >= since].reset_index(drop=True)
+        if kept.empty:
+            remove_table(sensor_dir)
+            return None
+        if len(parts) > 1 or len(kept) < len(df):
+            # 先写好新文件再整体替换目录，中断时旧文件仍完整
+            write_table(
+                kept,
+                sensor_dir,
+                basename_prefix=datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f"),
+            )
+        return kept
+
+    @staticmethod
+    def _save_sensor_part(sensors_dir: str, sensor_id, df: pd.DataFrame):
+        """
+        把一次增量追加为传感器目录下的独立文件（原子写入，中断不会留下半个文件）。
+        文件名以写入时间开头，合并时按文件名排序即为时间先后，重复日期以最新一次为准
+        """
+        write_table(
+            df,
+            os.path.join(sensors_dir, str(sensor_id)),
+            append=True,
+            basename_prefix=datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f"),
+        )
 
 
 if __name__ == "__main__":
@@ -408,11 +711,13 @@ if __name__ == "__main__":
     if not api_key:
         raise ValueError("未设置环境变量OPENAQ_API_KEY")
 
-    # 1. 创建下载器并下载数据
-    downloader = OpenAQSensorDownloaderComplete(api_key)
+    # 1. 创建下载器并下载数据（8 线程并发，全局限速 1 次/秒）
+    downloader = OpenAQSensorDownloaderComplete(
+        api_key, max_workers=8, rate_per_sec=1.0
+    )
 
     local_path = os.path.join(os.path.dirname(__file__), "../../", "data/raw/")
-    downloader.download_recent_sensor_data(
+    raw_path = downloader.download_recent_sensor_data(
         country_code="US",
         days_back=365,  # 30
         max_sensors=3000,  # 20
@@ -429,19 +734,12 @@ if __name__ == "__main__":
         "period.interval",
         "parameter.units",
     ]
-    csv_path = os.path.join(
-        os.path.dirname(__file__),
-        "../../",
-        "data/raw/US_20250101_20260118_sensor_daily_with_coords.csv",
-    )
-    df = pd.read_csv(csv_path, usecols=cols)
-
-    df = df[cols]
+    df = read_table(raw_path, columns=cols)
 
-    # 3. 写出到新的 csv
+    # 3. 写出按日期分区的数据集
     filtered_path = os.path.join(
         os.path.dirname(__file__),
         "../../",
-        "data/processed/US_20250101_20260118_sensor_filtered.csv",
+        "data/processed/US_20250101_20260118_sensor_filtered.parquet",
     )
-    df.to_csv(filtered_path, index=False)
+    write_table(df, filtered_path, date_col="period.datetimeFrom.utc")
@@ -0,0 +1,194 @@
+"""
+merge 的空间近邻检索：气象站 -> 半径内的传感器位置
+
+传感器位置几乎不随日期变化，因此只对去重后的位置建一次索引，
+预先算好每个气象站半径内的位置列表（CSR：flat + starts），所有日期共用；
+每天只需把当天的读数按位置写入数组，再对每个气象站的邻居段取最大值。
+
+可选索引（SPATIAL_INDEXES）：
+    balltree : sklearn BallTree（haversine），邻居集合与逐日重建 BallTree 完全一致
+    grid     : 经纬度网格哈希，格子边长取半径，只对附近格子里的位置精确计算大圆距离
+"""
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """大圆距离（km），参数为角度"""
+    lat1, lon1, lat2, lon2 = map(np.deg2rad, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class BallTreeIndex:
+    """位置坐标上的静态 BallTree"""
+
+    def __init__(self, coords: np.ndarray):
+        self.tree = BallTree(np.deg2rad(coords), metric="haversine")
+
+    def query_radius(self, points: np.ndarray, radius_km: float) -> list:
+        return list(
+            self.tree.query_radius(np.deg2rad(points), r=radius_km / EARTH_RADIUS_KM)
+        )
+
+
+class GridIndex:
+    """
+    经纬度网格哈希（geohash 式分桶）：(行, 列) -> 该格内的位置下标。
+    查询时按纬度换算经度方向需要覆盖的列数（高纬度格子更窄），并处理日期变更线
+    """
+
+    def __init__(self, coords: np.ndarray, cell_km: float = 50):
+        self.coords = np.asarray(coords, dtype=float)
+        self.cell = np.rad2deg(cell_km / EARTH_RADIUS_KM)
+        # 列宽取能整除 360 度的值，跨日期变更线时相邻列宽度一致
+        self.n_cols = int(np.ceil(360 / self.cell))
+        self.col_width = 360 / self.n_cols
+        rows, cols = self._cell_of(self.coords[:, 0], self.coords[:, 1])
+        order = np.lexsort((cols, rows))
+        keys, starts = np.unique(
+            np.stack([rows[order], cols[order]], axis=1), axis=0, return_index=True
+        )
+        self.cells = {
+            (int(r), int(c)): ids
+            for (r, c), ids in zip(keys, np.split(order, starts[1:]))
+        }
+
+    def _cell_of(self, lat, lon):
+        rows = np.floor((np.asarray(lat) + 90) / self.cell).astype(np.int64)
+        cols = np.floor((np.asarray(lon) + 180) / self.col_width).astype(np.int64)
+        return rows, cols % self.n_cols
+
+    def query_radius(self, points: np.ndarray, radius_km: float) -> list:
+        radius_deg = np.rad2deg(radius_km / EARTH_RADIUS_KM)
+        span = int(np.ceil(radius_deg / self.cell))
+        result = []
+        for lat, lon in np.asarray(points, dtype=float):
+            row, col = (int(v) for v in self._cell_of(lat, lon))
+            # 经度方向 1 度对应的距离随 cos(纬度) 缩小，取查询范围内的最高纬度
+            cos_lat = np.cos(np.deg2rad(min(abs(lat) + radius_deg, 90.0)))
+            lon_span = (
+                self.n_cols
+                if cos_lat < 1e-6
+                else min(
+                    self.n_cols, int(np.ceil(radius_deg / cos_lat / self.col_width))
+                )
+            )
+            cols = {(col + dc) % self.n_cols for dc in range(-lon_span, lon_span + 1)}
+            candidates = [
+                self.cells[(row + dr, c)]
+                for dr in range(-span, span + 1)
+                for c in cols
+                if (row + dr, c) in self.cells
+            ]
+            if not candidates:
+                result.append(np.empty(0, dtype=np.int64))
+                continue
+            ids = np.concatenate(candidates)
+            dist = haversine_km(lat, lon, self.coords[ids, 0], self.coords[ids, 1])
+            result.append(ids[dist <= radius_km])
+        return result
+
+
+SPATIAL_INDEXES = {"balltree": BallTreeIndex, "grid": GridIndex}
+
+
+class Sites:
+    """去重后的 (纬度, 经度) 位置表，把逐行坐标映射为位置下标（未知或缺失为 -1）"""
+
+    def __init__(self, lat, lon):
+        self.index = pd.MultiIndex.from_arrays(
+            [np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)]
+        ).unique()
+        self.coords = np.column_stack(
+            [self.index.get_level_values(i).to_numpy(dtype=float) for i in (0, 1)]
+        ).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self.index)
+
+    def ids(self, lat, lon) -> np.ndarray:
+        return self.index.get_indexer(
+            pd.MultiIndex.from_arrays(
+                [np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)]
+            )
+        )
+
+
+class SiteNeighbors:
+    """
+    气象站位置 -> 半径内传感器位置，构建一次、所有日期共用。
+    nearby_max 与 merge._nearby_max_for_date 语义相同：半径内当天有读数即为匹配，
+    取这些读数的最大 AQI（忽略 NaN）
+    """
+
+    def __init__(
+        self,
+        stations: Sites,
+        sensors: Sites,
+        dist_km: float = 50,
+        index: str = "balltree",
+    ):
+        self.stations, self.sensors = stations, sensors
+        counts = np.zeros(len(stations), dtype=np.int64)
+        neighbors = []
+        valid_a = ~np.isnan(stations.coords).any(axis=1)
+        valid_b = np.flatnonzero(~np.isnan(sensors.coords).any(axis=1))
+        if valid_a.any() and len(valid_b):
+            tree = SPATIAL_INDEXES[index](sensors.coords[valid_b])
+            found = tree.query_radius(stations.coords[valid_a], dist_km)
+            counts[valid_a] = [len(n) for n in found]
+            neighbors = [valid_b[n] for n in found if len(n)]
+
+        self.has_neighbors = counts > 0
+        self.flat = (
+            np.concatenate(neighbors) if neighbors else np.empty(0, dtype=np.int64)
+        )
+        self.starts = np.concatenate(([0], np.cumsum(counts[self.has_neighbors])[:-1]))
+
+    def for_date(self, a_lat_lon, b_lat_lon, b_aqi):
+        """按坐标查位置下标后调用 nearby_max，参数与 merge 的单日函数一致"""
+        return self.nearby_max(
+            self.stations.ids(a_lat_lon[:, 0], a_lat_lon[:, 1]),
+            self.sensors.ids(b_lat_lon[:, 0], b_lat_lon[:, 1]),
+            b_aqi,
+        )
+
+    def nearby_max(self, station_ids, sensor_ids, aqi):
+        """
+        当天：station_ids 为各 NOAA 行的气象站下标，sensor_ids / aqi 为各读数的位置与 AQI。
+        返回 (是否有匹配, 半径内最大 AQI)，与 station_ids 对齐
+        """
+        station_ids = np.asarray(station_ids)
+        matched = np.zeros(len(station_ids), dtype=bool)
+        max_aqi = np.full(len(station_ids), np.nan)
+        if not len(self.flat):
+            return matched, max_aqi
+
+        known = sensor_ids >= 0
+        present = np.zeros(len(self.sensors), dtype=bool)
+        present[sensor_ids[known]] = True
+        site_max = np.full(len(self.sensors), np.nan)
+        np.fmax.at(site_max, sensor_ids[known], np.asarray(aqi, dtype=float)[known])
+
+        # 每个有邻居的气象站：邻居段内是否有读数、读数最大值
+        station_hit = np.zeros(len(self.stations), dtype=bool)
+        station_max = np.full(len(self.stations), np.nan)
+        station_hit[self.has_neighbors] = np.logical_or.reduceat(
+            present[self.flat], self.starts
+        )
+        station_max[self.has_neighbors] = np.fmax.reduceat(
+            site_max[self.flat], self.starts
+        )
+
+        valid = station_ids >= 0
+        matched[valid] = station_hit[station_ids[valid]]
+        max_aqi[matched] = station_max[station_ids[matched]]
+        return matched, max_aqi
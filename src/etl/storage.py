@@ -0,0 +1,177 @@
+"""
+ETL 各阶段之间的列式存储层
+
+所有中间结果都写成 Parquet 数据集（目录），可按日期分区：
+    <path>/date_key=2025-01-01/part-xxxx-0.parquet
+读取时支持列裁剪（columns）与谓词下推（filters / dates），
+只解码需要的列和分区，避免 CSV 的浮点解析与重新序列化。
+"""
+
+import os
+import shutil
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# 日期分区列（由 date_col 派生，读取时默认不返回）
+PARTITION_COL = "date_key"
+COMPRESSION = "zstd"
+
+_PARTITIONING = ds.partitioning(
+    pa.schema([(PARTITION_COL, pa.string())]), flavor="hive"
+)
+
+
+def date_keys(values) -> pd.Series:
+    """把日期 / 时间戳列统一成 YYYY-MM-DD 分区键"""
+    return pd.to_datetime(pd.Series(values), errors="coerce").dt.strftime("%Y-%m-%d")
+
+
+def write_table(
+    df: pd.DataFrame,
+    path: str,
+    *,
+    date_col: str = None,
+    schema: pa.Schema = None,
+    append: bool = False,
+    basename_prefix: str = "part",
+) -> None:
+    """
+    写出 Parquet 数据集
+
+    参数
+    ----
+    df       : 待写出的数据
+    path     : 数据集目录
+    date_col : 指定时按该列的日期分区（path/date_key=YYYY-MM-DD/）
+    schema   : 可选，固定列类型（分块追加时保证各块一致）
+    append   : 追加写入（流式分块写出时使用），否则整体替换 path
+    basename_prefix : 文件名前缀；追加写入时传入可排序的前缀（如时间戳），
+                      按文件名排序即为写入先后
+
+    先写到临时目录再改名，读者不会看到写了一半的文件。
+    """
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    if date_col is not None:
+        table = table.append_column(
+            PARTITION_COL, pa.array(date_keys(df[date_col]), type=pa.string())
+        )
+
+    tmp_dir = f"{os.path.normpath(path)}.tmp-{uuid.uuid4().hex}"
+    ds.write_dataset(
+        table,
+        tmp_dir,
+        format="parquet",
+        partitioning=_PARTITIONING if date_col is not None else None,
+        basename_template=f"{basename_prefix}-{uuid.uuid4().hex}-{{i}}.parquet",
+        file_options=ds.ParquetFileFormat().make_write_options(compression=COMPRESSION),
+        max_partitions=100_000,
+    )
+    # 空表不会产生任何文件，也要留下（空的）数据集目录
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    if not append:
+        replace_table(tmp_dir, path)
+        return
+
+    # 追加：逐个文件移动到目标分区目录
+    for root, _, files in os.walk(tmp_dir):
+        target = os.path.join(path, os.path.relpath(root, tmp_dir))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            os.replace(os.path.join(root, name), os.path.join(target, name))
+    shutil.rmtree(tmp_dir)
+
+
+def replace_table(src: str, path: str) -> None:
+    """整体替换：把已写好的数据集 src 改名到 path，再删除旧目录"""
+    old_dir = None
+    if os.path.exists(path):
+        old_dir = f"{os.path.normpath(path)}.old-{uuid.uuid4().hex}"
+        os.replace(path, old_dir)
+    os.replace(src, path)
+    if old_dir:
+        _remove(old_dir)
+
+
+def read_table(
+    path: str,
+    columns: list = None,
+    *,
+    filters=None,
+    dates=None,
+) -> pd.DataFrame:
+    """
+    读取 Parquet 数据集（.csv 路径按 CSV 读取，兼容原始下载文件）
+
+    参数
+    ----
+    columns : 只读取这些列；缺省读取全部数据列（不含分区列）
+    filters : pyarrow 表达式或 [(col, op, value), ...]，下推到 row group 统计信息
+    dates   : 只读取这些日期分区（YYYY-MM-DD 字符串 / date / Timestamp）
+    """
+    if str(path).endswith(".csv"):
+        return pd.read_csv(path, usecols=columns)
+
+    dataset = open_dataset(path)
+    expr = None
+    if filters is not None:
+        expr = (
+            pq.filters_to_expression(filters) if isinstance(filters, list) else filters
+        )
+    if dates is not None:
+        keys = [pd.Timestamp(d).strftime("%Y-%m-%d") for d in dates]
+        date_expr = ds.field(PARTITION_COL).isin(keys)
+        expr = date_expr if expr is None else expr & date_expr
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name != PARTITION_COL]
+    return dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+
+def read_partition(path: str, day, columns: list = None) -> pd.DataFrame:
+    """
+    只读取单个日期分区：直接打开 path/date_key=YYYY-MM-DD/，
+    逐日处理时不必每次都扫描整个数据集的目录与文件
+    """
+    key = pd.Timestamp(day).strftime("%Y-%m-%d")
+    part = os.path.join(path, f"{PARTITION_COL}={key}")
+    if not os.path.isdir(part):
+        return read_table(path, columns, dates=[key])
+    return ds.dataset(part, format="parquet").to_table(columns=columns).to_pandas()
+
+
+def open_dataset(path: str) -> ds.Dataset:
+    """打开数据集，自动识别是否按日期分区"""
+    return ds.dataset(
+        path,
+        format="parquet",
+        partitioning=_PARTITIONING if list_partitions(path) else None,
+    )
+
+
+def list_partitions(path: str) -> list:
+    """列出数据集已有的日期分区（只看目录名，不读文件）"""
+    if not os.path.isdir(path):
+        return []
+    prefix = f"{PARTITION_COL}="
+    return sorted(
+        name[len(prefix) :]
+        for name in os.listdir(path)
+        if name.startswith(prefix) and not name.endswith("__HIVE_DEFAULT_PARTITION__")
+    )
+
+
+def remove_table(path: str) -> None:
+    """删除数据集（目录或单个文件）"""
+    if os.path.exists(path):
+        _remove(path)
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
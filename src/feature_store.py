@@ -0,0 +1,209 @@
+"""
+在线特征存储（模拟 SageMaker Feature Store 的在线存储）
+
+由处理后的 NOAA 数据构建：
+    城市名 -> 坐标（常用城市表，其余交给 geocode.Geocoder 本地解析）-> 最近的若干气象站
+    按 (气象站, 日期) 索引、常驻内存的 18 维特征数组
+每次预测只做字典查找与数组切片，无需读盘或重新计算特征。
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from .etl.merge import EARTH_RADIUS_KM, FRSHTT_COLUMNS, flag_to_nan, frshtt_flags
+from .etl.storage import read_table
+from .geocode import Geocoder, parse_query
+
+NOAA_PATH = os.environ.get(
+    "AQI_NOAA_PATH",
+    os.path.join(
+        os.path.dirname(__file__),
+        "..",
+        "data/processed/NOAA_GSOD_US_2025_filtered.parquet",
+    ),
+)
+
+# 12 个气象观测 + 6 个天气现象标志 = 训练时使用的 18 个特征（与 train.py 保持一致）
+WEATHER_COLUMNS = [
+    "TEMP",
+    "DEWP",
+    "SLP",
+    "STP",
+    "VISIB",
+    "WDSP",
+    "MXSPD",
+    "GUST",
+    "MAX",
+    "MIN",
+    "PRCP",
+    "SNDP",
+]
+FEATURE_COLUMNS = WEATHER_COLUMNS + FRSHTT_COLUMNS
+
+# 常用城市坐标（演示用；其他城市可通过 cities 参数补充）
+DEFAULT_CITIES = {
+    "new york": (40.7128, -74.0060),
+    "los angeles": (34.0522, -118.2437),
+    "chicago": (41.8781, -87.6298),
+    "houston": (29.7604, -95.3698),
+    "phoenix": (33.4484, -112.0740),
+    "philadelphia": (39.9526, -75.1652),
+    "san antonio": (29.4241, -98.4936),
+    "san diego": (32.7157, -117.1611),
+    "dallas": (32.7767, -96.7970),
+    "san jose": (37.3382, -121.8863),
+    "austin": (30.2672, -97.7431),
+    "jacksonville": (30.3322, -81.6557),
+    "san francisco": (37.7749, -122.4194),
+    "columbus": (39.9612, -82.9988),
+    "indianapolis": (39.7684, -86.1581),
+    "seattle": (47.6062, -122.3321),
+    "denver": (39.7392, -104.9903),
+    "washington": (38.9072, -77.0369),
+    "boston": (42.3601, -71.0589),
+    "nashville": (36.1627, -86.7816),
+    "detroit": (42.3314, -83.0458),
+    "portland": (45.5152, -122.6784),
+    "las vegas": (36.1699, -115.1398),
+    "atlanta": (33.7490, -84.3880),
+    "miami": (25.7617, -80.1918),
+    "minneapolis": (44.9778, -93.2650),
+    "salt lake city": (40.7608, -111.8910),
+    "fresno": (36.7378, -119.7871),
+    "sacramento": (38.5816, -121.4944),
+    "new orleans": (29.9511, -90.0715),
+}
+
+
+class CityNotFoundError(KeyError):
+    """城市无法解析为坐标，或附近没有气象站"""
+
+    def __str__(self):
+        return str(self.args[0]) if self.args else ""
+
+
+def normalize_city(city: str) -> str:
+    """
+    统一城市名写法：小写、去多余空格；逗号后的州 / 国家保留为限定部分
+    （"Portland, OR" -> "portland, or"），同名城市不会共用缓存
+    """
+    return Geocoder.query_key(city)
+
+
+class FeatureStore:
+    def __init__(
+        self,
+        observations: pd.DataFrame,
+        cities: dict = None,
+        k_stations: int = 5,
+        max_distance_km: float = 100,
+        geocoder: Geocoder = None,
+    ):
+        """
+        参数
+        ----
+        observations    : NOAA 日观测，含 DATE / LATITUDE / LONGITUDE、
+                          12 个气象列以及 FRSHTT（或已展开的 6 个标志列）
+        cities          : 额外的 {城市名: (纬度, 经度)}，覆盖 DEFAULT_CITIES
+        k_stations      : 每个城市取最近的 k 个气象站，缺测时依次回退
+        max_distance_km : 超过该距离的气象站不用于该城市
+        geocoder        : 可选，解析城市表以外的城市名（只查本地地名库与缓存）
+        """
+        # 浅复制：后续只替换列，不改动调用方的数据
+        df = observations.copy(deep=False)
+        if "FRSHTT" in df.columns and not set(FRSHTT_COLUMNS) <= set(df.columns):
+            df = df.assign(**frshtt_flags(df["FRSHTT"]))
+        df = flag_to_nan(df)
+        # 缺坐标或缺日期的行丢弃：factorize 会把缺失值编码为 -1，
+        # 写入立方体时会落到最后一个气象站 / 日期上，覆盖真实数据
+        day = pd.to_datetime(df["DATE"]).dt.normalize()
+        valid = df[["LATITUDE", "LONGITUDE"]].notna().all(axis=1) & day.notna()
+        df, day = df[valid], day[valid]
+
+        # 气象站以坐标区分，日期统一成 date
+        station_codes, stations = pd.factorize(
+            pd.MultiIndex.from_arrays([df["LATITUDE"], df["LONGITUDE"]])
+        )
+        date_codes, dates = pd.factorize(day, sort=True)
+
+        # 常驻内存的特征立方体：[气象站, 日期, 特征]，缺测为 NaN
+        self.features = np.full(
+            (len(stations), len(dates), len(FEATURE_COLUMNS)), np.nan, dtype=np.float32
+        )
+        self.features[station_codes, date_codes] = df[FEATURE_COLUMNS].to_numpy(
+            dtype=np.float32
+        )
+        self.dates = dates.values.astype("datetime64[D]")
+        self.date_index = {d: i for i, d in enumerate(self.dates)}
+
+        station_coords = np.array(list(stations), dtype=float)
+        self.station_tree = BallTree(np.deg2rad(station_coords), metric="haversine")
+        self.k_stations = min(k_stations, len(stations))
+        self.max_distance_km = max_distance_km
+
+        self.cities = {normalize_city(k): v for k, v in DEFAULT_CITIES.items()}
+        self.cities.update({normalize_city(k): v for k, v in (cities or {}).items()})
+        self.geocoder = geocoder
+        self._city_stations = {}
+
+    @classmethod
+    def from_path(cls, path: str = NOAA_PATH, **kwargs) -> "FeatureStore":
+        """从处理后的 NOAA 数据集构建（只读取需要的列），默认启用本地地理编码"""
+        columns = ["DATE", "LATITUDE", "LONGITUDE", "FRSHTT"] + WEATHER_COLUMNS
+        observations = read_table(path, columns=columns)
+        kwargs.setdefault("geocoder", Geocoder.from_env())
+        return cls(observations, **kwargs)
+
+    def resolve_city(self, city: str):
+        """
+        城市名 -> (纬度, 经度)：先查城市表，再交给 geocoder；
+        带州 / 国家限定时优先 geocoder，无法解析再按不带限定的名称查城市表
+        """
+        key = normalize_city(city)
+        name, qualifier = parse_query(city)
+        coords = self.cities.get(key)
+        if coords is None and self.geocoder is not None:
+            coords = self.geocoder.resolve(city)
+        if coords is None and qualifier:
+            coords = self.cities.get(name)
+        return coords
+
+    def lookup_city(self, city: str) -> np.ndarray:
+        """城市名 -> 由近到远的气象站下标（结果缓存）"""
+        key = normalize_city(city)
+        stations = self._city_stations.get(key)
+        if stations is not None:
+            return stations
+
+        coords = self.resolve_city(city)
+        if coords is None:
+            raise CityNotFoundError(f"Unknown city: {city}")
+        dist, idx = self.station_tree.query(
+            np.deg2rad([coords]), k=self.k_stations, sort_results=True
+        )
+        stations = idx[0][dist[0] * EARTH_RADIUS_KM <= self.max_distance_km]
+        if len(stations) == 0:
+            raise CityNotFoundError(
+                f"No weather station within {self.max_distance_km} km of {city}"
+            )
+        self._city_stations[key] = stations
+        return stations
+
+    def _date_position(self, date) -> int:
+        """日期 -> 特征表中的列；超出已有数据时取此前最近一天（持续性假设）"""
+        day = np.datetime64(pd.Timestamp(date).date(), "D")
+        pos = self.date_index.get(day)
+        if pos is None:
+            pos = max(int(np.searchsorted(self.dates, day, side="right")) - 1, 0)
+        return pos
+
+    def get_features(self, city: str, date) -> np.ndarray:
+        """
+        返回 (city, date) 的 18 维特征，顺序同 FEATURE_COLUMNS。
+        每个特征取最近一个有观测的气象站，全部缺测时为 NaN。
+        """
+        block = self.features[self.lookup_city(city), self._date_position(date)]
+        first_valid = (~np.isnan(block)).argmax(axis=0)
+        return block[first_valid, np.arange(block.shape[1])]
@@ -0,0 +1,154 @@
+"""
+预计算预报表（模拟夜间批量推理 + DynamoDB 在线读取）
+
+受支持的城市与未来 N 天是已知的有限集合，训练或数据更新后用批任务一次性打分，
+写成按 (城市, 日期) 排序的 Parquet 文件；API 以内存映射方式读入并建成字典，
+请求只做一次字典查找，未命中（表外城市、超出天数、模型已更新）时才在线推理。
+    python -m src.forecast_table --days 7    # 建议每晚执行（或 python -m src.pipeline forecast --force）
+"""
+
+import argparse
+import os
+import time
+from datetime import date, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+FORECAST_TABLE_PATH = os.environ.get(
+    "AQI_FORECAST_TABLE",
+    os.path.join(os.path.dirname(__file__), "..", "data/processed/forecasts.parquet"),
+)
+FORECAST_DAYS = int(os.environ.get("AQI_FORECAST_DAYS", "7"))
+
+SCHEMA = pa.schema(
+    [
+        ("city", pa.string()),
+        ("date", pa.string()),
+        ("predicted_aqi", pa.float64()),
+        ("aqi_level", pa.dictionary(pa.int8(), pa.string())),
+    ]
+)
+
+
+def build_forecast_table(
+    predictor,
+    cities=None,
+    days: int = FORECAST_DAYS,
+    start: date = None,
+    path: str = FORECAST_TABLE_PATH,
+) -> int:
+    """
+    对 cities（默认特征存储中的全部城市）从 start（默认今天）起 days 天打分，
+    一次 predict_batch 完成；写出预报表并返回行数。无气象站的城市跳过
+    """
+    from .feature_store import normalize_city
+
+    store = predictor.feature_store
+    start = start or date.today()
+    names = sorted({normalize_city(c) for c in (cities or store.cities)})
+    dates = [(start + timedelta(days=i)).isoformat() for i in range(days)]
+    items = [(city, day) for city in names for day in dates]
+    results = predictor.predict_batch(items, return_exceptions=True)
+
+    rows = [r for r in results if not isinstance(r, Exception)]
+    skipped = sorted(
+        {city for (city, _), r in zip(items, results) if isinstance(r, Exception)}
+    )
+    table = pa.Table.from_pylist(
+        [
+            {
+                "city": normalize_city(r["city"]),
+                "date": r["date"],
+                "predicted_aqi": r["predicted_aqi"],
+                "aqi_level": r["aqi_level"],
+            }
+            for r in rows
+        ],
+        schema=SCHEMA,
+    ).replace_schema_metadata(
+        {
+            "model_version": predictor.model_version,
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "start": dates[0] if dates else "",
+            "days": str(days),
+        }
+    )
+
+    # 先写临时文件再替换，API 不会读到写了一半的表
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, path)
+    if skipped:
+        print(f"Skipped {len(skipped)} cities without forecasts: {', '.join(skipped)}")
+    return table.num_rows
+
+
+class ForecastTable:
+    """
+    常驻内存的预报表：(规范化城市名, YYYY-MM-DD) -> 预测结果。
+    文件以内存映射方式读取，之后只保留字典
+    """
+
+    def __init__(self, path: str = FORECAST_TABLE_PATH):
+        self.path = path
+        table = pq.read_table(path, memory_map=True)
+        meta = table.schema.metadata or {}
+        self.model_version = meta.get(b"model_version", b"").decode()
+        self.generated_at = meta.get(b"generated_at", b"").decode()
+        self.mtime = os.stat(path).st_mtime_ns
+        self.entries = {
+            (city, day): {"predicted_aqi": aqi, "aqi_level": level}
+            for city, day, aqi, level in zip(
+                table.column("city").to_pylist(),
+                table.column("date").to_pylist(),
+                table.column("predicted_aqi").to_pylist(),
+                table.column("aqi_level").to_pylist(),
+            )
+        }
+
+    @classmethod
+    def load(cls, path: str = FORECAST_TABLE_PATH):
+        """表不存在时返回 None"""
+        return cls(path) if os.path.exists(path) else None
+
+    def changed(self) -> bool:
+        """文件是否已被新一轮批任务替换"""
+        try:
+            return os.stat(self.path).st_mtime_ns != self.mtime
+        except FileNotFoundError:
+            return True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, city_key: str, day: str):
+        return self.entries.get((city_key, day))
+
+
+if __name__ == "__main__":
+    from .cache import PredictionCache
+    from .model import AQIPredictor
+
+    parser = argparse.ArgumentParser(description="Precompute the forecast table")
+    parser.add_argument("--days", type=int, default=FORECAST_DAYS)
+    parser.add_argument("--start", help="first date (YYYY-MM-DD), default today")
+    parser.add_argument("--cities", nargs="*", help="default: all supported cities")
+    parser.add_argument("--out", default=FORECAST_TABLE_PATH)
+    args = parser.parse_args()
+
+    # 批任务不读写在线缓存，也不使用已有的预报表
+    predictor = AQIPredictor(cache=PredictionCache(max_size=0), forecasts=False)
+    start_time = time.perf_counter()
+    n_rows = build_forecast_table(
+        predictor,
+        cities=args.cities,
+        days=args.days,
+        start=date.fromisoformat(args.start) if args.start else None,
+        path=args.out,
+    )
+    print(
+        f"Saved {n_rows} forecasts -> {args.out} "
+        f"in {time.perf_counter() - start_time:.1f}s ({predictor.model_version})"
+    )
@@ -1,51 +1,136 @@
+"""
+模拟 Amazon Bedrock 图像生成（仅用于本地演示）：Pillow 绘制的城市 AQI 卡片
+
+字体与背景模板在 CityImageRenderer 创建时加载一次，每张图只复制模板并绘制文字层，
+直接得到 PNG / WebP 字节，由 API 的 /image 接口返回；写入磁盘图片缓存是可选的后续步骤。
+"""
+
+import hashlib
+import io
 import os
+import threading
+from collections import OrderedDict
+
 from PIL import Image, ImageDraw, ImageFont
 
-IMAGE_DIR = os.path.join(os.path.dirname(__file__), "..", "frontend", "images")
-os.makedirs(IMAGE_DIR, exist_ok=True)
+from .image_cache import (
+    bucket_level,
+    bucket_range,
+    display_city,
+    get_image_cache,
+    image_key,
+)
 
+WIDTH, HEIGHT = 600, 400
+# 依次尝试的字体（可用 AQI_FONT_PATH / AQI_FONT_BOLD_PATH 指定），都不可用时使用 Pillow 内置字体
+FONT_PATHS = [
+    p for p in (os.environ.get("AQI_FONT_PATH"), "Arial.ttf", "DejaVuSans.ttf") if p
+]
+BOLD_FONT_PATHS = [
+    p
+    for p in (
+        os.environ.get("AQI_FONT_BOLD_PATH"),
+        "Arial Bold.ttf",
+        "DejaVuSans-Bold.ttf",
+    )
+    if p
+]
+# 内存中保留的已渲染图片数
+RENDER_CACHE_SIZE = int(os.environ.get("AQI_RENDER_CACHE_SIZE", "1024"))
+FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
 
-def get_or_generate_city_image(city: str, aqi: float, aqi_level: str) -> str:
+
+def load_font(candidates: list, size: int):
+    """按顺序尝试加载 TrueType 字体，失败时回退到内置字体"""
+    for path in candidates:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1：内置字体不支持缩放
+        return ImageFont.load_default()
+
+
+class CityImageRenderer:
     """
-    模拟 Amazon Bedrock 图像生成（仅用于本地演示）
-    实际云部署时替换为 Bedrock API 调用
+    模板渲染器：背景（底色与装饰线）只绘制一次，每次请求复制模板后绘制城市名与 AQI 等级。
+    图片上的文字只取决于图片键：城市名用 display_city，等级与区间用 bucket_level / bucket_range；
+    渲染结果按 (图片键, 格式) 保存在有上限的内存 LRU 中，附带用于 ETag 的内容哈希
     """
-    safe_name = "".join(c for c in city if c.isalnum() or c in (" ", "-", "_")).rstrip()
-    filename = f"{safe_name.lower().replace(' ', '_')}_aqi_{int(aqi)}.png"
-    filepath = os.path.join(IMAGE_DIR, filename)
 
-    if os.path.exists(filepath):
+    def __init__(self, cache_size: int = RENDER_CACHE_SIZE):
+        self.font_title = load_font(BOLD_FONT_PATHS, 48)
+        self.font_aqi = load_font(FONT_PATHS, 32)
+        self.template = Image.new("RGB", (WIDTH, HEIGHT), color=(240, 248, 255))
+        draw = ImageDraw.Draw(self.template)
+        draw.line([(50, 250), (WIDTH - 50, 250)], fill=(100, 100, 100), width=2)
+        self.cache_size = cache_size
+        self._rendered = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compose(self, city: str, aqi: float) -> Image.Image:
+        """在模板副本上绘制文字层（图片按区间缓存，不写具体数值与调用方的等级）"""
+        img = self.template.copy()
+        draw = ImageDraw.Draw(img)
+        aqi_text = f"{bucket_level(aqi)} (AQI {bucket_range(aqi)})"
+        for text, font, y, fill in (
+            (display_city(city), self.font_title, 80, (30, 30, 30)),
+            (aqi_text, self.font_aqi, 160, (50, 50, 50)),
+        ):
+            # 水平居中
+            bbox = draw.textbbox((0, 0), text, font=font)
+            draw.text(
+                ((WIDTH - (bbox[2] - bbox[0])) // 2, y), text, fill=fill, font=font
+            )
+        return img
+
+    def render(self, city: str, aqi: float, fmt: str = "png"):
+        """返回 (图片字节, ETag)；同一城市同一 AQI 等级只渲染一次"""
+        key = (image_key(city, aqi), fmt)
+        with self._lock:
+            hit = self._rendered.get(key)
+            if hit is not None:
+                self._rendered.move_to_end(key)
+                return hit
+        buf = io.BytesIO()
+        self.compose(city, aqi).save(buf, format=FORMATS[fmt][0])
+        data = buf.getvalue()
+        hit = (data, '"' + hashlib.sha1(data).hexdigest()[:20] + '"')
+        with self._lock:
+            self._rendered[key] = hit
+            while len(self._rendered) > self.cache_size:
+                self._rendered.popitem(last=False)
+        return hit
+
+    def persist(self, city: str, aqi: float) -> str:
+        """把 PNG 写入磁盘图片缓存（已存在则跳过），返回路径"""
+        cache = get_image_cache()
+        key = image_key(city, aqi)
+        filepath = cache.get(key)
+        if filepath is None:
+            filepath = cache.put_bytes(key, self.render(city, aqi)[0])
         return filepath
 
-    # 创建美观的占位图
-    width, height = 600, 400
-    img = Image.new("RGB", (width, height), color=(240, 248, 255))  # AliceBlue
-    draw = ImageDraw.Draw(img)
 
-    # 尝试加载更好的字体（可选）
-    try:
-        font_title = ImageFont.truetype("Arial Bold.ttf", 48)
-        font_aqi = ImageFont.truetype("Arial.ttf", 32)
-    except:
-        font_title = ImageFont.load_default()
-        font_aqi = ImageFont.load_default()
-
-    # 绘制城市名（居中）
-    bbox = draw.textbbox((0, 0), city, font=font_title)
-    text_width = bbox[2] - bbox[0]
-    x = (width - text_width) // 2
-    draw.text((x, 80), city, fill=(30, 30, 30), font=font_title)
-
-    # 绘制 AQI 信息
-    aqi_text = f"AQI: {aqi:.0f} ({aqi_level})"
-    bbox = draw.textbbox((0, 0), aqi_text, font=font_aqi)
-    text_width = bbox[2] - bbox[0]
-    x = (width - text_width) // 2
-    draw.text((x, 160), aqi_text, fill=(50, 50, 50), font=font_aqi)
-
-    # 添加装饰性元素（可选）
-    draw.line([(50, 250), (width - 50, 250)], fill=(100, 100, 100), width=2)
-
-    img.save(filepath)
-    print(f"[Demo] Mock image saved: {filepath}")
-    return filepath
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer() -> CityImageRenderer:
+    """进程内共享的渲染器（首次调用时加载字体与模板）"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = CityImageRenderer()
+        return _renderer
+
+
+def get_or_generate_city_image(city: str, aqi: float, aqi_level: str) -> str:
+    """
+    模拟 Amazon Bedrock 图像生成（仅用于本地演示）
+    实际云部署时替换为 Bedrock API 调用；同一城市同一 AQI 等级共用一张图，
+    图上的等级由 AQI 区间决定（aqi_level 仅为兼容保留）
+    """
+    return get_renderer().persist(city, aqi)
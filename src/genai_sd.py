@@ -1,59 +1,381 @@
+"""
+Stable Diffusion 城市图像生成（参考实现，默认不启用）
+
+CPU 上生成一张图需要数分钟，加载管线本身也要数十秒，因此由常驻的
+ImageGenerationService 负责：管线只在后台工作线程中加载一次，生成任务经队列串行执行；
+同一城市 / AQI 等级的并发请求合并为同一个任务。调用方立即拿到任务句柄或占位图，不会被阻塞。
+生成的图片存入 src/image_cache.py 的按 AQI 等级分桶、有大小预算的缓存。
+
+夜间预生成（城市 × AQI 等级，已缓存的跳过），每次管线调用渲染一批提示词：
+    python -m src.genai_sd --top 500 --batch-size 4 --steps 12 --scheduler dpm
+"""
+
+import argparse
 import os
-from diffusers import StableDiffusionPipeline
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from diffusers import (
+    DPMSolverMultistepScheduler,
+    EulerDiscreteScheduler,
+    StableDiffusionPipeline,
+)
 import torch
-from PIL import Image
+from PIL import Image, ImageDraw
+
+from .image_cache import (
+    IMAGE_DIR,
+    bucket_level,
+    bucket_samples,
+    display_city,
+    get_image_cache,
+    image_key,
+)
 
 # 使用开源模型
 MODEL_NAME = "stabilityai/stable-diffusion-2-1-base"
-IMAGE_DIR = os.path.join(os.path.dirname(__file__), "..", "frontend", "images")
+# CPU 生成参数，可通过环境变量调整
+SD_STEPS = int(os.environ.get("AQI_SD_STEPS", "20"))
+SD_BATCH_SIZE = int(os.environ.get("AQI_SD_BATCH_SIZE", "4"))
+SD_THREADS = int(os.environ.get("AQI_SD_THREADS", str(os.cpu_count() or 1)))
+# 采样器：default 为模型自带；dpm（DPM-Solver++）约 12 步即可达到默认 20 步的效果
+SD_SCHEDULER = os.environ.get("AQI_SD_SCHEDULER", "default")
+SCHEDULERS = {"dpm": DPMSolverMultistepScheduler, "euler": EulerDiscreteScheduler}
+PLACEHOLDER_PATH = os.path.join(IMAGE_DIR, "placeholder.png")
+# 等待生成的任务上限，超出时新任务直接失败（调用方继续使用占位图）
+IMAGE_QUEUE_SIZE = int(os.environ.get("AQI_IMAGE_QUEUE_SIZE", "32"))
 
 # 创建输出目录
 os.makedirs(IMAGE_DIR, exist_ok=True)
 
 
+def city_prompt(city: str, aqi_level: str) -> str:
+    """构造提示词（Prompt Engineering）"""
+    return (
+        f"A photorealistic view of {city} on a clear day, "
+        f"with clean air and blue sky, "
+        f"air quality: {aqi_level}, "
+        f"environmental health, high detail, 4k"
+    )
+
+
 class CityImageGenerator:
-    def __init__(self, use_cpu=True):
+    def __init__(
+        self,
+        use_cpu=True,
+        steps: int = SD_STEPS,
+        batch_size: int = SD_BATCH_SIZE,
+        scheduler: str = SD_SCHEDULER,
+        threads: int = SD_THREADS,
+    ):
+        """
+        参数
+        ----
+        steps      : 每张图的去噪步数
+        batch_size : 每次管线调用渲染的提示词数量
+        scheduler  : 采样器，default / dpm / euler
+        threads    : CPU 上 torch 使用的线程数
+        """
+        self.steps = steps
+        self.batch_size = max(1, batch_size)
         print(f"Loading {MODEL_NAME} (this may take a while on CPU)...")
         self.pipe = StableDiffusionPipeline.from_pretrained(
             MODEL_NAME,
             torch_dtype=torch.float16 if not use_cpu else torch.float32,
             safety_checker=None,  # 关闭安全检查以简化演示（生产环境应开启）
         )
+        if scheduler != "default":
+            self.pipe.scheduler = SCHEDULERS[scheduler].from_config(
+                self.pipe.scheduler.config
+            )
         if not use_cpu and torch.cuda.is_available():
             self.pipe = self.pipe.to("cuda")
         else:
+            torch.set_num_threads(threads)
             self.pipe = self.pipe.to("cpu")
+            # 注意力分片降低批量生成时的峰值内存；channels_last 让 CPU 卷积走更快的内存布局
+            self.pipe.enable_attention_slicing()
+            self.pipe.unet.to(memory_format=torch.channels_last)
+            self.pipe.vae.to(memory_format=torch.channels_last)
+        self.pipe.set_progress_bar_config(disable=True)
 
     def generate_image(self, city: str, aqi: float, aqi_level: str) -> str:
         """
         生成城市空气质量主题图，返回保存路径
         """
-        # 构造提示词（Prompt Engineering）
-        prompt = (
-            f"A photorealistic view of {city} on a clear day, "
-            f"with clean air and blue sky, "
-            f"AQI: {aqi:.0f} ({aqi_level}), "
-            f"environmental health, high detail, 4k"
+        filepath = self.generate_batch([(city, aqi, aqi_level)])[0]
+        print(f"Generated image saved to {filepath}")
+        return filepath
+
+    def generate_batch(self, items: list) -> list:
+        """
+        items 为 [(城市, AQI, 等级), ...]，每 batch_size 条一次管线调用；
+        提示词中的城市名与等级取 display_city / bucket_level，与图片键一致。
+        图片存入图片缓存（原子写入，超出预算时淘汰最久未用的图片），返回路径列表
+        """
+        cache = get_image_cache()
+        paths = []
+        for start in range(0, len(items), self.batch_size):
+            chunk = items[start : start + self.batch_size]
+            with torch.inference_mode():
+                images = self.pipe(
+                    [
+                        city_prompt(display_city(city), bucket_level(aqi))
+                        for city, aqi, _ in chunk
+                    ],
+                    num_inference_steps=self.steps,
+                ).images
+            for (city, aqi, _), image in zip(chunk, images):
+                paths.append(cache.put(image_key(city, aqi), image))
+        return paths
+
+
+class ImageJob:
+    """
+    生成任务句柄：status 为 pending / running / done / failed，
+    完成后 path 指向生成的图片；wait() 阻塞等待结果
+    """
+
+    def __init__(self, key: str, city: str, aqi: float, aqi_level: str):
+        self.key = key
+        self.city, self.aqi, self.aqi_level = city, aqi, aqi_level
+        self.path = get_image_cache().path(key)
+        self.status = "pending"
+        self.error = None
+        self.future = Future()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def wait(self, timeout: float = None) -> str:
+        """等待生成完成并返回图片路径；失败时抛出生成时的异常"""
+        return self.future.result(timeout)
+
+    def _finish(self, path: str = None, error: Exception = None) -> None:
+        if error is None:
+            self.status = "done"
+            self.future.set_result(path)
+        else:
+            self.status, self.error = "failed", error
+            self.future.set_exception(error)
+
+
+class ImageGenerationService:
+    """
+    常驻图像生成服务：一个后台线程、一个管线实例，任务按提交顺序生成，
+    队列中已有的任务（最多 batch_size 个）合并为一次管线调用。
+    管线在第一个任务到来时于工作线程中加载，提交方从不等待加载
+    """
+
+    def __init__(self, generator_factory=None, max_queue: int = IMAGE_QUEUE_SIZE):
+        """
+        参数
+        ----
+        generator_factory : 创建生成器的函数，默认 CityImageGenerator(use_cpu=True)
+        max_queue         : 等待中的任务上限
+        """
+        self.generator_factory = generator_factory or (
+            lambda: CityImageGenerator(use_cpu=True)
         )
+        self.generator = None
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        # 进行中（排队或生成中）的任务，按图片文件名去重
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._worker = None
+        self.generated = 0
+        self.failed = 0
 
-        # 生成图像
-        image = self.pipe(prompt, num_inference_steps=20).images[0]
+    def submit(self, city: str, aqi: float, aqi_level: str) -> ImageJob:
+        """
+        提交生成任务并立即返回句柄：图片已存在时返回已完成的任务，
+        相同城市 / AQI 等级的任务仍在进行时返回同一个句柄
+        """
+        key = image_key(city, aqi)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                return job
+            job = ImageJob(key, city, aqi, aqi_level)
+            path = get_image_cache().get(key)
+            if path is not None:
+                job._finish(path)
+                return job
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self.failed += 1
+                job._finish(error=RuntimeError("Image generation queue is full"))
+                return job
+            self._jobs[key] = job
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="image-generator", daemon=True
+                )
+                self._worker.start()
+        return job
 
-        # 保存
-        filename = f"{city.replace(' ', '_').lower()}_aqi_{int(aqi)}.png"
-        filepath = os.path.join(IMAGE_DIR, filename)
-        image.save(filepath)
-        print(f"Generated image saved to {filepath}")
-        return filepath
+    def get(self, city: str, aqi: float):
+        """返回进行中的任务，没有时返回 None"""
+        return self._jobs.get(image_key(city, aqi))
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.generator is not None,
+            "pending": len(self._jobs),
+            "generated": self.generated,
+            "failed": self.failed,
+        }
+
+    def _run(self) -> None:
+        while True:
+            jobs = [self._queue.get()]
+            try:
+                # 加载失败时本批任务失败，下一个任务重试加载
+                if self.generator is None:
+                    self.generator = self.generator_factory()
+                while len(jobs) < getattr(self.generator, "batch_size", 1):
+                    try:
+                        jobs.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for job in jobs:
+                    job.status = "running"
+                paths = self.generator.generate_batch(
+                    [(job.city, job.aqi, job.aqi_level) for job in jobs]
+                )
+            except Exception as e:
+                self.failed += len(jobs)
+                paths, error = [None] * len(jobs), e
+            else:
+                self.generated += len(jobs)
+                error = None
+            with self._lock:
+                for job in jobs:
+                    del self._jobs[job.key]
+            for job, path in zip(jobs, paths):
+                job._finish(path, error)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> ImageGenerationService:
+    """进程内共享的生成服务（首次调用时创建）"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ImageGenerationService()
+        return _service
+
+
+def placeholder_image() -> str:
+    """生成期间展示的通用占位图，首次使用时用 Pillow 绘制"""
+    if not os.path.exists(PLACEHOLDER_PATH):
+        img = Image.new("RGB", (600, 400), color=(240, 248, 255))
+        draw = ImageDraw.Draw(img)
+        draw.text((230, 190), "Generating image...", fill=(80, 80, 80))
+        tmp = f"{PLACEHOLDER_PATH}.tmp-{os.getpid()}"
+        img.save(tmp, format="PNG")
+        os.replace(tmp, PLACEHOLDER_PATH)
+    return PLACEHOLDER_PATH
 
 
 # 提供预生成图片回退机制
-def get_or_generate_city_image(city: str, aqi: float, aqi_level: str) -> str:
-    """优先返回已存在图片，避免重复生成（节省时间）"""
-    filename = f"{city.replace(' ', '_').lower()}_aqi_{int(aqi)}.png"
-    filepath = os.path.join(IMAGE_DIR, filename)
-    if os.path.exists(filepath):
+def get_or_generate_city_image(
+    city: str, aqi: float, aqi_level: str, wait: bool = False
+) -> str:
+    """
+    优先返回已存在图片；否则把生成任务交给后台服务，立即返回占位图路径。
+    wait=True 时阻塞到生成完成（例如命令行演示）
+    """
+    filepath = get_image_cache().get(image_key(city, aqi))
+    if filepath is not None:
         return filepath
+    job = get_service().submit(city, aqi, aqi_level)
+    if wait:
+        return job.wait()
+    return job.path if job.status == "done" else placeholder_image()
+
+
+def pregenerate(cities, generator_factory=None) -> dict:
+    """
+    为每个城市的每个 AQI 等级（bucket_samples）生成图片，已在缓存中的跳过；
+    全部命中时不加载管线。返回 {"generated": 张数, "cached": 张数, "seconds": 耗时}
+    """
+    cache = get_image_cache()
+    todo, cached = [], 0
+    for city in dict.fromkeys(cities):
+        for aqi, level in bucket_samples():
+            if cache.get(image_key(city, aqi)) is None:
+                todo.append((city, aqi, level))
+            else:
+                cached += 1
+    start = time.perf_counter()
+    if todo:
+        generator = (generator_factory or CityImageGenerator)()
+        for i in range(0, len(todo), generator.batch_size):
+            generator.generate_batch(todo[i : i + generator.batch_size])
+            done = min(i + generator.batch_size, len(todo))
+            elapsed = time.perf_counter() - start
+            print(f"  {done}/{len(todo)} images, {elapsed / done:.1f}s per image")
+    return {
+        "generated": len(todo),
+        "cached": cached,
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+
+
+def top_cities(n: int) -> list:
+    """本地地名库中人口最多的 n 个城市名"""
+    from .geocode import Gazetteer
+
+    gazetteer = Gazetteer.from_path()
+    order = sorted(
+        range(len(gazetteer.display)), key=lambda i: -gazetteer.population[i]
+    )
+    return list(dict.fromkeys(gazetteer.display[i] for i in order))[:n]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pregenerate city images for every AQI category"
+    )
+    parser.add_argument("--cities", nargs="*", help="city names")
+    parser.add_argument(
+        "--top", type=int, help="the N most populous cities in the gazetteer"
+    )
+    parser.add_argument("--batch-size", type=int, default=SD_BATCH_SIZE)
+    parser.add_argument("--steps", type=int, default=SD_STEPS)
+    parser.add_argument(
+        "--scheduler", choices=["default", *SCHEDULERS], default=SD_SCHEDULER
+    )
+    parser.add_argument("--threads", type=int, default=SD_THREADS)
+    args = parser.parse_args()
+
+    if args.cities:
+        cities = args.cities
+    elif args.top:
+        cities = top_cities(args.top)
     else:
-        generator = CityImageGenerator(use_cpu=True)
-        return generator.generate_image(city, aqi, aqi_level)
+        from .feature_store import DEFAULT_CITIES
+
+        cities = [city.title() for city in DEFAULT_CITIES]
+    result = pregenerate(
+        cities,
+        lambda: CityImageGenerator(
+            use_cpu=True,
+            steps=args.steps,
+            batch_size=args.batch_size,
+            scheduler=args.scheduler,
+            threads=args.threads,
+        ),
+    )
+    print(
+        f"Generated {result['generated']} images ({result['cached']} already cached) "
+        f"for {len(cities)} cities in {result['seconds']}s"
+    )
@@ -0,0 +1,395 @@
+"""
+城市名 -> 坐标（模拟 Amazon Location Service 的地名检索）
+
+请求路径只做本地查找，不会等待远程地理编码服务：
+    1. 进程内结果字典
+    2. 磁盘缓存（SQLite，进程间、重启后共用）
+    3. 本地地名库（GeoNames 导出文件）的哈希索引：规范化名称 -> 按人口排序的地点
+    4. 拼写纠错：只在开头两个字符相同、长度相近的名称中比较，相似度须明显高于阈值
+名称前缀（有序键 + 二分查找）只用于自动补全，不会把 "Los" 解析成 Los Angeles。
+远程地理编码（geopy / Nominatim）只在离线批量预热时使用，结果写入磁盘缓存：
+    python -m src.geocode download                 # 下载 GeoNames cities15000
+    python -m src.geocode warm cities.txt --remote # 批量解析并写入缓存
+    python -m src.geocode lookup "Portland, OR"
+"""
+
+import argparse
+import bisect
+import difflib
+import io
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+GAZETTEER_PATH = os.environ.get(
+    "AQI_GAZETTEER_PATH", os.path.join(DATA_DIR, "gazetteer", "cities15000.txt")
+)
+GEOCODE_CACHE_PATH = os.environ.get(
+    "AQI_GEOCODE_CACHE", os.path.join(DATA_DIR, "geocode_cache.sqlite")
+)
+# 拼写纠错接受的最低相似度（difflib ratio），越高越保守；低于它的相近名称不会用于预测
+FUZZY_CUTOFF = float(os.environ.get("AQI_GEOCODE_FUZZY_CUTOFF", "0.92"))
+# 参与拼写纠错的最短名称：短名称差一个字母往往就是另一座城市
+FUZZY_MIN_LENGTH = int(os.environ.get("AQI_GEOCODE_FUZZY_MIN_LENGTH", "5"))
+# 单次纠错最多比较的名称数，超过时放弃（批处理线程上不做大范围扫描）
+FUZZY_MAX_CANDIDATES = int(os.environ.get("AQI_GEOCODE_FUZZY_MAX_CANDIDATES", "2000"))
+# 进程内记住的已解析 / 无法解析的查询数上限（防止随意输入的名称撑大内存）
+MAX_RESOLVED = 100000
+MAX_UNRESOLVED = 10000
+GEONAMES_URL = "https://download.geonames.org/export/dump/cities15000.zip"
+
+# GeoNames 导出文件（制表符分隔、无表头）中用到的列
+GEONAMES_COLUMNS = {
+    1: "name",
+    2: "asciiname",
+    3: "alternatenames",
+    4: "latitude",
+    5: "longitude",
+    8: "country",
+    10: "admin1",
+    14: "population",
+}
+# 常见的国家写法 -> ISO 代码（其余按两位代码或州 / 省代码匹配）
+COUNTRY_ALIASES = {"usa": "US", "united states": "US", "uk": "GB", "england": "GB"}
+
+
+def normalize_name(name: str) -> str:
+    """小写、合并空白"""
+    return " ".join(str(name).lower().split())
+
+
+def parse_query(city: str):
+    """拆出限定部分："Portland, OR" -> ("portland", "or")，没有时为 ("portland", "")"""
+    name, _, qualifier = str(city).partition(",")
+    return normalize_name(name), normalize_name(qualifier)
+
+
+class Gazetteer:
+    """
+    内存地名索引：
+        names : 规范化名称（含别名）-> 地点下标数组（按人口由多到少）
+        keys  : 有序的全部名称，前缀查询用二分查找，相当于扁平化的 trie
+    """
+
+    def __init__(self, places: pd.DataFrame):
+        """
+        places : 每行一个地点，列 name / latitude / longitude，
+                 可选 asciiname / alternatenames（逗号分隔）/ country / admin1 / population
+        """
+        places = places.reset_index(drop=True)
+        self.lat = places["latitude"].to_numpy(dtype=float)
+        self.lon = places["longitude"].to_numpy(dtype=float)
+        self.display = places["name"].astype(str).to_numpy()
+        self.country = _column(places, "country")
+        self.admin1 = _column(places, "admin1")
+        self.population = (
+            places["population"].fillna(0).to_numpy(dtype=np.int64)
+            if "population" in places
+            else np.zeros(len(places), dtype=np.int64)
+        )
+
+        pairs = [
+            (normalize_name(name), i)
+            for col in ("name", "asciiname")
+            if col in places
+            for i, name in enumerate(places[col])
+            if isinstance(name, str) and name
+        ]
+        if "alternatenames" in places:
+            pairs += [
+                (normalize_name(alt), i)
+                for i, alts in enumerate(places["alternatenames"])
+                if isinstance(alts, str)
+                for alt in alts.split(",")
+                if alt
+            ]
+        index = pd.DataFrame(pairs, columns=["key", "place"]).drop_duplicates()
+        index["population"] = self.population[index["place"].to_numpy()]
+        index = index.sort_values(["key", "population"], ascending=[True, False])
+        # 已按名称排序：相邻名称不同处即为各组的起点
+        keys = index["key"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        self.keys = list(keys[starts])
+        self.key_length = np.fromiter(map(len, self.keys), dtype=np.int32)
+        self.names = dict(
+            zip(self.keys, np.split(index["place"].to_numpy(), starts[1:]))
+        )
+
+    @classmethod
+    def from_path(cls, path: str = GAZETTEER_PATH) -> "Gazetteer":
+        """读取 GeoNames 导出文件（.txt）或带表头的 CSV（name, latitude, longitude, ...）"""
+        if path.endswith(".csv"):
+            return cls(pd.read_csv(path, keep_default_na=False, na_values=[""]))
+        places = pd.read_csv(
+            path,
+            sep="\t",
+            header=None,
+            usecols=list(GEONAMES_COLUMNS),
+            names=range(19),
+            quoting=3,  # csv.QUOTE_NONE：地名中可能带引号
+            keep_default_na=False,
+            na_values=[""],
+            dtype={8: str, 10: str},
+        ).rename(columns=GEONAMES_COLUMNS)
+        return cls(places)
+
+    def __len__(self):
+        return len(self.display)
+
+    def _pick(self, places, qualifier: str):
+        """同名地点中取人口最多的；有限定部分时只取国家或州 / 省代码相符的"""
+        if not qualifier:
+            return int(places[0])
+        code = COUNTRY_ALIASES.get(qualifier, qualifier).upper()
+        for i in places:
+            if code in (self.country[i], self.admin1[i]):
+                return int(i)
+        return None
+
+    def lookup(self, name: str, qualifier: str = ""):
+        """规范化名称精确查找，返回地点下标或 None"""
+        places = self.names.get(name)
+        return None if places is None else self._pick(places, qualifier)
+
+    def prefix(self, prefix: str, limit: int = 10) -> list:
+        """以 prefix 开头的名称（按人口由多到少），用于自动补全"""
+        start = bisect.bisect_left(self.keys, prefix)
+        stop = bisect.bisect_left(self.keys, prefix + "\uffff")
+        keys = self.keys[start:stop]
+        keys.sort(key=lambda k: -self.population[self.names[k][0]])
+        return keys[:limit]
+
+    def fuzzy(self, name: str, qualifier: str = "", cutoff: float = None):
+        """
+        拼写纠错：在开头两个字符相同、长度相差不超过 1 的名称中找相似度不低于 cutoff
+        （默认 FUZZY_CUTOFF）的名称，同分时取人口多的。返回地点下标或 None。
+        名称过短或候选过多时直接放弃，不做整表扫描
+        """
+        cutoff = FUZZY_CUTOFF if cutoff is None else cutoff
+        if len(name) < FUZZY_MIN_LENGTH:
+            return None
+        start = bisect.bisect_left(self.keys, name[:2])
+        stop = bisect.bisect_left(self.keys, name[:2] + "\uffff")
+        near = np.flatnonzero(np.abs(self.key_length[start:stop] - len(name)) <= 1)
+        if len(near) > FUZZY_MAX_CANDIDATES:
+            return None
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(name)
+        scored = []
+        for i in near:
+            key = self.keys[start + i]
+            matcher.set_seq1(key)
+            if (
+                matcher.real_quick_ratio() >= cutoff
+                and matcher.quick_ratio() >= cutoff
+                and matcher.ratio() >= cutoff
+            ):
+                place = self._pick(self.names[key], qualifier)
+                if place is not None:
+                    scored.append((-matcher.ratio(), -self.population[place], place))
+        return min(scored)[2] if scored else None
+
+    def coords(self, place: int):
+        return float(self.lat[place]), float(self.lon[place])
+
+
+def _column(df: pd.DataFrame, col: str) -> np.ndarray:
+    if col not in df:
+        return np.full(len(df), "", dtype=object)
+    return df[col].fillna("").astype(str).str.upper().to_numpy()
+
+
+class GeocodeCache:
+    """
+    磁盘缓存（SQLite）：规范化查询 -> (纬度, 经度, 来源)。
+    连接按进程建立，预 fork 的 worker 不会共用父进程的连接
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn, self._pid = None, None
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS geocode_cache (
+                    query     TEXT PRIMARY KEY,
+                    latitude  REAL NOT NULL,
+                    longitude REAL NOT NULL,
+                    source    TEXT NOT NULL,
+                    added_at  REAL NOT NULL
+                )
+                """)
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, query: str):
+        with self._lock:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT latitude, longitude FROM geocode_cache WHERE query = ?",
+                    (query,),
+                )
+                .fetchone()
+            )
+        return None if row is None else (row[0], row[1])
+
+    def set_many(self, rows: list):
+        """rows: [(query, 纬度, 经度, 来源), ...]"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?, ?, ?)",
+                [(*row, now) for row in rows],
+            )
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class Geocoder:
+    def __init__(self, gazetteer: Gazetteer = None, cache: GeocodeCache = None):
+        """
+        参数
+        ----
+        gazetteer : 本地地名库索引；缺省时只查磁盘缓存
+        cache     : 磁盘缓存；远程预热的结果写入其中
+        """
+        self.gazetteer = gazetteer
+        self.cache = cache
+        self._resolved = {}  # 进程内：规范化查询 -> (纬度, 经度)，上限 MAX_RESOLVED
+        self._unresolved = set()  # 进程内：本地无法解析的查询，不再重复模糊匹配
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Geocoder":
+        """按环境变量构建；地名库文件不存在时只用磁盘缓存"""
+        gazetteer = None
+        if os.path.exists(GAZETTEER_PATH):
+            gazetteer = Gazetteer.from_path(GAZETTEER_PATH)
+        return cls(gazetteer=gazetteer, cache=GeocodeCache(GEOCODE_CACHE_PATH))
+
+    @staticmethod
+    def query_key(city: str) -> str:
+        name, qualifier = parse_query(city)
+        return f"{name}, {qualifier}" if qualifier else name
+
+    def resolve(self, city: str):
+        """城市名 -> (纬度, 经度)，只查本地；无法解析时返回 None"""
+        key = self.query_key(city)
+        coords = self._resolved.get(key)
+        if coords is not None or key in self._unresolved:
+            return coords
+
+        coords = self.cache.get(key) if self.cache else None
+        if coords is None and self.gazetteer is not None:
+            name, qualifier = parse_query(city)
+            place = self.gazetteer.lookup(name, qualifier)
+            if place is None:
+                # 纠错结果只记在进程内；磁盘缓存只收远程预热结果（精确查找本身就是哈希查表）
+                place = self.gazetteer.fuzzy(name, qualifier)
+            if place is not None:
+                coords = self.gazetteer.coords(place)
+        with self._lock:
+            if coords is not None:
+                if len(self._resolved) >= MAX_RESOLVED:
+                    self._resolved.clear()
+                self._resolved[key] = coords
+            else:
+                if len(self._unresolved) >= MAX_UNRESOLVED:
+                    self._unresolved.clear()
+                self._unresolved.add(key)
+        return coords
+
+    def warm(self, cities, remote: bool = False, min_delay_s: float = 1.0) -> dict:
+        """
+        离线批量解析，返回 {城市: (纬度, 经度) 或 None}。
+        remote=True 时本地无法解析的名称交给 Nominatim（按其使用政策每秒最多 1 次），
+        结果写入磁盘缓存，之后的请求只走本地
+        """
+        results = {city: self.resolve(city) for city in dict.fromkeys(cities)}
+        missing = [city for city, coords in results.items() if coords is None]
+        if remote and missing:
+            from geopy.geocoders import Nominatim
+
+            geolocator = Nominatim(user_agent="aqi-forecast-geocoder")
+            for city in missing:
+                location = geolocator.geocode(city, timeout=10)
+                if location is not None:
+                    coords = (location.latitude, location.longitude)
+                    results[city] = coords
+                    with self._lock:
+                        self._unresolved.discard(self.query_key(city))
+                        if len(self._resolved) >= MAX_RESOLVED:
+                            self._resolved.clear()
+                        self._resolved[self.query_key(city)] = coords
+                    if self.cache:
+                        self.cache.set_many([(self.query_key(city), *coords, "remote")])
+                time.sleep(min_delay_s)
+        return results
+
+
+def download_gazetteer(url: str = GEONAMES_URL, path: str = GAZETTEER_PATH) -> str:
+    """下载 GeoNames 城市导出文件并解压到 path"""
+    import requests
+
+    response = requests.get(url, timeout=120)
+    response.raise_for_status()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        name = next(n for n in archive.namelist() if n.endswith(".txt"))
+        with archive.open(name) as src, open(path, "wb") as dst:
+            dst.write(src.read())
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local geocoding utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("download", help="download the GeoNames gazetteer")
+    warm = sub.add_parser("warm", help="bulk-resolve city names into the cache")
+    warm.add_argument("file", help="text file with one city name per line")
+    warm.add_argument(
+        "--remote", action="store_true", help="use Nominatim for unresolved names"
+    )
+    lookup = sub.add_parser("lookup", help="resolve city names")
+    lookup.add_argument("cities", nargs="+")
+    complete = sub.add_parser("complete", help="prefix completion")
+    complete.add_argument("prefix")
+    args = parser.parse_args()
+
+    if args.command == "download":
+        print(f"Saved gazetteer -> {download_gazetteer()}")
+        sys.exit(0)
+
+    geocoder = Geocoder.from_env()
+    if args.command == "warm":
+        with open(args.file) as f:
+            cities = [line.strip() for line in f if line.strip()]
+        results = geocoder.warm(cities, remote=args.remote)
+        missing = [city for city, coords in results.items() if coords is None]
+        print(f"Resolved {len(results) - len(missing)}/{len(results)} names")
+        for city in missing:
+            print(f"  unresolved: {city}")
+    elif args.command == "lookup":
+        for city in args.cities:
+            print(f"{city}: {geocoder.resolve(city)}")
+    elif geocoder.gazetteer is not None:
+        print("\n".join(geocoder.gazetteer.prefix(normalize_name(args.prefix))))
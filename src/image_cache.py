@@ -0,0 +1,302 @@
+"""
+城市图像缓存（模拟 S3 + CloudFront 前的生成结果缓存）
+
+图片只随城市与 AQI 等级变化：键为 (城市, AQI 区间)，默认区间即 EPA 的 6 个等级，
+每个城市最多 6 张图，命中率接近 100%。磁盘上的图片受总大小预算约束，超出时按 LRU 淘汰；
+索引文件记录各图片的大小与访问顺序，命中时只查内存中的索引，不再逐次 os.path.exists。
+图片先写临时文件再原子替换，并发的 worker 不会读到写了一半的 PNG。
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows：只做进程内加锁
+    fcntl = None
+
+IMAGE_DIR = os.environ.get(
+    "AQI_IMAGE_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "frontend", "images"),
+)
+# 磁盘预算（MB），超出时淘汰最久未使用的图片
+IMAGE_CACHE_MAX_MB = float(os.environ.get("AQI_IMAGE_CACHE_MB", "512"))
+# 访问顺序写回索引文件的最短间隔（秒）
+INDEX_FLUSH_SECONDS = float(os.environ.get("AQI_IMAGE_INDEX_FLUSH_SECONDS", "30"))
+INDEX_NAME = "index.json"
+# 不受缓存管理的文件（生成期间的通用占位图）
+RESERVED_NAMES = {"placeholder.png"}
+
+# EPA 等级上界与对应的键名（与 model.aqi_to_level 一致）
+EPA_BREAKPOINTS = (50, 100, 150, 200, 300)
+EPA_BUCKETS = ("good", "moderate", "usg", "unhealthy", "very_unhealthy", "hazardous")
+EPA_LEVELS = (
+    "Good",
+    "Moderate",
+    "Unhealthy for Sensitive Groups",
+    "Unhealthy",
+    "Very Unhealthy",
+    "Hazardous",
+)
+# 自定义区间上界，逗号分隔，例如 "25,50,75,100,150,200,300"；未设置时使用 EPA 等级
+IMAGE_BUCKETS = os.environ.get("AQI_IMAGE_BUCKETS")
+
+
+def parse_buckets(spec: str = IMAGE_BUCKETS) -> tuple:
+    """区间上界，递增"""
+    if not spec:
+        return EPA_BREAKPOINTS
+    bounds = tuple(sorted({int(b) for b in spec.split(",") if b.strip()}))
+    if not bounds:
+        raise ValueError(f"No AQI bucket bounds in {spec!r}")
+    return bounds
+
+
+def aqi_bucket(aqi: float, bounds: tuple = None) -> str:
+    """AQI 所在区间的键名：EPA 等级为 good / moderate / ...，自定义区间为 aqi_51_100 形式"""
+    bounds = parse_buckets() if bounds is None else bounds
+    lo = 0
+    for i, hi in enumerate(bounds):
+        if aqi <= hi:
+            return EPA_BUCKETS[i] if bounds == EPA_BREAKPOINTS else f"aqi_{lo}_{hi}"
+        lo = hi + 1
+    return EPA_BUCKETS[-1] if bounds == EPA_BREAKPOINTS else f"aqi_{lo}_plus"
+
+
+def bucket_range(aqi: float, bounds: tuple = None) -> str:
+    """AQI 所在区间的文字描述，例如 "0-50" / "301+"，用于图片上的说明"""
+    bounds = parse_buckets() if bounds is None else bounds
+    lo = 0
+    for hi in bounds:
+        if aqi <= hi:
+            return f"{lo}-{hi}"
+        lo = hi + 1
+    return f"{lo}+"
+
+
+def bucket_sample(aqi: float, bounds: tuple = None) -> int:
+    """AQI 所在区间的代表值（与 bucket_samples 一致），同一区间的图片 URL 因此相同"""
+    bounds = parse_buckets() if bounds is None else bounds
+    for hi in bounds:
+        if aqi <= hi:
+            return hi
+    return bounds[-1] + 100
+
+
+def bucket_level(aqi: float, bounds: tuple = None) -> str:
+    """
+    图片上写的 EPA 等级：取区间代表值的等级，而不是具体 AQI 的等级，
+    同一区间（同一图片键）的图片内容因此只有一种
+    """
+    sample = bucket_sample(aqi, bounds)
+    return EPA_LEVELS[sum(sample > b for b in EPA_BREAKPOINTS)]
+
+
+def bucket_samples(bounds: tuple = None) -> list:
+    """每个区间取一个代表 AQI 及其 EPA 等级 [(AQI, 等级), ...]，用于预生成全部图片"""
+    bounds = parse_buckets() if bounds is None else bounds
+    uppers = [*bounds, bounds[-1] + 100]
+    return [(hi, bucket_level(hi, bounds)) for hi in uppers]
+
+
+def safe_city(city: str) -> str:
+    """文件名中的城市部分：只保留字母数字、空格、- 和 _，小写，空格换成 _"""
+    name = "".join(c for c in city if c.isalnum() or c in (" ", "-", "_")).rstrip()
+    return name.lower().replace(" ", "_")
+
+
+def display_city(city: str) -> str:
+    """
+    图片上写的城市名：由 safe_city 还原并按词首字母大写，
+    同一图片键（"los angeles" / "Los Angeles"）画出的名称只有一种
+    """
+    return safe_city(city).replace("_", " ").title()
+
+
+def image_key(city: str, aqi: float, bounds: tuple = None) -> str:
+    """图片文件名，例如 los_angeles_good.png"""
+    return f"{safe_city(city)}_{aqi_bucket(aqi, bounds)}.png"
+
+
+class _FileLock:
+    """跨进程互斥（flock），保护索引文件的读-改-写"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+class ImageCache:
+    """
+    有大小预算的磁盘图片缓存。
+    索引（文件名 -> 字节数，按访问先后排序）常驻内存，并写回目录下的 index.json；
+    其他进程写入新图片后，本进程在未命中时根据索引文件的修改时间重新合并
+    """
+
+    def __init__(
+        self,
+        directory: str = IMAGE_DIR,
+        max_mb: float = IMAGE_CACHE_MAX_MB,
+        flush_seconds: float = INDEX_FLUSH_SECONDS,
+    ):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.flush_seconds = flush_seconds
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self.entries = OrderedDict()
+        self._index_mtime = None
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        with self._lock, _FileLock(self.index_path + ".lock"):
+            if not self._read_index():
+                # 首次使用（或索引丢失）：扫描目录重建，已有图片按修改时间排序
+                self.entries = self._scan()
+                self._write_index()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str):
+        """命中时返回图片路径并刷新访问顺序，未命中返回 None"""
+        with self._lock:
+            if key not in self.entries and self._index_changed():
+                with _FileLock(self.index_path + ".lock"):
+                    self._read_index()
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if time.monotonic() - self._last_flush >= self.flush_seconds:
+                with _FileLock(self.index_path + ".lock"):
+                    self._read_index()
+                    self._write_index()
+        return self.path(key)
+
+    def put(self, key: str, image, format: str = "PNG") -> str:
+        """
+        原子写入图片（PIL.Image）并登记到索引，必要时淘汰最久未使用的图片；返回路径
+        """
+        tmp = self._tmp_path(key)
+        image.save(tmp, format=format)
+        return self._commit(key, tmp)
+
+    def put_bytes(self, key: str, data: bytes) -> str:
+        """同 put，内容为已编码的图片字节"""
+        tmp = self._tmp_path(key)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        return self._commit(key, tmp)
+
+    def _tmp_path(self, key: str) -> str:
+        return f"{self.path(key)}.tmp-{os.getpid()}-{threading.get_ident()}"
+
+    def _commit(self, key: str, tmp: str) -> str:
+        path = self.path(key)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        with self._lock, _FileLock(self.index_path + ".lock"):
+            self._read_index()
+            self.entries[key] = size
+            self.entries.move_to_end(key)
+            self._evict(keep=key)
+            self._write_index()
+        return path
+
+    def stats(self) -> dict:
+        return {
+            "images": len(self.entries),
+            "bytes": sum(self.entries.values()),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _evict(self, keep: str) -> None:
+        total = sum(self.entries.values())
+        for key in list(self.entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.entries.pop(key)
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def _scan(self) -> OrderedDict:
+        files = []
+        for entry in os.scandir(self.directory):
+            name = entry.name
+            if (
+                entry.is_file()
+                and name.endswith((".png", ".webp"))
+                and name not in RESERVED_NAMES
+            ):
+                st = entry.stat()
+                files.append((st.st_mtime_ns, name, st.st_size))
+        return OrderedDict((name, size) for _, name, size in sorted(files))
+
+    def _index_changed(self) -> bool:
+        try:
+            return os.stat(self.index_path).st_mtime_ns != self._index_mtime
+        except FileNotFoundError:
+            return False
+
+    def _read_index(self) -> bool:
+        """
+        合并磁盘上的索引：本进程已知的图片保留本地访问顺序，
+        其他进程新增的排在最后，已被其他进程淘汰的移除。索引不存在时返回 False
+        """
+        try:
+            with open(self.index_path) as f:
+                disk = OrderedDict(json.load(f)["entries"])
+            self._index_mtime = os.stat(self.index_path).st_mtime_ns
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+        merged = OrderedDict((k, disk[k]) for k in self.entries if k in disk)
+        for key, size in disk.items():
+            merged.setdefault(key, size)
+        self.entries = merged
+        return True
+
+    def _write_index(self) -> None:
+        tmp = f"{self.index_path}.tmp-{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump({"entries": list(self.entries.items())}, f)
+        os.replace(tmp, self.index_path)
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+        self._last_flush = time.monotonic()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageCache:
+    """进程内共享的图片缓存（首次调用时读取索引）"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache()
+        return _cache
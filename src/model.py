@@ -1,95 +1,241 @@
 import os
+import json
+import threading
+import time
+import numpy as np
 import pandas as pd
 from autogluon.tabular import TabularPredictor
 
+from .cache import PredictionCache, model_version
+from .feature_store import FEATURE_COLUMNS, FeatureStore, normalize_city
+from .forecast_table import FORECAST_TABLE_PATH, ForecastTable
+
 # 模拟从 "SageMaker Model Registry" 加载模型（实际为本地路径）
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "data/ag_models")
+MODEL_PATH = os.environ.get(
+    "AQI_MODEL_PATH", os.path.join(os.path.dirname(__file__), "..", "data/ag_models")
+)
+# 蒸馏后的单模型快速路径（python -m src.train --fast 导出）
+FAST_MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "data/ag_models_fast")
+FAST_MODEL_META = os.path.join(FAST_MODEL_PATH, "fast_model.json")
+# 是否优先使用快速模型，以及允许的 RMSE 相对上升（0.05 即最多比完整集成差 5%）
+USE_FAST_MODEL = os.environ.get("AQI_FAST_MODEL", "0") == "1"
+FAST_TOLERANCE = float(os.environ.get("AQI_FAST_TOLERANCE", "0.05"))
+# 每隔多少秒检查一次模型目录是否被更新（重新训练后自动重新加载）
+MODEL_CHECK_SECONDS = float(os.environ.get("AQI_MODEL_CHECK_SECONDS", "60"))
+
+
+def aqi_to_level(aqi):
+    """EPA AQI 等级映射"""
+    if aqi <= 50:
+        return "Good"
+    elif aqi <= 100:
+        return "Moderate"
+    elif aqi <= 150:
+        return "Unhealthy for Sensitive Groups"
+    elif aqi <= 200:
+        return "Unhealthy"
+    elif aqi <= 300:
+        return "Very Unhealthy"
+    else:
+        return "Hazardous"
+
+
+def fast_model_status(tolerance: float = FAST_TOLERANCE):
+    """
+    检查快速模型是否可用：已导出、由当前完整模型蒸馏而来、
+    且验证集 RMSE 相对完整集成的上升不超过 tolerance。
+    返回 (是否可用, 原因)
+    """
+    if not os.path.exists(FAST_MODEL_META):
+        return False, "no fast model exported"
+    with open(FAST_MODEL_META) as f:
+        meta = json.load(f)
+    if meta["teacher_version"] != model_version(MODEL_PATH):
+        return False, "fast model is stale (full model retrained since export)"
+    degradation = meta["fast_rmse"] / meta["teacher_rmse"] - 1
+    if degradation > tolerance:
+        return False, (
+            f"fast model RMSE {meta['fast_rmse']:.2f} is {degradation:.1%} worse "
+            f"than full ensemble {meta['teacher_rmse']:.2f} (tolerance {tolerance:.1%})"
+        )
+    return True, f"fast model {meta['model']} (RMSE +{degradation:.1%})"
 
 
 class AQIPredictor:
-    def __init__(self):
-        print(f"Loading model from {MODEL_PATH}...")
-        self.predictor = TabularPredictor.load(MODEL_PATH)
-        # self.feature_columns = self.predictor.feature_metadata_inferred.features
-        self.feature_columns = list(self.predictor.feature_metadata_in.get_features())
+    def __init__(
+        self,
+        feature_store: FeatureStore = None,
+        cache: PredictionCache = None,
+        fast: bool = USE_FAST_MODEL,
+        fast_tolerance: float = FAST_TOLERANCE,
+        forecasts: bool = True,
+        auto_reload: bool = True,
+    ):
+        """
+        参数
+        ----
+        fast           : 优先加载蒸馏后的快速模型，不满足精度要求时回退完整集成
+        fast_tolerance : 快速模型允许的验证集 RMSE 相对上升
+        forecasts      : 使用预计算的预报表（python -m src.forecast_table），命中时不推理
+        auto_reload    : 预测时节流检查模型与预报表并自动重新加载；预派生模式下关闭，
+                         由父进程 refresh 后重启 worker（见 serve.py）
+        """
+        self.fast = fast
+        self.auto_reload = auto_reload
+        self.fast_tolerance = fast_tolerance
+        self._reload_lock = threading.Lock()
+        self.reload()
+        self.use_forecasts = forecasts
+        self.forecasts = ForecastTable.load() if forecasts else None
+        # 在线特征存储：按城市与日期取真实气象特征
+        self.feature_store = feature_store or FeatureStore.from_path()
+        # 预测结果缓存，键为 (城市, 日期, 模型版本)
+        self.cache = cache or PredictionCache.from_env()
+
+    def reload(self) -> None:
+        """（重新）加载模型；版本号变化后旧的缓存条目不再命中"""
+        with self._reload_lock:
+            version = self._current_version()
+            model_path = MODEL_PATH
+            if self.fast:
+                use_fast, reason = fast_model_status(self.fast_tolerance)
+                print(("Using " if use_fast else "Not using fast model: ") + reason)
+                if use_fast:
+                    model_path = FAST_MODEL_PATH
+
+            print(f"Loading model from {model_path}...")
+            self.predictor = TabularPredictor.load(model_path)
+            if model_path == FAST_MODEL_PATH:
+                # 单个模型常驻内存，避免每次预测从磁盘加载
+                self.predictor.persist()
+            # self.feature_columns = self.predictor.feature_metadata_inferred.features
+            self.feature_columns = list(
+                self.predictor.feature_metadata_in.get_features()
+            )
+            self.model_path = model_path
+            self.model_version = f"{os.path.basename(model_path)}:{version}"
+            self._last_check = time.monotonic()
+            if getattr(self, "cache", None) is not None:
+                self.cache.clear()
+
+    def reload_due(self) -> bool:
+        """是否到了检查模型目录与预报表的时间（检查可能触发较慢的重新加载）"""
+        return (
+            self.auto_reload
+            and time.monotonic() - self._last_check >= MODEL_CHECK_SECONDS
+        )
+
+    def _reload_if_changed(self) -> None:
+        """节流检查模型目录与预报表，发现更新时重新加载"""
+        if not self.reload_due():
+            return
+        self._last_check = time.monotonic()
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """立即检查模型目录与预报表，有更新时重新加载；返回是否有更新"""
+        changed = False
+        if not self.model_version.endswith(f":{self._current_version()}"):
+            self.reload()
+            changed = True
+        if self.use_forecasts and (
+            self.forecasts.changed()
+            if self.forecasts is not None
+            else os.path.exists(FORECAST_TABLE_PATH)
+        ):
+            self.forecasts = ForecastTable.load()
+            changed = True
+        return changed
+
+    def _current_version(self) -> str:
+        """完整模型（及快速模式下的快速模型）目录的版本号"""
+        version = model_version(MODEL_PATH)
+        if self.fast:
+            version += "+" + model_version(FAST_MODEL_PATH)
+        return version
+
+    def forecast(self, city: str, date_str: str):
+        """
+        只查预报表、不推理；未命中，或表不是由当前加载的模型生成时返回 None。
+        日期先按原样查找，非 YYYY-MM-DD 写法再规范化后重试。
+        命中预报表同样触发节流的更新检查，持续命中时也能发现重新训练的模型与新的预报表
+        """
+        self._reload_if_changed()
+        table = self.forecasts
+        if table is None or table.model_version != self.model_version:
+            return None
+        city_key = normalize_city(city)
+        hit = table.get(city_key, date_str)
+        if hit is None:
+            try:
+                day = pd.Timestamp(date_str).strftime("%Y-%m-%d")
+            except (ValueError, TypeError):
+                return None
+            if day == date_str:
+                return None
+            hit = table.get(city_key, day)
+            if hit is None:
+                return None
+        return {"city": city, "date": date_str, **hit}
 
     def predict(self, city: str, date_str: str) -> dict:
         """
-        模拟推理：输入城市和日期，返回 AQI 预测及等级
+        推理：输入城市和日期，从特征存储取特征，返回 AQI 预测及等级
         """
-        # 实际项目中，应调用特征存储（Feature Store）或实时计算特征
-        # 为演示，构造一个符合训练 schema 的 dummy 样本
-        feature_cols = [
-            "TEMP",
-            "DEWP",
-            "SLP",
-            "STP",
-            "VISIB",
-            "WDSP",
-            "MXSPD",
-            "GUST",
-            "MAX",
-            "MIN",
-            "PRCP",
-            "SNDP",
-            "Fog",
-            "Rain",
-            "Snow",
-            "Hail",
-            "Thunder",
-            "Tornado",
-        ]
-        # 真实场景需有特征工程 pipeline，此处简化为 mock 数据
-        sample = pd.DataFrame(
-            [
-                {
-                    "city": city,
-                    "date": pd.to_datetime(date_str),
-                    "TEMP": 36.5,
-                    "DEWP": 33.1,
-                    "SLP": 1008.7,
-                    "STP": 969.2,
-                    "VISIB": 8.3,
-                    "WDSP": 12.9,
-                    "MXSPD": 20,
-                    "GUST": 26,
-                    "MAX": 48.9,
-                    "MIN": 26.1,
-                    "PRCP": 0.19,
-                    "SNDP": 0.0,
-                    "PRCP": 0.0,
-                    "Fog": 0,
-                    "Rain": 1,
-                    "Snow": 1,
-                    "Hail": 0,
-                    "Thunder": 0,
-                    "Tornado": 0,
-                }
-            ]
-        )
+        return self.predict_batch([(city, date_str)])[0]
+
+    def predict_batch(self, items, return_exceptions: bool = False) -> list:
+        """
+        批量推理：所有 (city, date) 拼成一张特征表，只调用一次 TabularPredictor.predict
+
+        参数
+        ----
+        items             : [(city, date_str), ...]
+        return_exceptions : 为 True 时单条失败不影响整批，该位置返回异常对象；
+                            否则直接抛出
+
+        返回与 items 顺序一致的结果列表；命中预报表或缓存的条目不再进入模型
+        """
+        self._reload_if_changed()
+        version = self.model_version
+
+        results = [None] * len(items)
+        rows, positions, keys = [], [], []
+        for i, (city, date_str) in enumerate(items):
+            hit = self.forecast(city, date_str)
+            if hit is not None:
+                results[i] = hit
+                continue
+            try:
+                day = pd.to_datetime(date_str)
+                key = (normalize_city(city), day.strftime("%Y-%m-%d"), version)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    results[i] = {**cached, "city": city, "date": date_str}
+                    continue
+                rows.append(self.feature_store.get_features(city, day))
+            except (KeyError, ValueError, TypeError) as e:
+                if not return_exceptions:
+                    raise
+                results[i] = e
+                continue
+            positions.append(i)
+            keys.append(key)
+
+        if not rows:
+            return results
+
+        # 一次性预测整批 AQI 数值
+        sample = pd.DataFrame(np.vstack(rows), columns=FEATURE_COLUMNS)
+        aqi_preds = self.predictor.predict(sample).to_numpy()
 
-        # 预测 AQI 数值
-        aqi_pred = self.predictor.predict(sample[feature_cols]).iloc[0]
-        # aqi_pred = self.predictor.predict(sample).iloc[0]
-
-        # EPA AQI 等级映射
-        def aqi_to_level(aqi):
-            if aqi <= 50:
-                return "Good"
-            elif aqi <= 100:
-                return "Moderate"
-            elif aqi <= 150:
-                return "Unhealthy for Sensitive Groups"
-            elif aqi <= 200:
-                return "Unhealthy"
-            elif aqi <= 300:
-                return "Very Unhealthy"
-            else:
-                return "Hazardous"
-
-        return {
-            "city": city,
-            "date": date_str,
-            "predicted_aqi": round(float(aqi_pred), 1),
-            "aqi_level": aqi_to_level(aqi_pred),
-        }
+        for i, key, aqi_pred in zip(positions, keys, aqi_preds):
+            city, date_str = items[i]
+            results[i] = {
+                "city": city,
+                "date": date_str,
+                "predicted_aqi": round(float(aqi_pred), 1),
+                "aqi_level": aqi_to_level(aqi_pred),
+            }
+            self.cache.set(key, results[i])
+        return results
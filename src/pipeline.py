@@ -0,0 +1,361 @@
+"""
+训练数据流水线：声明各 ETL / 训练阶段的输入与输出，按依赖关系调度执行
+
+    noaa_extract ─┐
+                  ├─> merge ─> train ─> forecast
+    openaq_extract ─> calc_aqi ─┘
+
+每个阶段的指纹 = 阶段代码（含其引用的 src 内模块）+ 输入文件内容的哈希。
+指纹与上次成功运行一致且输出仍在时跳过该阶段，例如只改 calc_aqi 不会触发重新下载；
+互不依赖的阶段（NOAA 与 OpenAQ 提取）并行执行。每个阶段以 `python -m <模块>`
+在独立子进程中运行，与手动执行 README 中的命令完全相同。在仓库根目录运行：
+    python -m src.pipeline                  # 执行所有过期的阶段
+    python -m src.pipeline merge --dry-run  # 只显示 merge 及其上游的执行计划
+    python -m src.pipeline calc_aqi --force # 强制重跑 calc_aqi（下游随之过期）
+    python -m src.pipeline forecast --force # 夜间任务：按当天日期重建预报表
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+STATE_PATH = os.environ.get(
+    "AQI_PIPELINE_STATE", os.path.join(ROOT, "data", ".pipeline_state.json")
+)
+PIPELINE_JOBS = int(os.environ.get("AQI_PIPELINE_JOBS", 2))
+
+NOAA_FILTERED = "data/processed/NOAA_GSOD_US_2025_filtered.parquet"
+OPENAQ_FILTERED = "data/processed/US_20250101_20260118_sensor_filtered.parquet"
+AQI_ADDED = "data/processed/US_sensor_with_aqi.parquet"
+MERGED = "data/processed/noaa_openaq_aqi.parquet"
+MERGED_FRSHTT = "data/processed/noaa_openaq_aqi_frshtt.parquet"
+
+
+class Stage:
+    """一个流水线阶段：模块名与相对仓库根目录的输入 / 输出路径"""
+
+    def __init__(self, name, module, inputs=(), outputs=(), args=()):
+        self.name = name
+        self.module = module
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.args = list(args)
+        self.deps = []
+
+    def command(self):
+        return [sys.executable, "-m", self.module, *self.args]
+
+
+# 路径与各模块 __main__ 中写死的路径一致
+STAGES = [
+    Stage("noaa_extract", "src.etl.noaa_extract", outputs=[NOAA_FILTERED]),
+    Stage("openaq_extract", "src.etl.openaq_extract", outputs=[OPENAQ_FILTERED]),
+    Stage(
+        "calc_aqi", "src.etl.calc_aqi", inputs=[OPENAQ_FILTERED], outputs=[AQI_ADDED]
+    ),
+    Stage(
+        "merge",
+        "src.etl.merge",
+        inputs=[NOAA_FILTERED, AQI_ADDED],
+        outputs=[MERGED, MERGED_FRSHTT],
+    ),
+    Stage(
+        "train",
+        "src.train",
+        inputs=[MERGED_FRSHTT],
+        outputs=[
+            "data/ag_models",
+            "data/ag_models_fast",
+            "data/processed/train_dataset.parquet",
+            "data/processed/val_dataset.parquet",
+        ],
+        # 同时导出蒸馏模型，否则 data/ag_models_fast 缺失，阶段每次都判为过期
+        args=["--fast"],
+    ),
+    # 预报表依赖日期，指纹不含当天日期，夜间任务需 --force
+    Stage(
+        "forecast",
+        "src.forecast_table",
+        inputs=[NOAA_FILTERED, "data/ag_models"],
+        outputs=["data/processed/forecasts.parquet"],
+    ),
+]
+
+
+def build_graph(stages):
+    """由输入 / 输出路径推出阶段间依赖，返回 {名称: Stage}"""
+    producers = {}
+    for stage in stages:
+        for path in stage.outputs:
+            producers[path] = stage.name
+    for stage in stages:
+        stage.deps = sorted({producers[p] for p in stage.inputs if p in producers})
+    return {stage.name: stage for stage in stages}
+
+
+def module_files(module):
+    """模块本身及其（递归）引用的 src 内模块的源文件"""
+    seen, pending = set(), [module]
+    while pending:
+        name = pending.pop()
+        path = os.path.join(ROOT, *name.split(".")) + ".py"
+        if name in seen or not os.path.exists(path):
+            continue
+        seen.add(name)
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=path)
+        package = name.rsplit(".", 1)[0]
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom):
+                if node.level:
+                    base = package.rsplit(".", node.level - 1)[0]
+                    base = f"{base}.{node.module}" if node.module else base
+                else:
+                    base = node.module or ""
+                # from .x import y 中的 y 也可能是模块
+                candidates = [base] + [f"{base}.{a.name}" for a in node.names]
+            elif isinstance(node, ast.Import):
+                candidates = [a.name for a in node.names]
+            else:
+                continue
+            pending += [c for c in candidates if c.split(".")[0] == "src"]
+    return sorted(os.path.join(ROOT, *n.split(".")) + ".py" for n in seen)
+
+
+class Hasher:
+    """
+    文件内容哈希，按 (路径, 大小, mtime) 缓存，
+    未变化的大文件不会被重复读取；目录按相对路径排序后逐个文件计入
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or {}
+        self.lock = threading.Lock()
+
+    def file(self, path):
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        with self.lock:
+            cached = self.cache.get(path)
+        if cached and cached[:2] == stamp:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with self.lock:
+            self.cache[path] = stamp + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def path(self, path):
+        """文件或目录的内容哈希；不存在时返回 None"""
+        if os.path.isfile(path):
+            return self.file(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                full = os.path.join(dirpath, name)
+                digest.update(os.path.relpath(full, path).encode())
+                digest.update(self.file(full).encode())
+        return digest.hexdigest()
+
+
+def fingerprint(stage, hasher):
+    """阶段代码 + 输入内容 + 命令参数的哈希；有输入缺失时返回 None"""
+    digest = hashlib.sha256(" ".join([stage.module, *stage.args]).encode())
+    for path in module_files(stage.module):
+        digest.update(os.path.relpath(path, ROOT).encode())
+        digest.update(hasher.file(path).encode())
+    for path in stage.inputs:
+        h = hasher.path(os.path.join(ROOT, path))
+        if h is None:
+            return None
+        digest.update(f"{path}={h}".encode())
+    return digest.hexdigest()
+
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {"stages": {}, "files": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_PATH):
+    # 先写临时文件再替换，中断时不会留下半个 JSON
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def stale_reason(stage, state, hasher):
+    """阶段需要执行的原因；是最新的则返回 None"""
+    record = state["stages"].get(stage.name)
+    if record is None:
+        return "never run"
+    for path in stage.outputs:
+        if hasher.path(os.path.join(ROOT, path)) != record["outputs"].get(path):
+            return f"output changed or missing: {path}"
+    key = fingerprint(stage, hasher)
+    if key is None:
+        return "inputs missing"
+    if key != record["fingerprint"]:
+        return "code or inputs changed"
+    return None
+
+
+def select(graph, targets):
+    """targets 及其全部上游阶段（保持声明顺序）"""
+    wanted, pending = set(), list(targets or graph)
+    while pending:
+        name = pending.pop()
+        if name not in wanted:
+            wanted.add(name)
+            pending += graph[name].deps
+    return [name for name in graph if name in wanted]
+
+
+def plan(graph, names, state, hasher, force=()):
+    """
+    按依赖顺序估计每个阶段是否需要执行（dry run 用）：
+    上游将要执行时，下游的输入尚不可知，视为过期
+    """
+    result = {}
+    for name in names:
+        stage = graph[name]
+        if name in force:
+            result[name] = "forced"
+        elif any(result.get(d) for d in stage.deps):
+            result[name] = "upstream will run"
+        else:
+            result[name] = stale_reason(stage, state, hasher)
+    return result
+
+
+def run_stage(stage, log_dir):
+    """以子进程执行阶段，输出写入日志文件，返回 (退出码, 耗时)"""
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"{stage.name}.log")
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        code = subprocess.call(
+            stage.command(), cwd=ROOT, stdout=log, stderr=subprocess.STDOUT
+        )
+    return code, time.perf_counter() - start
+
+
+def run(targets=None, force=(), jobs=PIPELINE_JOBS, dry_run=False, state_path=None):
+    """执行 targets（默认全部）及其上游中过期的阶段，返回是否全部成功"""
+    state_path = state_path or STATE_PATH
+    graph = build_graph(STAGES)
+    names = select(graph, targets)
+    state = load_state(state_path)
+    hasher = Hasher(state.setdefault("files", {}))
+    force = set(force)
+
+    if dry_run:
+        for name, reason in plan(graph, names, state, hasher, force).items():
+            print(f"{name:<16}{'run: ' + reason if reason else 'up to date'}")
+        return True
+
+    log_dir = os.path.join(ROOT, "results", "pipeline")
+    lock = threading.Lock()
+    done, failed = set(), set()
+    running = {}
+
+    def ready(name):
+        return name not in done | failed | set(running.values()) and all(
+            d in done for d in graph[name].deps
+        )
+
+    def finish(name, code, seconds):
+        stage = graph[name]
+        if code != 0:
+            print(
+                f"[{name}] failed (exit {code}) after {seconds:.1f}s, "
+                f"see {os.path.join(log_dir, name + '.log')}"
+            )
+            failed.add(name)
+            return
+        # 成功后记录指纹与输出哈希，下游据此判断是否过期
+        with lock:
+            state["stages"][name] = {
+                "fingerprint": fingerprint(stage, hasher),
+                "outputs": {
+                    p: hasher.path(os.path.join(ROOT, p)) for p in stage.outputs
+                },
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "seconds": round(seconds, 1),
+            }
+            save_state(state, state_path)
+        print(f"[{name}] done in {seconds:.1f}s")
+        done.add(name)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        while True:
+            for name in names:
+                if not ready(name):
+                    continue
+                reason = (
+                    "forced"
+                    if name in force
+                    else stale_reason(graph[name], state, hasher)
+                )
+                if reason is None:
+                    print(f"[{name}] up to date, skipped")
+                    done.add(name)
+                    continue
+                print(f"[{name}] running ({reason})")
+                running[pool.submit(run_stage, graph[name], log_dir)] = name
+            if not running and not any(ready(n) for n in names):
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                finish(running.pop(future), *future.result())
+
+    blocked = [n for n in names if n not in done | failed]
+    if blocked:
+        print(f"Not run because an upstream stage failed: {', '.join(blocked)}")
+    return not failed and not blocked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the AQI data pipeline")
+    parser.add_argument(
+        "stages",
+        nargs="*",
+        metavar="STAGE",
+        help="target stages (their upstream stages run as needed); default: all",
+    )
+    parser.add_argument(
+        "--force",
+        nargs="*",
+        metavar="STAGE",
+        help="rerun these stages even if up to date (no names: the targets)",
+    )
+    parser.add_argument("--jobs", type=int, default=PIPELINE_JOBS)
+    parser.add_argument("--dry-run", action="store_true", help="only print the plan")
+    args = parser.parse_args()
+    unknown = set(args.stages + (args.force or [])) - {s.name for s in STAGES}
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    if args.force is None:
+        force = []
+    else:
+        force = args.force or args.stages or [s.name for s in STAGES]
+    ok = run(args.stages, force=force, jobs=args.jobs, dry_run=args.dry_run)
+    sys.exit(0 if ok else 1)
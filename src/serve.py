@@ -0,0 +1,139 @@
+"""
+多进程预测服务（预派生，模型在 fork 前只加载一次）
+
+`uvicorn --workers N` 会让每个 worker 各自执行 TabularPredictor.load，
+整套集成模型（LightGBM / XGBoost / CatBoost / RF / NN）与特征存储在内存中复制 N 份。
+这里由父进程先加载模型与特征存储、绑定端口，再 fork 出 N 个 worker：
+模型内存页由各 worker 以写时复制（copy-on-write）方式共享，常驻内存不随 worker 数成倍增长。
+worker 不自行重新加载模型（否则每个 worker 各持一份私有副本）：父进程定期检查模型目录
+与预报表，有更新时在父进程中重新加载，再滚动重启 worker（先起新 worker，再停旧的）。
+
+用法（在仓库根目录）：
+    python -m src.serve --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from . import api
+from .model import MODEL_CHECK_SECONDS
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    # 显式指定 IPPROTO_TCP：asyncio 只对 proto 为 TCP 的连接设置 TCP_NODELAY，
+    # 否则 keep-alive 连接上的响应会被 Nagle 算法与延迟 ACK 拖慢约 40ms
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _spawn_worker(sock: socket.socket, log_level: str) -> int:
+    """fork 一个 worker，在共享的监听 socket 上运行 uvicorn"""
+    pid = os.fork()
+    if pid:
+        return pid
+
+    # 子进程：恢复默认信号处理，由 uvicorn 自行接管
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(api.app, log_level=log_level)
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+def serve(
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    workers: int = None,
+    log_level: str = "info",
+):
+    """
+    参数
+    ----
+    workers : worker 进程数，缺省为 CPU 核数
+    """
+    workers = workers or os.cpu_count() or 1
+
+    # 1. 父进程加载模型与特征存储（不做预测，避免在 fork 前初始化 OpenMP 线程池）
+    predictor = api.load_predictor()
+    predictor.auto_reload = False
+    # 2. 把已加载的对象移出 GC 跟踪，子进程的垃圾回收不再写这些对象所在的内存页
+    gc.collect()
+    gc.freeze()
+
+    sock = _bind(host, port)
+    children = {_spawn_worker(sock, log_level) for _ in range(workers)}
+    print(f"Serving on http://{host}:{port} with {workers} workers (pids {children})")
+
+    stopping = False
+
+    def _shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, _shutdown)
+    signal.signal(signal.SIGTERM, _shutdown)
+
+    # 3. 监督子进程：异常退出的 worker 重新 fork（仍共享父进程中的模型）；
+    #    模型或预报表更新时在父进程重新加载，再滚动替换全部 worker
+    retiring = set()
+    last_check = time.monotonic()
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.5)
+            if stopping or time.monotonic() - last_check < MODEL_CHECK_SECONDS:
+                continue
+            last_check = time.monotonic()
+            gc.unfreeze()
+            changed = predictor.refresh()
+            gc.collect()
+            gc.freeze()
+            if changed:
+                print(f"Model updated to {predictor.model_version}, restarting workers")
+                old = set(children) - retiring
+                children |= {_spawn_worker(sock, log_level) for _ in range(workers)}
+                for old_pid in old:
+                    retiring.add(old_pid)
+                    try:
+                        os.kill(old_pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+            continue
+        children.discard(pid)
+        if pid in retiring:
+            retiring.discard(pid)
+        elif not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting")
+            time.sleep(1)
+            children.add(_spawn_worker(sock, log_level))
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-forking AQI prediction server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.log_level)
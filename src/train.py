@@ -3,15 +3,19 @@ import sys
 import time
 import json
 import logging
+import argparse
 from datetime import datetime
 
-import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 from sklearn.metrics import mean_absolute_error, r2_score, mean_squared_error
 from sklearn.model_selection import train_test_split
 from autogluon.tabular import TabularPredictor
 
+from .cache import model_version
+from .etl.storage import open_dataset, read_table, write_table
+from .model import FAST_MODEL_PATH, FAST_MODEL_META, MODEL_PATH
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -22,79 +26,122 @@ logging.basicConfig(
 def setup_dirs():
     dirs = [
         os.path.join(os.path.dirname(__file__), "../data/processed/"),
-        os.path.join(os.path.dirname(__file__), "../data/ag_models/"),
+        MODEL_PATH,
         os.path.join(os.path.dirname(__file__), "../results/"),
     ]
     for d in dirs:
         os.makedirs(d, exist_ok=True)
 
 
-def read_and_split():
-    csv_path = os.path.join(
-        os.path.dirname(__file__), "../", "data/processed/noaa_openaq_aqi_frshtt.csv"
+def read_and_split(columns=None):
+    """读取融合后的数据集（只取需要的列），划分训练 / 验证集并留档"""
+    data_path = os.path.join(
+        os.path.dirname(__file__),
+        "../",
+        "data/processed/noaa_openaq_aqi_frshtt.parquet",
     )
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"Input data not found: {csv_path}")
+    if not os.path.exists(data_path):
+        raise FileNotFoundError(f"Input data not found: {data_path}")
+
+    # 验证列是否存在（只读 schema，不读数据）
+    available = open_dataset(data_path).schema.names
+    missing_cols = [col for col in columns or [] if col not in available]
+    if missing_cols:
+        raise ValueError(f"Missing columns in data: {missing_cols}")
 
-    df = pd.read_csv(csv_path)
+    df = read_table(data_path, columns=columns)
     train_df, val_df = train_test_split(df, test_size=0.15, random_state=42)
 
-    train_csv_path = os.path.join(
-        os.path.dirname(__file__), "../", "data/processed/train_dataset.csv"
+    # 划分结果留档备查，训练直接使用内存中的数据，不再回读
+    train_path = os.path.join(
+        os.path.dirname(__file__), "../", "data/processed/train_dataset.parquet"
     )
-    val_csv_path = os.path.join(
-        os.path.dirname(__file__), "../", "data/processed/val_dataset.csv"
+    val_path = os.path.join(
+        os.path.dirname(__file__), "../", "data/processed/val_dataset.parquet"
     )
-
-    train_df.to_csv(train_csv_path, index=False)
-    val_df.to_csv(val_csv_path, index=False)
+    write_table(train_df, train_path)
+    write_table(val_df, val_path)
     logging.info(
         f"Data split: {len(train_df)} train, {len(val_df)} validation samples."
     )
+    return train_df, val_df
 
 
-def main():
-    setup_dirs()
-    read_and_split()
+FEATURE_COLS = [
+    "TEMP",
+    "DEWP",
+    "SLP",
+    "STP",
+    "VISIB",
+    "WDSP",
+    "MXSPD",
+    "GUST",
+    "MAX",
+    "MIN",
+    "PRCP",
+    "SNDP",
+    "Fog",
+    "Rain",
+    "Snow",
+    "Hail",
+    "Thunder",
+    "Tornado",
+]
+LABEL_COL = "max_aqi"
+
 
-    # 1. 加载数据
-    train_dataset_path = os.path.join(
-        os.path.dirname(__file__), "../", "data/processed/train_dataset.csv"
+def export_fast_model(predictor, val_df, time_limit=60):
+    """
+    把多层集成蒸馏成单个 LightGBM 学生模型，导出到 data/ag_models_fast/，
+    并记录学生模型与完整集成在验证集上的 RMSE（AQIPredictor 据此判断是否可用）
+    """
+    y_true = val_df[LABEL_COL]
+    teacher = predictor.model_best
+    teacher_rmse = np.sqrt(mean_squared_error(y_true, predictor.predict(val_df)))
+
+    logging.info("Distilling ensemble into a single LightGBM model...")
+    students = predictor.distill(
+        time_limit=time_limit, hyperparameters={"GBM": {}}, teacher_preds="soft"
     )
-    val_dataset_path = os.path.join(
-        os.path.dirname(__file__), "../", "data/processed/val_dataset.csv"
+    # 蒸馏不改变线上默认使用的完整集成
+    predictor.set_model_best(teacher, save_trained=True)
+
+    scores = {
+        name: np.sqrt(mean_squared_error(y_true, predictor.predict(val_df, model=name)))
+        for name in students
+    }
+    student = min(scores, key=scores.get)
+    logging.info(
+        f"Fast model {student}: RMSE {scores[student]:.4f} "
+        f"(full ensemble {teacher_rmse:.4f})"
     )
-    train_df = pd.read_csv(train_dataset_path)
-    val_df = pd.read_csv(val_dataset_path)
-
-    feature_cols = [
-        "TEMP",
-        "DEWP",
-        "SLP",
-        "STP",
-        "VISIB",
-        "WDSP",
-        "MXSPD",
-        "GUST",
-        "MAX",
-        "MIN",
-        "PRCP",
-        "SNDP",
-        "Fog",
-        "Rain",
-        "Snow",
-        "Hail",
-        "Thunder",
-        "Tornado",
-    ]
-    label_col = "max_aqi"
 
-    # 验证列是否存在
-    missing_cols = [
-        col for col in feature_cols + [label_col] if col not in train_df.columns
-    ]
-    if missing_cols:
-        raise ValueError(f"Missing columns in data: {missing_cols}")
+    # 只保留学生模型及其依赖，作为独立的预测器导出
+    predictor.clone_for_deployment(
+        path=FAST_MODEL_PATH, model=student, dirs_exist_ok=True
+    )
+    meta = {
+        "timestamp": datetime.now().isoformat(),
+        "model": student,
+        "teacher_model": teacher,
+        "teacher_version": model_version(predictor.path),
+        "teacher_rmse": float(teacher_rmse),
+        "fast_rmse": float(scores[student]),
+    }
+    with open(FAST_MODEL_META, "w") as f:
+        json.dump(meta, f, indent=4)
+    logging.info(f"Fast model exported to {FAST_MODEL_PATH}")
+    return meta
+
+
+def main(export_fast=False):
+    setup_dirs()
+
+    feature_cols = FEATURE_COLS
+    label_col = LABEL_COL
+
+    # 1. 加载数据（列裁剪：只读特征与标签）
+    train_df, val_df = read_and_split(columns=feature_cols + [label_col])
 
     # 2. 模型配置
     hyperparams = {
@@ -105,10 +152,10 @@ def main():
         "NN_TORCH": {},
     }
 
-    model_save_path = os.path.join(os.path.dirname(__file__), "../", "data/ag_models/")
+    # 与服务端加载的路径一致（AQI_MODEL_PATH），蒸馏记录的教师版本才对得上
     predictor = TabularPredictor(
         label=label_col,
-        path=model_save_path,
+        path=MODEL_PATH,
         problem_type="regression",
         eval_metric="rmse",
     )
@@ -205,8 +252,34 @@ def main():
     # 10. 保存模型
     predictor.save()
     logging.info("Model saved successfully.")
+
+    # 11. （可选）导出蒸馏后的快速模型
+    if export_fast:
+        export_fast_model(predictor, val_df)
     print("Training and evaluation completed!")
 
 
+def export_fast_only():
+    """对已训练好的模型单独执行蒸馏导出（验证集划分与训练时一致）"""
+    _, val_df = read_and_split(columns=FEATURE_COLS + [LABEL_COL])
+    predictor = TabularPredictor.load(MODEL_PATH)
+    export_fast_model(predictor, val_df)
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Train the AQI model")
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="also distill and export a single-model fast path",
+    )
+    parser.add_argument(
+        "--fast-only",
+        action="store_true",
+        help="only distill/export the fast model from the trained ensemble",
+    )
+    args = parser.parse_args()
+    if args.fast_only:
+        export_fast_only()
+    else:
+        main(export_fast=args.fast)
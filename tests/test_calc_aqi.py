@@ -0,0 +1,100 @@
+"""calc_aqi_vectorized 与逐行 convert_to_aqi 的一致性"""
+
+import numpy as np
+import pytest
+
+from src.etl.calc_aqi import AQI_BREAKPOINTS, calc_aqi_vectorized, convert_to_aqi
+
+
+def _scalar(parameter, period, unit, value):
+    aqi = convert_to_aqi(parameter, period, unit, value)
+    return np.nan if aqi is None else float(aqi)
+
+
+def _assert_parity(parameter, period, unit, values):
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    got = calc_aqi_vectorized([parameter] * n, [period] * n, [unit] * n, values)
+    expected = np.array([_scalar(parameter, period, unit, v) for v in values])
+    mismatches = [
+        (v, e, g)
+        for v, e, g in zip(values, expected, got)
+        if not (e == g or (np.isnan(e) and np.isnan(g)))
+    ]
+    assert not mismatches, f"{parameter} {period} {unit}: {mismatches[:10]}"
+
+
+def _probe_values(rule: dict, scale: float) -> np.ndarray:
+    """断点两侧、截断网格上的点以及超出最后一档的浓度"""
+    step = 1 / scale
+    edges = [c for band in rule["bands"] for c in band[:2]]
+    edges += [rule.get("extend_from", edges[-1])]
+    around = [e + d for e in edges for d in (-step, -step / 2, 0, step / 2, step)]
+    top = max(edges)
+    grid = np.arange(0, top * 1.5 + step, step)
+    over = [top * 2, top * 10, top * 100]
+    return np.unique(np.concatenate([around, grid, over]).round(9))
+
+
+@pytest.mark.parametrize("key", sorted(AQI_BREAKPOINTS))
+def test_breakpoints_and_truncation_grid(key):
+    parameter, period = key
+    rule = AQI_BREAKPOINTS[key]
+    unit = "ppm" if rule["scale"] == 1000 else "µg/m³"
+    values = _probe_values(rule, rule["scale"])
+    if not rule["divide"]:
+        # so2 / no2：ppm 先乘 1000 换算成 ppb，断点按 ppb 给出
+        values = values / rule["scale"]
+    _assert_parity(parameter, period, unit, values)
+
+
+@pytest.mark.parametrize("parameter", ["so2", "no2"])
+def test_unit_conversion(parameter):
+    rule = AQI_BREAKPOINTS[(parameter, "01:00:00")]
+    ppb = _probe_values(rule, 1)
+    _assert_parity(parameter, "01:00:00", "ppb", ppb)
+    _assert_parity(parameter, "01:00:00", "ppm", ppb / 1000)
+
+
+def test_over_range_caps():
+    cases = [
+        ("o3", "08:00:00", "ppm", [0.2, 0.5, 5.0], [300, 300, 300]),
+        ("so2", "01:00:00", "ppb", [305, 1000, 1e6], [200, 200, 200]),
+    ]
+    for parameter, period, unit, values, expected in cases:
+        n = len(values)
+        got = calc_aqi_vectorized([parameter] * n, [period] * n, [unit] * n, values)
+        np.testing.assert_array_equal(got, expected)
+        _assert_parity(parameter, period, unit, values)
+
+
+def test_nan_and_unsupported_inputs():
+    got = calc_aqi_vectorized(
+        ["pm25", "o3", "so2", "pm25", "bc", "o3"],
+        ["24:00:00", "08:00:00", "01:00:00", "01:00:00", "24:00:00", "01:00:00"],
+        ["µg/m³", "ppm", "ppb", "µg/m³", "µg/m³", "ppm"],
+        [np.nan, np.nan, np.nan, 12.0, 3.0, 0.1],
+    )
+    # 缺测浓度（含 otherwise 有默认值的 o3 / so2）、不支持的组合、低于首档的 o3 1 小时
+    assert np.isnan(got).all()
+    assert convert_to_aqi("pm25", "01:00:00", "µg/m³", 12.0) is None
+    assert convert_to_aqi("bc", "24:00:00", "µg/m³", 3.0) is None
+    assert convert_to_aqi("o3", "01:00:00", "ppm", 0.1) is None
+
+
+def test_mixed_rows_match_row_by_row():
+    rng = np.random.default_rng(0)
+    keys = sorted(AQI_BREAKPOINTS)
+    n = 5000
+    picks = rng.integers(0, len(keys), n)
+    parameter = [keys[i][0] for i in picks]
+    period = [keys[i][1] for i in picks]
+    unit = rng.choice(["ppm", "ppb", "µg/m³"], n)
+    top = np.array([AQI_BREAKPOINTS[keys[i]]["bands"][-1][1] for i in picks])
+    value = rng.uniform(0, 1.3, n) * top
+    value[unit == "ppm"] /= np.where(
+        np.isin(np.array(parameter)[unit == "ppm"], ["so2", "no2"]), 1000, 1
+    )
+    got = calc_aqi_vectorized(parameter, period, unit, value)
+    expected = [_scalar(*row) for row in zip(parameter, period, unit, value)]
+    np.testing.assert_array_equal(got, expected)
@@ -0,0 +1,221 @@
+"""
+OpenAQ 下载器的限速与重试：本地桩服务器按脚本返回 429 / 503。
+openaq_extract 中的 time 换成假时钟，断言请求的等待时长而不是实际耗时。
+速率取 2 的幂，令牌计算在浮点下精确，不会出现极小的补差等待
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.etl import openaq_extract
+from src.etl.openaq_extract import (
+    OpenAQSensorDownloaderComplete,
+    TokenBucket,
+    parse_retry_after,
+)
+
+
+class FakeClock:
+    """替代 time 模块：sleep 只记录时长并推进时钟（至少 1 纳秒，同真实时钟）"""
+
+    def __init__(self, now: float = 1024.0):
+        self.now = now
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        with self._lock:
+            self.sleeps.append(seconds)
+            self.now += max(1e-9, seconds)
+
+
+class StubAPI:
+    """按路径预设的响应序列 [(状态码, 头), ...]，用完后返回 200；记录请求路径"""
+
+    def __init__(self):
+        self.scripts = {}
+        self.requests = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                api.requests.append(path)
+                script = api.scripts.get(path, [])
+                status, headers = script.pop(0) if script else (200, {})
+                body = b'{"results": []}'
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        )
+        self.thread.start()
+
+    def count(self, path: str) -> int:
+        return self.requests.count(path)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(openaq_extract, "time", fake)
+    # 退避抖动取 0，等待时长可精确断言
+    monkeypatch.setattr(openaq_extract.random, "random", lambda: 0.0)
+    return fake
+
+
+@pytest.fixture
+def stub():
+    api = StubAPI()
+    yield api
+    api.close()
+
+
+def _downloader(stub, **kwargs):
+    kwargs.setdefault("rate_per_sec", 1024)
+    kwargs.setdefault("backoff_base", 0.05)
+    return OpenAQSensorDownloaderComplete("test-key", base_url=stub.url, **kwargs)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    future = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 28 <= parse_retry_after(format_datetime(future, usegmt=True)) <= 30
+    past = datetime.now(timezone.utc) - timedelta(seconds=30)
+    assert parse_retry_after(format_datetime(past, usegmt=True)) == 0.0
+
+
+def test_429_retry_after_seconds(stub, clock):
+    stub.scripts["/locations"] = [(429, {"Retry-After": "7"})]
+    downloader = _downloader(stub)
+    response = downloader._get("/locations")
+    assert response.status_code == 200
+    assert stub.count("/locations") == 2
+    # 遵循 Retry-After，而不是 0.05 秒的退避；之后只剩取令牌的 1/rate 等待
+    assert clock.sleeps[0] == 7.0
+    assert clock.sleeps[1:] == [1 / 1024]
+    # 429 同时暂停了共享的令牌桶
+    assert downloader.rate_limiter.resume_at == pytest.approx(1024.0 + 7)
+
+
+def test_429_retry_after_http_date(stub, clock):
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    header = format_datetime(retry_at, usegmt=True)
+    stub.scripts["/locations"] = [(429, {"Retry-After": header})]
+    response = _downloader(stub)._get("/locations")
+    assert response.status_code == 200
+    assert stub.count("/locations") == 2
+    # HTTP 日期精确到秒
+    assert 28 < clock.sleeps[0] <= 30
+
+
+def test_503_exponential_backoff(stub, clock):
+    stub.scripts["/sensors/1"] = [(503, {}), (503, {}), (503, {})]
+    response = _downloader(stub, max_retries=5)._get("/sensors/1")
+    assert response.status_code == 200
+    assert stub.count("/sensors/1") == 4
+    # backoff_base * 2**attempt，抖动为 0
+    assert clock.sleeps == pytest.approx([0.05, 0.1, 0.2])
+
+
+def test_backoff_jitter(stub, clock, monkeypatch):
+    monkeypatch.setattr(openaq_extract.random, "random", lambda: 1.0)
+    stub.scripts["/sensors/1"] = [(503, {}), (503, {})]
+    _downloader(stub)._get("/sensors/1")
+    # 抖动上限为 1.5 倍
+    assert clock.sleeps == pytest.approx([0.075, 0.15])
+
+
+def test_gives_up_after_max_retries(stub, clock):
+    stub.scripts["/sensors/2"] = [(503, {})] * 10
+    response = _downloader(stub, max_retries=2)._get("/sensors/2")
+    assert response.status_code == 503
+    assert stub.count("/sensors/2") == 3
+    assert clock.sleeps == pytest.approx([0.05, 0.1])
+
+
+def test_quota_exhausted_pauses_all_requests(stub, clock):
+    stub.scripts["/locations"] = [
+        (200, {"x-ratelimit-remaining": "0", "x-ratelimit-reset": "4"})
+    ]
+    downloader = _downloader(stub)
+    downloader._get("/locations")
+    assert clock.sleeps == []
+    # 其他路径的请求也要等配额重置
+    downloader._get("/sensors/3")
+    assert clock.sleeps[0] == pytest.approx(4.0)
+    assert clock.sleeps == pytest.approx([4.0, 1 / 1024])
+
+
+def test_token_bucket_rate(clock):
+    bucket = TokenBucket(rate=16)
+    for _ in range(9):
+        bucket.acquire()
+    # 容量为 1：第一个令牌立即可用，之后每 1/16 秒一个
+    assert clock.sleeps == [1 / 16] * 8
+    assert clock.now == 1024.5
+
+
+def test_token_bucket_burst_capacity(clock):
+    bucket = TokenBucket(rate=8, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [1 / 8]
+
+
+def test_token_bucket_shared_across_threads(clock):
+    bucket = TokenBucket(rate=16)
+    times = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(4):
+            bucket.acquire()
+            with lock:
+                times.append(clock.monotonic())
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    times.sort()
+    assert len(times) == 12
+    # 三个线程合计也不超过 16 次/秒：第 k 个令牌最早在 k/16 秒时发放
+    for k, t in enumerate(times):
+        assert t >= 1024.0 + k / 16
+
+
+def test_downloader_rate_limit(stub, clock):
+    downloader = _downloader(stub, rate_per_sec=8)
+    for _ in range(6):
+        assert downloader._get("/locations").status_code == 200
+    assert stub.count("/locations") == 6
+    assert clock.sleeps == [1 / 8] * 5